@@ -5,30 +5,103 @@ Usage:
   python3 ds-agent.py "your task here"
   echo "your task" | python3 ds-agent.py
   python3 ds-agent.py --file task.txt
+  python3 ds-agent.py serve                  # warm daemon; send it tasks with ds-client.py
 
-Set DEEPSEEK_API_KEY env var or pass --key flag.
+Set DEEPSEEK_API_KEY env var or pass --key flag. DEEPSEEK_API_URL points the
+agent at another endpoint, e.g. the local ds-stub.py used by ds-bench.py.
 Working directory defaults to the anavi project root.
 """
 
 import sys
 import os
+import pty
 import json
+import codecs
+import uuid
+import select
+import socket
+import socketserver
+import signal
+import random
+import email.utils
+import tempfile
 import subprocess
 import glob as glob_module
 import re
+import shlex
+import bisect
+import fnmatch
+import hashlib
+import sqlite3
 import argparse
-import urllib.request
-import urllib.error
+import ssl
+import asyncio
+import weakref
+import contextvars
+import threading
+import time
+import http.client
+import urllib.parse
+from array import array
+from itertools import accumulate
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
 from pathlib import Path
 from typing import Any
 
 # ── Config ──────────────────────────────────────────────────────────────────
 
 PROJECT_ROOT = Path(__file__).parent.parent / "anavi"
-API_URL = "https://api.deepseek.com/v1/chat/completions"
+API_URL = os.environ.get("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 MODEL = "deepseek-chat"          # swap to "deepseek-reasoner" for hard tasks
 MAX_TURNS = 30
 MAX_OUTPUT_CHARS = 8000          # truncate long bash output
+STREAM = False                   # stream completions and start tools as their args arrive
+TOOL_WORKERS = 4                 # parallel read-only tool calls per agent
+RATE_RPM = 0                     # API requests per minute across all agents (0 = no cap)
+RATE_TPM = 0                     # API tokens per minute across all agents (0 = no cap)
+API_MAX_RETRIES = 6              # retries per call for 429, 5xx and network errors
+BACKOFF_BASE = 1.0               # seconds; jittered exponential backoff between retries...
+BACKOFF_MAX = 60.0               # ...capped here (Retry-After wins when the API sends one)
+BREAKER_THRESHOLD = 5            # consecutive failed calls that open the circuit
+BREAKER_COOLDOWN = 30.0          # seconds the circuit stays open before one probe call
+CONTEXT_BUDGET = 48_000          # prompt tokens before old tool results get compacted (0 = off)
+KEEP_RECENT_TURNS = 3            # turns whose tool results are never compacted
+COMPACT_ORDER = "largest"        # evict "largest" or "oldest" tool results first
+CHARS_PER_TOKEN = 4              # estimate for text the API hasn't counted yet
+FILE_CACHE_BYTES = 64 << 20      # memory cap for rendered read_file results
+LINE_INDEX_BYTES = 32 << 20      # memory cap for per-file line-offset indexes
+TEXT_CACHE_BYTES = 64 << 20      # memory cap for file contents grep has scanned
+SEARCH_CACHE_BYTES = 16 << 20    # memory cap for grep output and glob matches (each)
+READ_PAGE_LINES = 2000           # read_file without a limit returns at most this many lines...
+READ_PAGE_CHARS = 80_000         # ...and any read at most this many chars, then a continuation hint
+READ_MAX_LINE_CHARS = 2000       # longer lines (minified bundles) are cut
+GREP_MAX_MATCHES = 400           # grep stops after this many matching lines
+SEARCH_WORKERS = 8               # threads reading files for grep
+SKIP_DIRS = {".git", "node_modules", "dist", "build", ".pnpm-store", "__pycache__", ".next", "coverage"}
+PERSISTENT_SHELL = False         # keep one bash per agent (cwd/env survive between calls)
+BASH_TIMEOUT = 60                # seconds per bash command
+BASH_LOG_DIR = Path(tempfile.gettempdir()) / "ds-agent-logs"
+BASH_LOG_KEEP = 100              # spilled bash logs kept before the oldest are deleted
+TYPECHECK_WARM = True            # load tsserver when an agent starts, not at its first typecheck
+TYPECHECK_TIMEOUT = 120          # seconds; the first check waits for the project to load
+TYPECHECK_SERVER = None          # root -> checker elsewhere (ds-swarm --processes), else a local tsserver
+BASH_ERROR_PATTERNS = [          # lines kept from the middle of long bash output
+    r"error TS\d+", r"error:", r"Error\b", r"FAIL\b", r"failed\b", r"ERR!", r"panic\b",
+    r" at .+:\d+:\d+\)?$", r"Traceback \(most recent call last\)",
+]
+TREE_REFRESH_SECS = 2.0          # re-stat snapshot directories at most this often
+GREP_INDEX = True                # narrow grep candidates with the on-disk trigram index
+INDEX_DIR = Path.home() / ".cache" / "ds-agent"
+INDEX_REFRESH_SECS = 2.0         # rescan mtimes at most this often (our own writes apply at once)
+INDEX_MAX_FILE_BYTES = 1 << 20   # larger files are never indexed, always searched
+RESPONSE_CACHE = "off"           # "record", "replay" or "replay-or-record" chat() responses on disk
+RESPONSE_CACHE_DIR = INDEX_DIR / "responses"
+RESPONSE_CACHE_BYTES = 1 << 30   # least recently used responses are deleted past this
+TRACE_FILE = None                # append per-turn timing/token records here as JSON lines
+DAEMON_SOCKET = Path(os.environ.get("DS_AGENT_SOCKET", INDEX_DIR / "daemon.sock"))  # for `serve`
 
 SYSTEM_PROMPT = """You are an expert full-stack TypeScript engineer working on ANAVI, a B2B relationship intelligence platform.
 
@@ -43,7 +116,8 @@ Key conventions:
 - DB modules in server/db/*.ts, routers in server/routers/*.ts
 - Shared types in shared/types.ts, schema in drizzle/schema.ts
 
-Work methodically: read before editing, make minimal changes, verify with pnpm check after.
+Work methodically: read before editing, make minimal changes, verify each edit with the typecheck tool.
+It checks only the files you changed, not the files that import them, so run `pnpm check` once before you finish.
 """.format(root=PROJECT_ROOT)
 
 # ── Tool definitions ─────────────────────────────────────────────────────────
@@ -96,11 +170,55 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "multi_edit",
+            "description": "Apply several edit_file replacements to one file in order, all or nothing. "
+                           "Each edit sees the result of the previous ones; each old_string must be unique.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "edits": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "old_string": {"type": "string", "description": "Exact text to find and replace"},
+                                "new_string": {"type": "string", "description": "Replacement text"},
+                            },
+                            "required": ["old_string", "new_string"],
+                        },
+                    },
+                },
+                "required": ["path", "edits"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "apply_patch",
+            "description": "Apply a unified diff. Prefer this to rewriting a large file with write_file: "
+                           "send only the changed hunks. Hunks are located by their context (line numbers "
+                           "are hints, a bare @@ works too), tolerating whitespace differences; nothing is "
+                           "written unless every hunk applies. Use --- /dev/null to create a file.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "patch": {"type": "string", "description": "Unified diff, one or more files"},
+                    "path": {"type": "string", "description": "Target file when the diff has no ---/+++ headers"},
+                },
+                "required": ["patch"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
             "name": "bash",
-            "description": "Run a shell command. cwd defaults to project root (anavi/).",
+            "description": "Run a shell command. cwd defaults to project root (anavi/). Long output keeps the start, the end and error lines, and names a log file with the rest.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -115,12 +233,15 @@ TOOLS = [
         "type": "function",
         "function": {
             "name": "glob",
-            "description": "Find files matching a glob pattern.",
+            "description": "Find files matching a glob pattern. Skips node_modules, dist and "
+                           ".gitignored paths unless the pattern names them.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "pattern": {"type": "string", "description": "Glob pattern e.g. 'client/src/**/*.tsx'"},
                     "root": {"type": "string", "description": "Search root (optional, defaults to project root)"},
+                    "sort": {"type": "string", "enum": ["mtime", "path"],
+                             "description": "Order: most recently modified first (default) or by path"},
                 },
                 "required": ["pattern"],
             },
@@ -130,7 +251,8 @@ TOOLS = [
         "type": "function",
         "function": {
             "name": "grep",
-            "description": "Search file contents with a regex pattern.",
+            "description": "Search file contents with a Python regex. Skips node_modules, dist, "
+                           "binary and .gitignored files; results are grouped per file.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -143,8 +265,1157 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "typecheck",
+            "description": "TypeScript diagnostics from a warm tsserver, in under a second. With no "
+                           "files, checks the .ts/.tsx files changed since your last typecheck. Files "
+                           "that import them are not checked: run `pnpm check` before finishing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {"type": "array", "items": {"type": "string"},
+                              "description": "Files to check instead of the changed ones (optional)"},
+                    "root": {"type": "string", "description": "Directory inside the project (default anavi/)"},
+                },
+            },
+        },
+    },
 ]
 
+# ── Caches ────────────────────────────────────────────────────────────────────
+
+class LRUCache:
+    """Thread-safe LRU map with a byte budget, shared by every agent in the process."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()                # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def discard(self, pred):
+        """Drop every entry whose key satisfies pred(key)."""
+        with self._lock:
+            for key in [k for k in self._data if pred(k)]:
+                self.bytes -= self._data.pop(key)[1]
+
+    def summary(self) -> str:
+        return (f"{self.hits} hits, {self.misses} misses, "
+                f"{len(self._data)} entries / {self.bytes >> 10} KiB")
+
+
+# read_file results keyed by (path, mtime_ns, size, offset, limit): any
+# change to the file changes the key, so stale entries just age out. Our
+# own writes also drop the path outright, in case they land within the
+# filesystem's mtime granularity without changing the size.
+FILE_CACHE = LRUCache(FILE_CACHE_BYTES)
+
+
+class LineIndex:
+    """Byte offset of every line start in one version of a file, so a
+    read_file range costs a seek and a read of just that range."""
+
+    def __init__(self, path: Path):
+        starts = array("Q", [0])
+        pos = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                parts = chunk.split(b"\n")
+                starts.extend(pos + end for end in accumulate(len(p) + 1 for p in parts[:-1]))
+                pos += len(chunk)
+        self.size = pos
+        self.starts = starts
+        # a final line without a trailing newline still counts
+        self.lines = len(starts) - (starts[-1] == pos)
+
+    def span(self, start: int, end: int) -> tuple:
+        """Byte range of lines [start, end)."""
+        return self.starts[start], (self.starts[end] if end < len(self.starts) else self.size)
+
+
+# keyed by (path, mtime_ns, size) like FILE_CACHE; 8 bytes per line
+LINE_INDEX = LRUCache(LINE_INDEX_BYTES)
+
+
+def line_index(p: Path, st: os.stat_result) -> LineIndex:
+    key = (str(p), st.st_mtime_ns, st.st_size)
+    index = LINE_INDEX.get(key)
+    if index is None:
+        index = LineIndex(p)
+        LINE_INDEX.put(key, index, len(index.starts) * 8)
+    return index
+
+
+# decoded contents of files grep scanned (False for binary files), keyed by
+# (path, mtime_ns, size) like FILE_CACHE, so agents grepping the same hot
+# files read each version from disk once
+TEXT_CACHE = LRUCache(TEXT_CACHE_BYTES)
+
+# grep output, for searches the trigram index narrowed, keyed by its
+# arguments plus a digest of the (path, mtime_ns, size) of every candidate
+# file (see _versions), and glob matches (paths only; tool_glob stats them
+# for mtime order) keyed by the pattern plus the TREE version. Whoever
+# changed a file, an agent's edit or a bash command, the next lookup
+# computes a different key for exactly the results that depended on it.
+GREP_CACHE = LRUCache(SEARCH_CACHE_BYTES)
+GLOB_CACHE = LRUCache(SEARCH_CACHE_BYTES)
+
+
+def _under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root + os.sep)
+
+
+def invalidate_file(p: Path):
+    path = str(p)
+    FILE_CACHE.discard(lambda k: k[0] == path)
+    LINE_INDEX.discard(lambda k: k[0] == path)
+    TEXT_CACHE.discard(lambda k: k[0] == path)
+    GREP_CACHE.discard(lambda k: _under(path, k[1]))
+    TRIGRAM_INDEX.mark_dirty(path)
+    TREE.mark_stale()
+
+# ── Code search ───────────────────────────────────────────────────────────────
+
+class IgnoreRules:
+    """The subset of .gitignore semantics agents run into: globs, dir/ suffixes,
+    /anchored and **/ patterns, and ! negation (last match wins)."""
+
+    def __init__(self, rules: tuple = ()):
+        self.rules = rules                        # (base, pattern, negate, dir_only, anchored)
+        # Without negations the order doesn't matter, so every basename rule
+        # folds into one regex and the anchored ones into one per directory.
+        self._ordered = any(r[2] for r in rules)
+        if not self._ordered:
+            def fold(patterns):
+                return re.compile("|".join(patterns)) if patterns else None
+            self._names = fold([r[1] for r in rules if not r[4] and not r[3]])
+            self._dir_names = fold([r[1] for r in rules if not r[4] and r[3]])
+            bases = {}
+            for base, pattern, _, dir_only, anchored in rules:
+                if anchored:
+                    bases.setdefault((base, dir_only), []).append(pattern)
+            self._anchored = [(base, dir_only, fold(ps)) for (base, dir_only), ps in bases.items()]
+
+    def child(self, directory: str) -> "IgnoreRules":
+        """Rules for entries of directory, adding its own .gitignore if present."""
+        try:
+            text = Path(directory, ".gitignore").read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return self
+        added = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            line = line.lstrip("!")
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if line.startswith("**/"):
+                line, anchored = line[3:], False
+            added.append((directory, fnmatch.translate(line), negate, dir_only, anchored))
+        return IgnoreRules(self.rules + tuple(added)) if added else self
+
+    def ignored(self, path: str, name: str, is_dir: bool) -> bool:
+        if not self._ordered:
+            if self._names and self._names.match(name):
+                return True
+            if is_dir and self._dir_names and self._dir_names.match(name):
+                return True
+            for base, dir_only, rx in self._anchored:
+                if (is_dir or not dir_only) and rx.match(os.path.relpath(path, base).replace(os.sep, "/")):
+                    return True
+            return False
+        result = False
+        for base, pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            target = os.path.relpath(path, base).replace(os.sep, "/") if anchored else name
+            if re.match(pattern, target):
+                result = not negate
+        return result
+
+
+def _root_ignore_rules(root: str) -> IgnoreRules:
+    """Ignore rules from every .gitignore between the repo root and root."""
+    chain = []
+    d = os.path.abspath(root)
+    while True:
+        chain.append(d)
+        if os.path.isdir(os.path.join(d, ".git")) or os.path.dirname(d) == d:
+            break
+        d = os.path.dirname(d)
+    rules = IgnoreRules()
+    for d in reversed(chain[1:]):
+        rules = rules.child(d)
+    return rules
+
+
+def iter_files(root: str, file_glob: str = None):
+    """Yield files under root in sorted order, skipping SKIP_DIRS, ignored paths
+    and non-matching names. An explicitly named root is always searched."""
+    if os.path.isfile(root):
+        yield root
+        return
+
+    def walk(directory, rules):
+        rules = rules.child(directory)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            return
+        for entry in entries:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and entry.name in SKIP_DIRS:
+                continue
+            if rules.ignored(entry.path, entry.name, is_dir):
+                continue
+            if is_dir:
+                yield from walk(entry.path, rules)
+            elif entry.is_file() and (not file_glob or fnmatch.fnmatch(entry.name, file_glob)):
+                yield entry.path
+
+    yield from walk(root, _root_ignore_rules(root))
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str):
+    return re.compile(pattern)
+
+
+def _file_text(path: str):
+    """Decoded contents of path through TEXT_CACHE; False for a binary file, None if unreadable."""
+    try:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        text = TEXT_CACHE.get(key)
+        if text is not None:
+            return text
+        with open(path, "rb") as f:
+            data = f.read(8192)
+            if b"\0" in data:
+                text = False                      # binary
+            else:
+                text = (data + f.read()).decode("utf-8", errors="replace")
+    except OSError:
+        return None
+    TEXT_CACHE.put(key, text, len(text) if text else 64)
+    return text
+
+
+def _versions(paths) -> str:
+    """Digest of the (path, mtime_ns, size) of every file in paths."""
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        h.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return h.hexdigest()
+
+
+def _search_file(path: str, rx, context: int):
+    """Return [(lineno, text, is_match)] for one file, or None if nothing matches."""
+    text = _file_text(path)
+    if not text or not rx.search(text):
+        return None                               # one C-level scan rules out most files
+    lines = text.splitlines()
+    hits = [i for i, line in enumerate(lines) if rx.search(line)]
+    if not hits:
+        return None
+    wanted = set()
+    for i in hits:
+        wanted.update(range(max(i - context, 0), min(i + context + 1, len(lines))))
+    hit_set = set(hits)
+    return [(i + 1, lines[i], i in hit_set) for i in sorted(wanted)]
+
+
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+
+
+def search(pattern: str, root: str, file_glob: str = None, context: int = 0,
+           max_matches: int = GREP_MAX_MATCHES, files=None):
+    """Stream (path, lines) groups for files matching pattern, in path order.
+
+    Files are read and scanned on a shared thread pool in small batches, so
+    the walk stops soon after max_matches matching lines have been yielded.
+    files overrides the directory walk with an explicit candidate list.
+    """
+    rx = _compile(pattern)
+    paths = iter(files if files is not None else iter_files(root, file_glob))
+    found = 0
+    while found < max_matches:
+        batch = [p for _, p in zip(range(SEARCH_WORKERS * 4), paths)]
+        if not batch:
+            return
+        for path, lines in zip(batch, _search_pool.map(lambda p: _search_file(p, rx, context), batch)):
+            if lines:
+                yield path, lines
+                found += sum(1 for line in lines if line[2])
+                if found >= max_matches:
+                    return
+
+
+def _display_path(path: str) -> str:
+    try:
+        return str(Path(path).relative_to(PROJECT_ROOT))
+    except ValueError:
+        return path
+
+# ── Tree snapshot ─────────────────────────────────────────────────────────────
+
+def _glob_segment(seg: str) -> str:
+    out = []
+    i = 0
+    while i < len(seg):
+        c = seg[i]
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and (j := seg.find("]", i + 2)) != -1:
+            body = seg[i + 1:j].replace("\\", "\\\\")
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+            i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    # like glob, wildcards never match a leading dot
+    return ("" if seg.startswith(".") else "(?!\\.)") + "".join(out)
+
+
+@lru_cache(maxsize=256)
+def _glob_regex(pattern: str):
+    """Compile a relative, /-separated glob.glob(recursive=True) pattern: * and ?
+    stay inside one segment and ** spans any number of directories."""
+    segments = pattern.split("/")
+    parts = []
+    for i, seg in enumerate(segments):
+        last = i == len(segments) - 1
+        if seg == "**":
+            parts.append("(?:(?!\\.)[^/]+/)*" + ("(?:(?!\\.)[^/]+)?" if last else ""))
+        else:
+            parts.append(_glob_segment(seg) + ("" if last else "/"))
+    return re.compile("".join(parts) + "\\Z")
+
+
+class TreeSnapshot:
+    """In-memory listing of a tree for tool_glob, shared by every agent in the process.
+
+    Built on first use with the same SKIP_DIRS and .gitignore rules as
+    grep. Afterwards, at most every TREE_REFRESH_SECS (or right after one
+    of our tools wrote something or ran bash), each directory is re-stat'ed
+    and only directories whose mtime changed are listed again.
+    """
+
+    def __init__(self, root: Path):
+        self.root = os.path.abspath(root)
+        self._dirs = {}                           # abs dir -> (mtime_ns, rules, {name: is_dir})
+        self._flat = None                         # sorted [(relpath, abspath)], rebuilt after changes
+        self.version = 0                          # bumped on every change, keys GLOB_CACHE
+        self._lock = threading.Lock()
+        self._stale = True
+        self._checked = 0.0
+
+    def mark_stale(self):
+        self._stale = True
+
+    def _scan(self, directory: str, rules: IgnoreRules):
+        rules = rules.child(directory)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        listing = {}
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if (is_dir and entry.name in SKIP_DIRS) or rules.ignored(entry.path, entry.name, is_dir):
+                    continue
+                listing[entry.name] = is_dir
+            except OSError:
+                continue
+        old = self._dirs.get(directory)
+        self._dirs[directory] = (mtime, rules, listing)
+        self._flat = None
+        self.version += 1
+        for name, is_dir in listing.items():
+            path = os.path.join(directory, name)
+            if is_dir and path not in self._dirs:
+                self._scan(path, rules)
+        if old:
+            for name, is_dir in old[2].items():
+                if is_dir and name not in listing:
+                    self._drop(os.path.join(directory, name))
+
+    def _drop(self, directory: str):
+        state = self._dirs.pop(directory, None)
+        self._flat = None
+        self.version += 1
+        if state:
+            for name, is_dir in state[2].items():
+                if is_dir:
+                    self._drop(os.path.join(directory, name))
+
+    def _refresh(self):
+        if not self._dirs:
+            self._scan(self.root, _root_ignore_rules(self.root))
+        elif self._stale or time.monotonic() - self._checked > TREE_REFRESH_SECS:
+            for directory, (mtime, rules, _) in list(self._dirs.items()):
+                if directory not in self._dirs:
+                    continue                      # dropped along with a parent
+                try:
+                    changed = os.stat(directory).st_mtime_ns != mtime
+                except OSError:
+                    self._drop(directory)
+                    continue
+                if changed:
+                    parent = os.path.dirname(directory)
+                    parent_rules = self._dirs[parent][1] if parent in self._dirs else _root_ignore_rules(directory)
+                    self._scan(directory, parent_rules)
+        else:
+            return
+        self._stale = False
+        self._checked = time.monotonic()
+
+    def glob(self, pattern: str, base: str):
+        """Sorted paths matching pattern relative to base, or None if the snapshot
+        can't answer (base outside the root, absolute pattern, skipped dir).
+
+        Only which paths exist is tracked: a file rewritten in place leaves
+        its directory's mtime alone, so callers that care stat the files.
+        """
+        base = os.path.abspath(base)
+        if os.path.isabs(pattern) or (base != self.root and not base.startswith(self.root + os.sep)):
+            return None
+        rel_base = os.path.relpath(base, self.root).replace(os.sep, "/")
+        full = pattern if rel_base == "." else f"{rel_base}/{pattern}"
+        full = re.sub(r"(^|/)\./", r"\1", full)
+        if SKIP_DIRS.intersection(full.split("/")) or ".." in full.split("/"):
+            return None
+        rx = _glob_regex(full)
+        # the part before the first wildcard narrows the scan to one subtree
+        prefix = re.split(r"[*?\[]", full, 1)[0]
+        with self._lock:
+            self._refresh()
+            key = (full, self.version)
+            cached = GLOB_CACHE.get(key)
+            if cached is not None:
+                return list(cached)
+            if self._flat is None:
+                self._flat = sorted(
+                    (os.path.relpath(os.path.join(d, name), self.root).replace(os.sep, "/"),
+                     os.path.join(d, name))
+                    for d, (_, _, listing) in self._dirs.items()
+                    for name in listing
+                )
+            flat = self._flat
+        start = bisect.bisect_left(flat, (prefix,))
+        out = []
+        for rel, path in flat[start:]:
+            if not rel.startswith(prefix):
+                break
+            if rx.match(rel):
+                out.append(path)
+        GLOB_CACHE.put(key, tuple(out), sum(len(path) + 64 for path in out))
+        return out
+
+
+TREE = TreeSnapshot(PROJECT_ROOT)
+
+# ── Trigram index ─────────────────────────────────────────────────────────────
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:                               # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT)}
+
+
+def _trigrams(text: str) -> set:
+    text = text.translate(_ASCII_LOWER)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _literal_query(parsed):
+    """Boolean query of literal runs every match of a parsed regex must contain.
+
+    Returns ("lit", s), ("and", [...]), ("or", [...]) or None for "no
+    constraint". Only ASCII runs of 3+ characters count, and ASCII is
+    lowercased on both sides, so (?i) patterns are handled too.
+    """
+    items, run = [], []
+
+    def flush():
+        if len(run) >= 3:
+            items.append(("lit", "".join(run)))
+        run.clear()
+
+    for op, av in parsed:
+        if op is sre_constants.LITERAL and av < 128:
+            run.append(chr(av))
+            continue
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            items.append(_literal_query(av[-1]))
+        elif op in _REPEATS and av[0] >= 1:
+            items.append(_literal_query(av[2]))
+        elif op is sre_constants.BRANCH:
+            alts = [_literal_query(a) for a in av[1]]
+            if all(alts):
+                items.append(("or", alts))
+    flush()
+    items = [i for i in items if i]
+    if not items:
+        return None
+    return items[0] if len(items) == 1 else ("and", items)
+
+
+class TrigramIndex:
+    """Persistent trigram index of a tree, used to narrow grep's candidate files.
+
+    Stored in SQLite under INDEX_DIR, one database per root. update() brings
+    it up to date incrementally: files whose mtime/size changed are hashed,
+    and only those whose content changed are re-tokenized. Paths written by
+    our own tools are re-indexed before the next query; anything else
+    (other processes, bash) is picked up by a rescan at most every
+    INDEX_REFRESH_SECS.
+    """
+
+    TEXT, UNINDEXED, BINARY = 0, 1, 2             # files.kind
+
+    def __init__(self, root: Path):
+        self.root = os.path.abspath(root)
+        self.db_path = INDEX_DIR / f"trigram-{hashlib.sha1(self.root.encode()).hexdigest()[:12]}.db"
+        self._db = None
+        self._lock = threading.Lock()             # held for whole refreshes and queries
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()       # just for _dirty, so writers never wait on a rescan
+        self._stale = True
+        self._checked = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE,
+                    mtime_ns INTEGER, size INTEGER, sha1 TEXT, kind INTEGER);
+                CREATE TABLE IF NOT EXISTS postings (
+                    tri TEXT, file_id INTEGER, PRIMARY KEY (tri, file_id)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+            """)
+            self._db = db
+        return self._db
+
+    def mark_dirty(self, path: str):
+        with self._dirty_lock:
+            self._dirty.add(path)
+
+    def _take_dirty(self) -> set:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_stale(self):
+        self._stale = True
+
+    def _index_file(self, db, path: str, st, file_id: int = None, sha1: str = None) -> bool:
+        """(Re)index one file; returns True if its content changed."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read(INDEX_MAX_FILE_BYTES + 1)
+        except OSError:
+            return False
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == sha1:
+            db.execute("UPDATE files SET mtime_ns=?, size=? WHERE id=?", (st.st_mtime_ns, st.st_size, file_id))
+            return False
+        if b"\0" in data[:8192]:
+            kind = self.BINARY
+        elif len(data) > INDEX_MAX_FILE_BYTES:
+            kind = self.UNINDEXED
+        else:
+            kind = self.TEXT
+        if file_id is not None:
+            db.execute("DELETE FROM postings WHERE file_id=?", (file_id,))
+            db.execute("UPDATE files SET mtime_ns=?, size=?, sha1=?, kind=? WHERE id=?",
+                       (st.st_mtime_ns, st.st_size, digest, kind, file_id))
+        else:
+            file_id = db.execute(
+                "INSERT INTO files (path, mtime_ns, size, sha1, kind) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_mtime_ns, st.st_size, digest, kind)).lastrowid
+        if kind == self.TEXT:
+            db.executemany("INSERT INTO postings VALUES (?, ?)",
+                           ((t, file_id) for t in _trigrams(data.decode("utf-8", errors="replace"))))
+        return True
+
+    def _sync(self, paths) -> tuple:
+        """Reindex changed files among paths; returns (stats, known rows, paths seen)."""
+        db = self._conn()
+        rows = {r[1]: r for r in db.execute("SELECT id, path, mtime_ns, size, sha1 FROM files")}
+        stats = {"scanned": 0, "reindexed": 0, "removed": 0}
+        seen = set()
+        for path in paths:
+            seen.add(path)
+            stats["scanned"] += 1
+            row = rows.get(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if row and (row[2], row[3]) == (st.st_mtime_ns, st.st_size):
+                continue
+            if self._index_file(db, path, st, *((row[0], row[4]) if row else ())):
+                stats["reindexed"] += 1
+        return stats, rows, seen
+
+    def update(self) -> dict:
+        """Full incremental refresh against the tree on disk."""
+        with self._lock:
+            return self._update()
+
+    def _update(self) -> dict:
+        # reset before scanning: a path dirtied (or bash run) mid-scan is
+        # picked up by the next refresh rather than forgotten
+        self._take_dirty()
+        self._stale = False
+        db = self._conn()
+        with db:
+            stats, rows, seen = self._sync(iter_files(self.root))
+            for path, row in rows.items():
+                if path not in seen:
+                    db.execute("DELETE FROM postings WHERE file_id=?", (row[0],))
+                    db.execute("DELETE FROM files WHERE id=?", (row[0],))
+                    stats["removed"] += 1
+        self._checked = time.monotonic()
+        return stats
+
+    def _refresh(self):
+        if self._stale or time.monotonic() - self._checked > INDEX_REFRESH_SECS:
+            self._update()
+        elif dirty := self._take_dirty():
+            db = self._conn()
+            with db:
+                self._sync(p for p in dirty
+                           if os.path.isfile(p) and p.startswith(self.root + os.sep)
+                           and not SKIP_DIRS.intersection(Path(p).parts))
+
+    def _eval(self, db, query):
+        if query[0] == "lit":
+            ids = None
+            for tri in _trigrams(query[1]):
+                posting = {r[0] for r in db.execute("SELECT file_id FROM postings WHERE tri=?", (tri,))}
+                ids = posting if ids is None else ids & posting
+                if not ids:
+                    break
+            return ids or set()
+        sets = [self._eval(db, q) for q in query[1]]
+        return set.intersection(*sets) if query[0] == "and" else set.union(*sets)
+
+    def candidates(self, pattern: str, root: str, file_glob: str = None):
+        """Sorted files under root that can match pattern, or None when the
+        index can't help (no usable literals, or root outside the index)."""
+        root = os.path.abspath(root)
+        if root != self.root and not root.startswith(self.root + os.sep):
+            return None
+        if SKIP_DIRS.intersection(Path(root).relative_to(self.root).parts):
+            return None                           # explicitly searching a skipped dir
+        try:
+            query = _literal_query(sre_parse.parse(pattern))
+        except re.error:
+            return None
+        if query is None:
+            return None
+        with self._lock:
+            self._refresh()
+            db = self._conn()
+            ids = self._eval(db, query)
+            rows = db.execute("SELECT id, path, kind FROM files WHERE kind != ?", (self.BINARY,)).fetchall()
+        prefix = root + os.sep
+        return sorted(
+            path for file_id, path, kind in rows
+            if (file_id in ids or kind == self.UNINDEXED)
+            and (path == root or path.startswith(prefix))
+            and (not file_glob or fnmatch.fnmatch(os.path.basename(path), file_glob))
+        )
+
+    def info(self) -> dict:
+        with self._lock:
+            db = self._conn()
+            kinds = dict(db.execute("SELECT kind, COUNT(*) FROM files GROUP BY kind").fetchall())
+            return {
+                "root": self.root,
+                "db": str(self.db_path),
+                "db_bytes": self.db_path.stat().st_size if self.db_path.exists() else 0,
+                "files": sum(kinds.values()),
+                "text": kinds.get(self.TEXT, 0),
+                "unindexed": kinds.get(self.UNINDEXED, 0),
+                "binary": kinds.get(self.BINARY, 0),
+                "trigrams": db.execute("SELECT COUNT(DISTINCT tri) FROM postings").fetchone()[0],
+                "postings": db.execute("SELECT COUNT(*) FROM postings").fetchone()[0],
+            }
+
+
+TRIGRAM_INDEX = TrigramIndex(PROJECT_ROOT)
+
+# ── Output capture ────────────────────────────────────────────────────────────
+
+_ANSI = re.compile(r"\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07]*\x07")
+
+
+@lru_cache(maxsize=8)
+def _error_regexes(patterns: tuple) -> list:
+    # searched one by one: each keeps its literal-prefix fast path, which a
+    # combined alternation loses (about 10x slower on a clean build log)
+    return [re.compile(p.encode(), re.MULTILINE) for p in patterns]
+
+
+# "<session key>/<tool_call_id>" while a session runs a tool; names spill logs
+TOOL_CALL = contextvars.ContextVar("tool_call", default=None)
+
+
+class OutputCapture:
+    """Bounded capture of a command's output, fed as it streams.
+
+    Keeps the first quarter and the last half of MAX_OUTPUT_CHARS plus any
+    lines in between that match BASH_ERROR_PATTERNS, so memory stays flat
+    however much a build prints. Once output outgrows the limit the whole
+    log is written to a file under BASH_LOG_DIR that read_file can page.
+    """
+
+    MAX_LINE = 4096                # longer lines are matched and shown cut
+
+    def __init__(self, limit: int = None, command: str = None):
+        limit = limit or MAX_OUTPUT_CHARS
+        self.head_size = limit // 4
+        self.tail_size = limit // 2
+        self.error_size = limit - self.head_size - self.tail_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.lines = 0
+        self.errors = []               # (line number, offset, text) past the head
+        self.error_bytes = 0
+        self.errors_full = False       # error budget spent; later matches only in the log
+        self._line = bytearray()
+        self._line_start = 0
+        self._rxs = _error_regexes(tuple(BASH_ERROR_PATTERNS))
+        self._decoder = None
+        self._spill = None
+        self.spill_path = None
+        self.command = command
+
+    def feed(self, data: bytes):
+        if not data:
+            return
+        if self._spill is None and self.total + len(data) > self.head_size + self.tail_size:
+            self._open_spill()
+        if self._spill is not None:
+            self._spill.write(self._decoder.decode(data))
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            self.tail += data[room:]
+        else:
+            self.tail += data
+        if len(self.tail) > 2 * self.tail_size:
+            del self.tail[:-self.tail_size]
+        self._scan(data)
+        self.total += len(data)
+
+    def _scan(self, data: bytes):
+        nl = data.rfind(b"\n")
+        if nl < 0:
+            self._line += data[:self.MAX_LINE - len(self._line)]
+            return
+        lines = bytes(self._line) + data[:nl + 1]
+        if not self.errors_full and self.total + nl >= self.head_size:
+            self._match(lines, len(self._line))
+        self.lines += lines.count(b"\n")
+        self._line = bytearray(data[nl + 1:nl + 1 + self.MAX_LINE])
+        self._line_start = self.total + nl + 1
+
+    def _match(self, buf: bytes, carried: int):
+        """Record matching lines of buf (complete lines; the first carried bytes came earlier)."""
+        pos, lineno = 0, self.lines
+        while True:
+            hits = [m for rx in self._rxs if (m := rx.search(buf, pos))]
+            if not hits:
+                return
+            m = min(hits, key=lambda m: m.start())
+            start = buf.rfind(b"\n", 0, m.start()) + 1
+            end = buf.find(b"\n", m.end())
+            lineno += buf.count(b"\n", pos, start) + 1
+            offset = self._line_start if start < carried else self.total + start - carried
+            if offset >= self.head_size:
+                line = buf[start:end][:self.MAX_LINE]
+                if self.error_bytes + len(line) > self.error_size:
+                    self.errors_full = True
+                    return
+                self.errors.append((lineno, offset, line))
+                self.error_bytes += len(line) + 16
+            pos = end + 1
+
+    def _open_spill(self):
+        BASH_LOG_DIR.mkdir(parents=True, exist_ok=True)
+        logs = sorted(BASH_LOG_DIR.glob("bash-*.log"), key=lambda f: f.stat().st_mtime)
+        for old in logs[:max(0, len(logs) - BASH_LOG_KEEP + 1)]:
+            old.unlink(missing_ok=True)
+        call = TOOL_CALL.get()
+        if call and self.command is not None:
+            # named after the call so a replayed run gets the same path in its results
+            digest = hashlib.sha256(f"{call}\0{self.command}".encode()).hexdigest()[:16]
+            path = str(BASH_LOG_DIR / f"bash-{digest}.log")
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        else:
+            fd, path = tempfile.mkstemp(prefix="bash-", suffix=".log", dir=BASH_LOG_DIR)
+        self.spill_path = path
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._spill = open(fd, "w", encoding="utf-8")
+        self._spill.write(self._decoder.decode(bytes(self.head + self.tail)))
+
+    def close(self):
+        if self._line:                     # a final unterminated line
+            if not self.errors_full:
+                self._match(bytes(self._line) + b"\n", len(self._line))
+            self.lines += 1
+            self._line.clear()
+        if self._spill is not None:
+            self._spill.write(self._decoder.decode(b"", final=True))
+            self._spill.close()
+            self._spill = None
+
+    def text(self) -> str:
+        """Everything, if it fit; otherwise head, matched middle lines and tail."""
+        self.close()
+        if self.total <= self.head_size + self.tail_size:
+            return (self.head + self.tail).decode(errors="replace")
+        tail = bytes(self.tail[-self.tail_size:])
+        tail_start = self.total - len(tail)
+        cut = tail.find(b"\n")
+        if 0 <= cut < 200:                 # start the tail on a line boundary
+            tail, tail_start = tail[cut + 1:], tail_start + cut + 1
+        tail_line = self.lines - tail.count(b"\n") + tail.endswith(b"\n")
+        head = bytes(self.head)
+        cut = head.rfind(b"\n")
+        if len(head) - cut < 200:          # and end the head on one
+            head = head[:cut + 1]
+        parts = [head.decode(errors="replace").rstrip("\n"),
+                 f"... [{tail_start - len(head)} bytes omitted; full log "
+                 f"({self.lines} lines): {self.spill_path}]"]
+        shown = [(n, line) for n, start, line in self.errors if start < tail_start]
+        if shown:
+            parts.append("... [error lines from the omitted part:]")
+            parts += [f"  {n}: {line.decode(errors='replace')}" for n, line in shown]
+            if self.errors_full:
+                parts.append("  ... [more in the full log]")
+        parts.append(f"... [last lines, from line {tail_line}:]")
+        parts.append(tail.decode(errors="replace"))
+        return "\n".join(parts)
+
+# ── Type checking ─────────────────────────────────────────────────────────────
+
+_STARTED = time.time_ns()           # first typecheck reports files changed since then
+
+
+def _tsconfig_root(start: Path) -> Path:
+    """The nearest directory at or above start holding a tsconfig.json."""
+    for d in [start, *start.parents]:
+        if (d / "tsconfig.json").is_file():
+            return d
+    return PROJECT_ROOT
+
+
+class TypeChecker:
+    """A warm tsserver for one TypeScript project, shared by every agent in
+    the process.
+
+    The project is loaded once; after that a check re-reads only the given
+    files and asks for their diagnostics, which takes milliseconds instead
+    of the tens of seconds a cold `tsc` needs. Calls are serialized on a
+    lock, and a server that dies or stops answering is restarted on the
+    next call.
+    """
+
+    def __init__(self, root: Path):
+        self.root = str(root)
+        self.proc = None
+        self.seq = 0
+        self._buf = b""
+        self._open = set()
+        self._outside = set()               # open files that aren't part of the tsconfig project
+        self._lock = threading.Lock()
+
+    def _server(self) -> list:
+        for d in [Path(self.root), *Path(self.root).parents]:
+            js = d / "node_modules" / "typescript" / "lib" / "tsserver.js"
+            if js.is_file():
+                return ["node", str(js)]
+        raise RuntimeError(f"typescript is not installed under {self.root} (run pnpm install)")
+
+    def _start(self):
+        self.close()
+        self.proc = subprocess.Popen(
+            self._server() + ["--disableAutomaticTypingAcquisition"], cwd=self.root,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self.seq = 0
+        self._buf = b""
+        self._open = set()
+        self._outside = set()
+
+    def _send(self, command: str, arguments: dict) -> int:
+        self.seq += 1
+        msg = {"seq": self.seq, "type": "request", "command": command, "arguments": arguments}
+        self.proc.stdin.write(json.dumps(msg).encode() + b"\n")
+        self.proc.stdin.flush()
+        return self.seq
+
+    def _message(self, deadline: float) -> dict:
+        """The next Content-Length framed message from the server."""
+        fd = self.proc.stdout.fileno()
+        while True:
+            head, sep, rest = self._buf.partition(b"\r\n\r\n")
+            if sep:
+                length = int(re.search(rb"Content-Length: (\d+)", head).group(1))
+                if len(rest) >= length:
+                    self._buf = rest[length:]
+                    return json.loads(rest[:length])
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"tsserver did not answer within {TYPECHECK_TIMEOUT}s")
+            if select.select([fd], [], [], remaining)[0]:
+                chunk = os.read(fd, 1 << 20)
+                if not chunk:
+                    raise RuntimeError("tsserver exited")
+                self._buf += chunk
+
+    def _request(self, command: str, arguments: dict, deadline: float) -> dict:
+        seq = self._send(command, arguments)
+        while True:
+            msg = self._message(deadline)
+            if msg.get("type") == "response" and msg.get("request_seq") == seq:
+                if not msg.get("success"):
+                    raise RuntimeError(f"tsserver {command}: {msg.get('message')}")
+                return msg.get("body")
+
+    def _sync(self, files: list, deadline: float) -> list:
+        """Load the current contents of files; return the ones that still exist."""
+        present, new = [], []
+        for f in files:
+            if not os.path.isfile(f):
+                if f in self._open:
+                    self._send("close", {"file": f})
+                    self._open.discard(f)
+            elif f in self._open:
+                self._request("reload", {"file": f, "tmpfile": f}, deadline)
+                present.append(f)
+            else:
+                new.append({"file": f, "projectRootPath": self.root})
+                present.append(f)
+        if new:
+            self._request("updateOpen", {"openFiles": new}, deadline)
+            for o in new:
+                self._open.add(o["file"])
+                # files the tsconfig leaves out (tests, scripts) land in an
+                # inferred project whose errors `pnpm check` never reports
+                info = self._request("projectInfo", {"file": o["file"], "needFileNameList": False}, deadline)
+                if not info.get("configFileName", "").endswith(".json"):
+                    self._outside.add(o["file"])
+        return [f for f in present if f not in self._outside]
+
+    def _diagnostics(self, files: list, deadline: float) -> dict:
+        """{file: [diagnostic]} for the syntax and semantic errors in files."""
+        seq = self._send("geterr", {"files": files, "delay": 0})
+        diags = {f: [] for f in files}
+        while True:
+            msg = self._message(deadline)
+            event = msg.get("event")
+            if event in ("syntaxDiag", "semanticDiag"):
+                body = msg["body"]
+                diags.setdefault(body["file"], []).extend(body["diagnostics"])
+            elif event == "requestCompleted" and msg["body"].get("request_seq") == seq:
+                return diags
+
+    def check(self, files: list) -> dict:
+        with self._lock:
+            deadline = time.monotonic() + TYPECHECK_TIMEOUT
+            try:
+                if self.proc is None or self.proc.poll() is not None:
+                    self._start()
+                present = self._sync(files, deadline)
+                return self._diagnostics(present, deadline) if present else {}
+            except (TimeoutError, RuntimeError, OSError):
+                self.close()                      # restart from scratch next time
+                raise
+
+    def _sample_file(self) -> str:
+        """A source file the tsconfig includes, to load the project with."""
+        try:
+            include = json.loads(Path(self.root, "tsconfig.json").read_text()).get("include", [])
+        except (OSError, ValueError):
+            include = []
+        for pattern in include + ["**/*"]:
+            found = TREE.glob(pattern, self.root)
+            if found is None:                     # project outside PROJECT_ROOT
+                rx = _glob_regex(pattern)
+                found = [p for p in iter_files(self.root)
+                         if rx.match(os.path.relpath(p, self.root).replace(os.sep, "/"))]
+            for path in found:
+                if path.endswith((".ts", ".tsx")) and not path.endswith(".d.ts"):
+                    return path
+        return None
+
+    def warm(self):
+        """Start the server and load the project, so the first check is fast."""
+        try:
+            first = self._sample_file()
+            if first:
+                self.check([first])
+        except Exception:
+            pass
+
+    def close(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+
+_TYPECHECKERS = {}
+_TYPECHECKERS_LOCK = threading.Lock()
+
+
+def typechecker(root: Path, warm: bool = False) -> TypeChecker:
+    """The process-wide checker for the project at root, created on first use."""
+    key = str(root)
+    if TYPECHECK_SERVER is not None:
+        return TYPECHECK_SERVER(key)
+    with _TYPECHECKERS_LOCK:
+        checker = _TYPECHECKERS.get(key)
+        if checker is None:
+            checker = _TYPECHECKERS[key] = TypeChecker(root)
+            if warm:
+                threading.Thread(target=checker.warm, daemon=True).start()
+    return checker
+
+
+def warm_typechecker():
+    """Start loading the project's tsserver in the background."""
+    typechecker(_tsconfig_root(PROJECT_ROOT), warm=True)
+
+
+def _ts_files(root: Path) -> dict:
+    """{path: (mtime_ns, size)} for the .ts/.tsx files under root."""
+    found = []
+    for pattern in ("**/*.ts", "**/*.tsx"):
+        matches = TREE.glob(pattern, str(root))
+        if matches is None:
+            matches = iter_files(str(root), pattern[3:])
+        found += matches
+    # The snapshot lists which files exist, but its mtimes only refresh when
+    # a directory changes, and rewriting a file in place doesn't: stat each.
+    versions = {}
+    for p in found:
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        versions[p] = (st.st_mtime_ns, st.st_size)
+    return versions
+
+
+def _format_diagnostic(path: str, d: dict) -> str:
+    text = d["text"].replace("\n", "\n  ")
+    return f"{_display_path(path)}({d['start']['line']},{d['start']['offset']}): {d['category']} TS{d['code']}: {text}"
+
+
+_TYPECHECK_SEEN = {}                # {path: (mtime_ns, size)} as of the last standalone typecheck
+
+
+def tool_typecheck(files: list = None, root: str = None, seen: dict = None) -> str:
+    """Diagnostics for files, or for the .ts/.tsx files changed since the last
+    call. seen holds the caller's view of the tree (one per agent session)."""
+    try:
+        base = _tsconfig_root(resolve_path(root) if root else PROJECT_ROOT)
+        seen = _TYPECHECK_SEEN if seen is None else seen
+        current = _ts_files(base)
+        if files:
+            targets = [os.path.normpath(str(resolve_path(f))) for f in files]
+            missing = [f for f, p in zip(files, targets) if not os.path.isfile(p)]
+            if missing:
+                return f"ERROR: no such file: {', '.join(missing)}"
+            checked_now = {p: current[p] for p in targets if p in current}
+            deleted = []
+        else:
+            targets = sorted(p for p, version in current.items()
+                             if (seen[p] != version if p in seen else version[0] >= _STARTED))
+            deleted = [p for p in seen if p.startswith(str(base) + os.sep) and p not in current]
+            targets += deleted
+            checked_now = current
+        if not targets:
+            return "(no TypeScript files changed since the last typecheck)"
+        diags = typechecker(base).check(targets)
+        # only now: a failed check leaves the changes to be reported next time
+        for p in deleted:
+            del seen[p]
+        seen.update(checked_now)
+        lines = [_format_diagnostic(path, d) for path in sorted(diags) for d in diags[path]]
+        errors = sum(d["category"] == "error" for ds in diags.values() for d in ds)
+        checked = f"{len(diags)} checked file{'s' * (len(diags) != 1)}"
+        skipped = len([t for t in targets if os.path.isfile(t)]) - len(diags)
+        if skipped:
+            checked += f", {skipped} outside the tsconfig project skipped"
+        if not lines:
+            return f"No errors in {checked}"
+        out = "\n".join(lines)
+        if len(out) > MAX_OUTPUT_CHARS:
+            out = out[:MAX_OUTPUT_CHARS] + "\n... [truncated]"
+        return (f"{out}\n[{errors} error{'s' * (errors != 1)} in "
+                f"{sum(bool(ds) for ds in diags.values())} of {checked}]")
+    except Exception as e:
+        return f"ERROR: {e}"
+
 # ── Tool execution ────────────────────────────────────────────────────────────
 
 def resolve_path(path: str) -> Path:
@@ -154,14 +1425,48 @@ def resolve_path(path: str) -> Path:
     return PROJECT_ROOT / path
 
 
+def cache_summaries() -> list:
+    """One line per shared cache, for the end-of-run summaries."""
+    return [f"file cache: {FILE_CACHE.summary()}",
+            f"search cache: grep {GREP_CACHE.hits} hits / {GREP_CACHE.misses} misses, "
+            f"glob {GLOB_CACHE.hits} / {GLOB_CACHE.misses}, file text {TEXT_CACHE.hits} / {TEXT_CACHE.misses} "
+            f"({TEXT_CACHE.bytes >> 10} KiB)"]
+
+
 def tool_read_file(path: str, offset: int = None, limit: int = None) -> str:
     try:
         p = resolve_path(path)
-        lines = p.read_text(encoding="utf-8").splitlines()
-        start = (offset - 1) if offset else 0
-        end = (start + limit) if limit else len(lines)
-        chunk = lines[start:end]
-        return "\n".join(f"{start+i+1}\t{line}" for i, line in enumerate(chunk))
+        st = p.stat()
+        key = (str(p), st.st_mtime_ns, st.st_size, offset, limit)
+        cached = FILE_CACHE.get(key)
+        if cached is not None:
+            return cached
+        index = line_index(p, st)
+        start = max(offset - 1, 0) if offset else 0
+        if start >= index.lines > 0:
+            return f"(past the end: {path} has {index.lines} lines)"
+        end = min(start + (limit or READ_PAGE_LINES), index.lines)
+        lo, hi = index.span(start, end)
+        with open(p, "rb") as f:
+            f.seek(lo)
+            data = f.read(hi - lo)
+        out, chars = [], 0
+        for i, line in enumerate(data.decode("utf-8").split("\n")[:end - start]):
+            line = line.rstrip("\r")
+            if len(line) > READ_MAX_LINE_CHARS:
+                line = line[:READ_MAX_LINE_CHARS] + f"... [line cut, {len(line)} chars]"
+            row = f"{start+i+1}\t{line}"
+            chars += len(row) + 1
+            if out and chars > READ_PAGE_CHARS:
+                break
+            out.append(row)
+        shown = start + len(out)
+        if shown < index.lines and (not limit or shown < start + limit):
+            out.append(f"... [lines {start+1}-{shown} of {index.lines}; "
+                       f"read_file with offset={shown+1} for more]")
+        out = "\n".join(out)
+        FILE_CACHE.put(key, out, len(out))
+        return out
     except Exception as e:
         return f"ERROR: {e}"
 
@@ -171,67 +1476,397 @@ def tool_write_file(path: str, content: str) -> str:
         p = resolve_path(path)
         p.parent.mkdir(parents=True, exist_ok=True)
         p.write_text(content, encoding="utf-8")
+        invalidate_file(p)
         return f"Written {len(content)} chars to {p}"
     except Exception as e:
         return f"ERROR: {e}"
 
 
+def _atomic_write(p: Path, content: str):
+    """Replace p's contents all at once: readers see the old file or the new one."""
+    p = p.resolve()                               # keep symlinks pointing at the edited file
+    fd, tmp = tempfile.mkstemp(dir=p.parent, prefix=f".{p.name}.", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        os.chmod(tmp, p.stat().st_mode & 0o7777)
+        os.replace(tmp, p)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _apply_edits(content: str, edits: list) -> tuple:
+    """Apply (old_string, new_string) pairs in order.
+
+    Returns (new content, None, None), or (None, index, error) for the first
+    edit that doesn't match exactly once.
+    """
+    for i, (old, new) in enumerate(edits):
+        at = content.find(old) if old else -1
+        if at < 0:
+            return None, i, "old_string not found in file"
+        again = content.find(old, at + len(old))
+        if again >= 0:
+            count = 2 + content.count(old, again + len(old))
+            return None, i, f"old_string found {count} times — must be unique. Add more context."
+        content = content[:at] + new + content[at + len(old):]
+    return content, None, None
+
+
 def tool_edit_file(path: str, old_string: str, new_string: str) -> str:
     try:
         p = resolve_path(path)
-        content = p.read_text(encoding="utf-8")
-        count = content.count(old_string)
-        if count == 0:
-            return "ERROR: old_string not found in file"
-        if count > 1:
-            return f"ERROR: old_string found {count} times — must be unique. Add more context."
-        p.write_text(content.replace(old_string, new_string, 1), encoding="utf-8")
+        content, _, error = _apply_edits(p.read_text(encoding="utf-8"), [(old_string, new_string)])
+        if error:
+            return f"ERROR: {error}"
+        _atomic_write(p, content)
+        invalidate_file(p)
         return f"Replaced 1 occurrence in {p}"
     except Exception as e:
         return f"ERROR: {e}"
 
 
+def tool_multi_edit(path: str, edits: list) -> str:
+    try:
+        p = resolve_path(path)
+        if not edits:
+            return "ERROR: no edits given"
+        pairs = [(e["old_string"], e["new_string"]) for e in edits]
+        content, failed, error = _apply_edits(p.read_text(encoding="utf-8"), pairs)
+        if error:
+            return f"ERROR: edit {failed + 1} of {len(pairs)}: {error} (no edits were applied)"
+        _atomic_write(p, content)
+        invalidate_file(p)
+        return f"Applied {len(pairs)} edits to {p}"
+    except KeyError as e:
+        return f"ERROR: every edit needs old_string and new_string (missing {e})"
+    except Exception as e:
+        return f"ERROR: {e}"
+
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+def _parse_patch(patch: str) -> list:
+    """Split a unified diff into [[old path, new path, [(header, old start, ops)]]].
+
+    Paths are None when the diff has no ---/+++ lines. A hunk header may
+    omit its line numbers (a bare "@@"), and blank lines inside a hunk
+    count as empty context lines, which is how models tend to write them.
+    When the header gives line counts, that many lines belong to the hunk
+    whatever they look like: "--- x" there is a removed line "-- x".
+    """
+    files, hunk, left = [], None, None           # left: (old, new) lines the header still promises
+    lines = patch.splitlines()
+    for i, line in enumerate(lines):
+        if left and (line[:1] in (" ", "-", "+", "\\") or not line):
+            if line[:1] != "\\":
+                op = line[:1] or " "
+                hunk[2].append((op, line[1:]))
+                left = (left[0] - (op != "+"), left[1] - (op != "-"))
+                if left[0] <= 0 and left[1] <= 0:
+                    left = None
+            continue
+        left = None
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            files.append([line[4:].split("\t")[0].strip(), None, []])
+            hunk = None
+        elif line.startswith("+++ ") and files and files[-1][1] is None and not files[-1][2]:
+            files[-1][1] = line[4:].split("\t")[0].strip()
+        elif line.startswith("@@"):
+            if not files:
+                files.append([None, None, []])
+            m = _HUNK_HEADER.match(line)
+            start = int(m.group(1)) if m else None
+            if m and m.group(2) == "0":
+                start += 1                        # "-N,0" means: insert after line N
+            if m and (counts := (int(m.group(2) or 1), int(m.group(3) or 1))) != (0, 0):
+                left = counts
+            hunk = (line, start, [])
+            files[-1][2].append(hunk)
+        elif hunk is not None and (line[:1] in (" ", "-", "+") or not line):
+            hunk[2].append((line[:1] or " ", line[1:]))
+        elif line.startswith("\\"):                # "\ No newline at end of file"
+            continue
+        else:
+            hunk = None                           # diff --git, index, ... lines
+    for f in files:
+        for _, _, ops in f[2]:
+            while ops and ops[-1] == (" ", ""):   # trailing blank lines of the patch text
+                ops.pop()
+    return [f for f in files if f[2] or f[0] != f[1]]
+
+
+_FUZZ = [
+    ("", None),
+    ("ignoring trailing whitespace", str.rstrip),
+    ("ignoring whitespace", lambda s: " ".join(s.split())),
+]
+
+
+def _locate(lines: list, old: list, hint: int, lo: int) -> int:
+    """Start of the match for old in lines[lo:] nearest to hint, or None."""
+    best = None
+    for at in range(lo, len(lines) - len(old) + 1):
+        if lines[at] == old[0] and lines[at:at + len(old)] == old:
+            if best is None or abs(at - hint) < abs(best - hint):
+                best = at
+            elif at > hint:
+                break
+    return best
+
+
+def _hunk_failure(n: int, header: str, lines: list, old: list, hint: int) -> str:
+    norm = _FUZZ[-1][1]
+    best, score = None, 0
+    for at in range(len(lines) - len(old) + 1):
+        s = sum(norm(lines[at + i]) == norm(x) for i, x in enumerate(old))
+        if s > score or (s == score and best is not None and abs(at - hint) < abs(best - hint)):
+            best, score = at, s
+    msg = f"hunk {n} ({header}): context not found"
+    if best is None or not score:
+        return msg
+    diff = next(i for i, x in enumerate(old) if norm(lines[best + i]) != norm(x))
+    return (f"{msg}; closest match at line {best + 1} ({score} of {len(old)} lines agree), "
+            f"first difference at line {best + diff + 1}:\n"
+            f"  expected: {old[diff]!r}\n  found:    {lines[best + diff]!r}")
+
+
+def _apply_hunks(lines: list, hunks: list) -> list:
+    """Apply hunks in order to lines in place; return notes on inexact matches."""
+    notes, growth, drift, lo = [], 0, 0, 0
+    normed = {}                                   # fuzz level -> normalized copy of lines
+    for n, (header, start, ops) in enumerate(hunks, 1):
+        old = [text for op, text in ops if op != "+"]
+        hint = start - 1 + growth + drift if start else lo
+        if not old:                               # pure insertion: trust the line number
+            if not start and lines:
+                raise PatchError(f"hunk {n} ({header}): only adds lines, with no line numbers "
+                                 f"or context lines to say where")
+            at, fuzz = min(max(hint, lo), len(lines)), ""
+        else:
+            for fuzz, norm in _FUZZ:
+                if norm and fuzz not in normed:
+                    normed[fuzz] = [norm(x) for x in lines]
+                at = _locate(normed.get(fuzz, lines), [norm(x) for x in old] if norm else old, hint, lo)
+                if at is not None:
+                    break
+            else:
+                raise PatchError(_hunk_failure(n, header, lines, old, hint))
+        new, j = [], at
+        for op, text in ops:
+            if op == " ":
+                new.append(lines[j])              # keep the file's own context lines
+            if op != "+":
+                j += 1
+            if op == "+":
+                new.append(text)
+        lines[at:at + len(old)] = new
+        for level, norm in _FUZZ[1:]:
+            if level in normed:
+                normed[level][at:at + len(old)] = [norm(x) for x in new]
+        if start and at != hint:
+            notes.append(f"hunk {n} applied at line {at + 1} (offset {at - hint:+d})")
+        if fuzz:
+            notes.append(f"hunk {n} matched {fuzz}")
+        if start:
+            drift = at - (start - 1 + growth)
+        growth += len(new) - len(old)
+        lo = at + len(new)
+    return notes
+
+
+def _creates_file(old_name: str, hunks: list) -> bool:
+    """Whether a file's diff says it creates the file: --- /dev/null, or only -0,0 hunks."""
+    if old_name == "/dev/null":
+        return True
+    headers = [_HUNK_HEADER.match(header) for header, _, _ in hunks]
+    return bool(headers) and all(m and m.group(1) == "0" and m.group(2) == "0" for m in headers)
+
+
+def _patch_target(name: str, path: str) -> Path:
+    if path:
+        return resolve_path(path)
+    if name is None:
+        raise PatchError("the patch has no ---/+++ file headers; pass path")
+    p = resolve_path(name)
+    if not p.exists() and name[:2] in ("a/", "b/"):
+        p = resolve_path(name[2:])               # git-style a/ b/ prefixes
+    return p
+
+
+def tool_apply_patch(patch: str, path: str = None) -> str:
+    try:
+        files = _parse_patch(patch)
+        if not files:
+            return "ERROR: no hunks found in patch"
+        if path and len(files) > 1:
+            return "ERROR: path given but the patch touches several files"
+        # work out every file's new contents before writing any of them
+        results = []
+        for old_name, new_name, hunks in files:
+            if new_name == "/dev/null":
+                p = _patch_target(old_name, path)
+                if not p.is_file():
+                    raise PatchError(f"{p}: cannot delete, no such file")
+                results.append((p, None, "deleted"))
+                continue
+            p = _patch_target(new_name or old_name, path)
+            if not hunks and old_name != "/dev/null":
+                raise PatchError(f"{p}: no hunks for this file")
+            if not p.exists() and not _creates_file(old_name, hunks):
+                raise PatchError(f"{p}: no such file")  # a mistyped path is not a new file
+            if not p.exists() or old_name == "/dev/null":
+                if p.exists():
+                    raise PatchError(f"{p}: patch creates a file that already exists")
+                if any(op != "+" for _, _, ops in hunks for op, _ in ops):
+                    raise PatchError(f"{p}: no such file")
+                content, crlf, notes = "", False, []
+            else:
+                content = p.read_bytes().decode("utf-8")   # no newline translation
+                crlf = "\r\n" in content
+                content = content.replace("\r\n", "\n") if crlf else content
+            lines = content.split("\n")
+            trailing = lines[-1] == "" and len(lines) > 1
+            if trailing or not content:
+                lines.pop()
+            try:
+                notes = _apply_hunks(lines, hunks)
+            except PatchError as e:
+                raise PatchError(f"{p}: {e}") from None
+            text = "\n".join(lines) + ("\n" if trailing or not content else "")
+            if crlf:
+                text = text.replace("\n", "\r\n")
+            summary = f"{len(hunks)} hunk{'s' * (len(hunks) != 1)} applied"
+            results.append((p, text, "; ".join([summary] + notes)))
+        for p, text, _ in results:
+            if text is None:
+                p.unlink()
+            elif p.exists():
+                _atomic_write(p, text)
+            else:
+                p.parent.mkdir(parents=True, exist_ok=True)
+                p.write_text(text, encoding="utf-8")
+            invalidate_file(p)
+        return "\n".join(f"Patched {p}: {what}" for p, _, what in results)
+    except PatchError as e:
+        return f"ERROR: {e} (no files were changed)"
+    except Exception as e:
+        return f"ERROR: {e}"
+
+
+def _bash_output(capture: OutputCapture, notes=()) -> str:
+    out = _ANSI.sub("", capture.text().replace("\r", "")).strip("\n")
+    return "\n".join([out, *notes] if out else notes) or "(no output)"
+
+
 def tool_bash(command: str, cwd: str = None) -> str:
     try:
         wd = resolve_path(cwd) if cwd else PROJECT_ROOT
-        result = subprocess.run(
-            command, shell=True, cwd=wd,
-            capture_output=True, text=True, timeout=60
-        )
-        out = result.stdout + result.stderr
-        if len(out) > MAX_OUTPUT_CHARS:
-            out = out[:MAX_OUTPUT_CHARS] + f"\n... [truncated, {len(out)} total chars]"
-        return out or "(no output)"
-    except subprocess.TimeoutExpired:
-        return "ERROR: command timed out (60s)"
+        TRIGRAM_INDEX.mark_stale()               # bash can change any file
+        TREE.mark_stale()
+        capture = OutputCapture(command=command)
+        deadline = time.monotonic() + BASH_TIMEOUT
+        with subprocess.Popen(
+            command, shell=True, cwd=wd, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True,
+        ) as proc:
+            fd = proc.stdout.fileno()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    return _bash_output(capture, [f"ERROR: command timed out ({BASH_TIMEOUT}s)"])
+                if select.select([fd], [], [], remaining)[0]:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    capture.feed(chunk)
+            try:
+                proc.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:      # output closed, shell still running
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+                return _bash_output(capture, [f"ERROR: command timed out ({BASH_TIMEOUT}s)"])
+        return _bash_output(capture)
     except Exception as e:
         return f"ERROR: {e}"
 
 
-def tool_glob(pattern: str, root: str = None) -> str:
+def tool_glob(pattern: str, root: str = None, sort: str = "mtime") -> str:
     try:
         base = resolve_path(root) if root else PROJECT_ROOT
-        matches = sorted(glob_module.glob(str(base / pattern), recursive=True))
+        matches = TREE.glob(pattern, str(base))
+        if matches is None:
+            # outside the snapshot (other root, absolute pattern or a skipped dir)
+            matches = glob_module.glob(str(base / pattern), recursive=True)
         if not matches:
             return "(no matches)"
-        return "\n".join(str(Path(m).relative_to(PROJECT_ROOT)) for m in matches[:200])
+        if sort == "path":
+            matches.sort()
+        else:
+            mtimes = {}
+            for m in matches:
+                try:
+                    mtimes[m] = os.stat(m).st_mtime
+                except OSError:
+                    mtimes[m] = 0.0               # deleted since the snapshot: sorts last
+            matches.sort(key=lambda m: (-mtimes[m], m))
+        out = "\n".join(_display_path(m) for m in matches[:200])
+        if len(matches) > 200:
+            out += f"\n... [{len(matches) - 200} more — narrow the pattern]"
+        return out
     except Exception as e:
         return f"ERROR: {e}"
 
 
 def tool_grep(pattern: str, path: str, file_glob: str = None, context: int = 0) -> str:
     try:
-        cmd = ["grep", "-rn", "--color=never"]
-        if context:
-            cmd += [f"-C{context}"]
-        if file_glob:
-            cmd += ["--include", file_glob]
-        cmd += [pattern, str(resolve_path(path))]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        out = result.stdout
-        if len(out) > MAX_OUTPUT_CHARS:
-            out = out[:MAX_OUTPUT_CHARS] + "\n... [truncated]"
-        return out or "(no matches)"
+        try:
+            _compile(pattern)
+        except re.error as e:
+            return f"ERROR: invalid regex: {e}"
+        root = str(resolve_path(path))
+        candidates = TRIGRAM_INDEX.candidates(pattern, root, file_glob) if GREP_INDEX else None
+        # Only searches the index narrowed are cached: keying a full walk on
+        # every file's version would stat the whole tree before the first
+        # match, and search() stops early after GREP_MAX_MATCHES.
+        key = None
+        if candidates is not None:
+            key = (pattern, root, file_glob, context or 0, _versions(candidates))
+            cached = GREP_CACHE.get(key)
+            if cached is not None:
+                return cached
+        out = []
+        size = files = matches = 0
+        for file, lines in search(pattern, root, file_glob, context or 0, files=candidates):
+            block = [_display_path(file)]
+            prev = None
+            for n, text, is_match in lines:
+                if prev is not None and n > prev + 1:
+                    block.append("  --")          # gap between context groups
+                block.append(f"  {n}{':' if is_match else '-'} {text}")
+                prev = n
+            files += 1
+            matches += sum(1 for line in lines if line[2])
+            size += sum(len(b) + 1 for b in block)
+            out.extend(block)
+            if size > MAX_OUTPUT_CHARS:
+                break
+        body = "\n".join(out) or "(no matches)"
+        if len(body) > MAX_OUTPUT_CHARS:
+            body = body[:MAX_OUTPUT_CHARS] + "\n... [truncated]"
+        if matches >= GREP_MAX_MATCHES or size > MAX_OUTPUT_CHARS:
+            body += f"\n[stopped after {matches} matches in {files} files — narrow the pattern or path]"
+        if key is not None:
+            GREP_CACHE.put(key, body, len(body))
+        return body
     except Exception as e:
         return f"ERROR: {e}"
 
@@ -240,9 +1875,12 @@ TOOL_FN_MAP = {
     "read_file": tool_read_file,
     "write_file": tool_write_file,
     "edit_file": tool_edit_file,
+    "multi_edit": tool_multi_edit,
+    "apply_patch": tool_apply_patch,
     "bash": tool_bash,
     "glob": tool_glob,
     "grep": tool_grep,
+    "typecheck": tool_typecheck,
 }
 
 
@@ -252,100 +1890,2181 @@ def execute_tool(name: str, args: dict) -> str:
         return f"ERROR: unknown tool {name}"
     return fn(**args)
 
-# ── DeepSeek API ──────────────────────────────────────────────────────────────
+# ── Persistent shell ──────────────────────────────────────────────────────────
 
-def chat(messages: list, api_key: str) -> dict:
-    payload = json.dumps({
-        "model": MODEL,
-        "messages": messages,
-        "tools": TOOLS,
-        "tool_choice": "auto",
-        "max_tokens": 32768,
-    }).encode()
-    req = urllib.request.Request(
-        API_URL,
-        data=payload,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        },
-        method="POST",
-    )
-    try:
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            return json.loads(resp.read())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode()
-        raise RuntimeError(f"HTTP {e.code}: {body}")
+class ShellSession:
+    """A long-lived bash for one agent, driven over a pty.
 
-# ── Agent loop ────────────────────────────────────────────────────────────────
+    Each command is written to a temp file and sourced, so multi-line
+    scripts, cd and exported variables behave as in a terminal and persist
+    to the next call. A per-session sentinel line carrying $? marks the end
+    of the output. On timeout the running job is killed, and the shell is
+    restarted if it doesn't come back; a shell that exits (say, the command
+    ran `exit`) is restarted on the next call.
+    """
 
-def run_agent(task: str, api_key: str, verbose: bool = True) -> str:
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": task},
-    ]
+    def __init__(self, cwd: Path = PROJECT_ROOT):
+        self.cwd = cwd
+        self.proc = None
+        self.fd = None
+        self.sentinel = f"__DS_DONE_{uuid.uuid4().hex}__"
+        self._script = tempfile.NamedTemporaryFile("w", prefix="ds-shell-", suffix=".sh", delete=False)
+        self._script.close()
 
-    if verbose:
-        print(f"\n{'='*60}", flush=True)
-        print(f"TASK: {task[:200]}", flush=True)
-        print('='*60, flush=True)
+    def _start(self):
+        master, slave = pty.openpty()
+        env = dict(os.environ, TERM="dumb", NO_COLOR="1", FORCE_COLOR="0",
+                   PAGER="cat", GIT_PAGER="cat", PS1="", PS2="")
+        self.proc = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"], cwd=self.cwd,
+            stdin=slave, stdout=slave, stderr=slave,
+            env=env, start_new_session=True,
+        )
+        os.close(slave)
+        self.fd = master
+        self._send("stty -echo -onlcr; PS1=''; PS2=''")
+        self._read_until_sentinel(10)
 
-    for turn in range(MAX_TURNS):
-        if verbose:
-            print(f"\n[turn {turn+1}] calling DeepSeek...", flush=True)
+    def _alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
 
-        response = chat(messages, api_key)
-        choice = response["choices"][0]
-        msg = choice["message"]
-        messages.append(msg)
+    def _send(self, line: str):
+        os.write(self.fd, (f"{line}; printf '\\n%s %d\\n' {self.sentinel} $?\n").encode())
 
-        # Extract text content if any
-        content = msg.get("content") or ""
-        if content and verbose:
-            print(f"\n[assistant] {content[:500]}", flush=True)
-
-        # Check for tool calls
-        tool_calls = msg.get("tool_calls") or []
-        if not tool_calls:
-            # Done
-            if verbose:
-                print(f"\n{'='*60}", flush=True)
-                print("DONE", flush=True)
-            return content
-
-        # Execute each tool call
-        for tc in tool_calls:
-            fn_name = tc["function"]["name"]
-            fn_args = json.loads(tc["function"]["arguments"])
-            if verbose:
-                print(f"\n  → {fn_name}({json.dumps(fn_args)[:120]})", flush=True)
-            result = execute_tool(fn_name, fn_args)
-            if verbose:
-                preview = result[:300].replace("\n", "\\n")
-                print(f"    ← {preview}", flush=True)
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tc["id"],
-                "content": result,
-            })
+    def _drain(self):
+        """Discard output left over from an earlier timed-out command."""
+        while select.select([self.fd], [], [], 0)[0]:
+            try:
+                if not os.read(self.fd, 65536):
+                    return
+            except OSError:
+                return
 
-    return "ERROR: max turns reached"
+    def _read_until_sentinel(self, timeout: float, capture: OutputCapture = None):
+        """Stream output into capture; return the exit code, or None on timeout or shell death."""
+        buf = b""                                 # unscanned bytes that may hold a split sentinel
+        done = re.compile(re.escape(self.sentinel.encode()) + rb" (\d+)\r?\n")
+        keep = len(self.sentinel) + 16
+        deadline = time.monotonic() + timeout
+        while True:
+            m = done.search(buf)
+            if m:
+                if capture:
+                    capture.feed(buf[:m.start()])
+                return int(m.group(1))
+            if capture and len(buf) > keep:
+                capture.feed(buf[:-keep])
+                buf = buf[-keep:]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.fd, 65536)
+            except OSError:                       # EIO: the shell is gone
+                chunk = b""
+            if not chunk:
+                break
+            buf += chunk
+        if capture:
+            capture.feed(buf)
+        return None
 
-# ── CLI ───────────────────────────────────────────────────────────────────────
+    def run(self, command: str, cwd: str = None) -> str:
+        notes = []
+        if not self._alive():
+            if self.proc is not None:
+                notes.append("[previous shell exited; started a new session]")
+            self.close_shell()
+            self._start()
+        self._drain()
+        Path(self._script.name).write_text(command + "\n", encoding="utf-8")
+        prefix = f"cd -- {shlex.quote(str(resolve_path(cwd)))} && " if cwd else ""
+        self._send(f"{prefix}. {shlex.quote(self._script.name)} < /dev/null 2>&1")
+        capture = OutputCapture(command=command)
+        code = self._read_until_sentinel(BASH_TIMEOUT, capture)
+        if code is None and self._alive():
+            # kill the running job and give the shell a moment to print the sentinel
+            self._kill_jobs()
+            code = self._read_until_sentinel(0.5, capture)
+            if code is None and self._alive():
+                # an interrupted list never reaches its sentinel; ask for a new one
+                self._send(":")
+                code = self._read_until_sentinel(2, capture)
+            if code is None:
+                self.close_shell()                # wedged: next call starts a fresh shell
+            notes.append(f"ERROR: command timed out ({BASH_TIMEOUT}s)")
+        elif code is None:
+            notes.append("[shell exited]")
+        elif code:
+            notes.append(f"[exit code {code}]")
+        return _bash_output(capture, notes)
 
-def main():
-    global MODEL
-    parser = argparse.ArgumentParser(description="DeepSeek coding agent")
-    parser.add_argument("task", nargs="?", help="Task description")
-    parser.add_argument("--file", "-f", help="Read task from file")
-    parser.add_argument("--key", "-k", help="DeepSeek API key (or set DEEPSEEK_API_KEY)")
-    parser.add_argument("--quiet", "-q", action="store_true", help="Only print final result")
-    parser.add_argument("--model", "-m", default=MODEL, help=f"Model name (default: {MODEL})")
-    args = parser.parse_args()
+    def _kill_jobs(self):
+        """Interrupt the terminal's foreground job, then kill it if it lingers.
 
-    # Resolve API key
-    api_key = args.key or os.environ.get("DEEPSEEK_API_KEY")
+        bash on a pty runs with job control, so the job has its own process
+        group and signalling it leaves the shell alone.
+        """
+        try:
+            pgid = os.tcgetpgrp(self.fd)
+        except OSError:
+            return
+        if pgid == self.proc.pid:
+            return
+        for sig in (signal.SIGINT, signal.SIGKILL):
+            try:
+                os.killpg(pgid, sig)
+            except OSError:
+                return
+            time.sleep(0.2)
+
+    def close_shell(self):
+        if self.proc is not None and self._alive():
+            try:
+                os.killpg(os.getpgid(self.proc.pid), signal.SIGKILL)
+            except OSError:
+                pass
+            self.proc.wait()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def close(self):
+        self.close_shell()
+        Path(self._script.name).unlink(missing_ok=True)
+
+# ── Async tool execution ──────────────────────────────────────────────────────
+
+async def tool_bash_async(command: str, cwd: str = None) -> str:
+    try:
+        wd = resolve_path(cwd) if cwd else PROJECT_ROOT
+        TRIGRAM_INDEX.mark_stale()
+        TREE.mark_stale()
+        capture = OutputCapture(command=command)
+        proc = await asyncio.create_subprocess_shell(
+            command, cwd=wd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+        async def pump():
+            while chunk := await proc.stdout.read(65536):
+                capture.feed(chunk)
+            await proc.wait()
+
+        try:
+            await asyncio.wait_for(pump(), timeout=BASH_TIMEOUT)
+        except asyncio.TimeoutError:
+            os.killpg(proc.pid, signal.SIGKILL)
+            await proc.wait()
+            return _bash_output(capture, [f"ERROR: command timed out ({BASH_TIMEOUT}s)"])
+        return _bash_output(capture)
+    except Exception as e:
+        return f"ERROR: {e}"
+
+
+# Tools without a native async version run their sync implementation in
+# the default thread pool, which keeps file I/O (and grep) off the event loop.
+ASYNC_TOOL_FN_MAP = {
+    "bash": tool_bash_async,
+}
+
+
+async def execute_tool_async(name: str, args: dict) -> str:
+    fn = ASYNC_TOOL_FN_MAP.get(name)
+    if fn:
+        return await fn(**args)
+    return await asyncio.to_thread(execute_tool, name, args)
+
+# ── Tool scheduling ───────────────────────────────────────────────────────────
+
+READ_ONLY_TOOLS = {"read_file", "glob", "grep", "typecheck"}
+
+
+def _tool_scope(name: str, args: dict) -> str:
+    """The file or directory a tool call touches (bash has no single scope)."""
+    if name in ("glob", "typecheck"):
+        where = args.get("root")
+    else:
+        where = args.get("path")
+    return os.path.normpath(str(resolve_path(where) if where else PROJECT_ROOT))
+
+
+def _overlaps(a: str, b: str) -> bool:
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+class ToolScheduler:
+    """Runs one agent's tool calls on a bounded pool while keeping their effects ordered.
+
+    Read-only calls (read_file, glob, grep, typecheck) run in parallel. A
+    write_file, edit_file, multi_edit or apply_patch waits for every earlier
+    call on an overlapping path (an apply_patch without a path covers the
+    whole project), and later calls on that path wait for it. bash is a
+    full barrier in both directions, since it can touch anything. Callers
+    collect the returned futures in tool_call order, so results are
+    appended in that order.
+    """
+
+    def __init__(self, max_workers: int = TOOL_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._history = []                        # (name, scope, future) in submit order
+
+    def _deps(self, name: str, scope: str) -> list:
+        if name == "bash":
+            return [f for _, _, f in self._history]
+        deps = []
+        for prev_name, prev_scope, f in self._history:
+            if prev_name == "bash":
+                deps.append(f)
+            elif name in READ_ONLY_TOOLS and prev_name in READ_ONLY_TOOLS:
+                continue
+            elif _overlaps(scope, prev_scope):
+                deps.append(f)
+        return deps
+
+    def submit(self, name: str, args: dict, run_tool=None):
+        """Schedule a call; run_tool() replaces execute_tool(name, args) if given."""
+        scope = None if name == "bash" else _tool_scope(name, args)
+        deps = self._deps(name, scope)
+
+        def run():
+            # deps were submitted earlier, so with a FIFO pool they are
+            # already running or done and this wait cannot deadlock
+            for f in deps:
+                f.exception()
+            return run_tool() if run_tool else execute_tool(name, args)
+
+        future = self._executor.submit(run)
+        self._history.append((name, scope, future))
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncToolScheduler(ToolScheduler):
+    """ToolScheduler for run_agent_async: same ordering rules, asyncio tasks
+    instead of threads, bounded by a semaphore."""
+
+    def __init__(self, max_workers: int = TOOL_WORKERS):
+        self._slots = asyncio.Semaphore(max_workers)
+        self._history = []
+
+    def submit(self, name: str, args: dict, run_tool=None) -> asyncio.Task:
+        scope = None if name == "bash" else _tool_scope(name, args)
+        deps = self._deps(name, scope)
+
+        async def run():
+            await asyncio.gather(*deps, return_exceptions=True)
+            async with self._slots:
+                if run_tool:
+                    return await run_tool()
+                return await execute_tool_async(name, args)
+
+        task = asyncio.ensure_future(run())
+        self._history.append((name, scope, task))
+        return task
+
+    async def shutdown(self):
+        await asyncio.gather(*(t for _, _, t in self._history), return_exceptions=True)
+
+# ── HTTP transport ────────────────────────────────────────────────────────────
+
+def _split_url(url: str):
+    """Return ((scheme, host, port), request-target) for a URL."""
+    u = urllib.parse.urlsplit(url)
+    port = u.port or (443 if u.scheme == "https" else 80)
+    return (u.scheme, u.hostname, port), u.path + (f"?{u.query}" if u.query else "")
+
+
+class PooledConnection:
+    """A keep-alive HTTP(S) connection plus the metrics we report on it."""
+
+    def __init__(self, scheme: str, host: str, port: int, timeout: float):
+        self.id = 0                               # assigned by the pool
+        self.host = host
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self.conn = cls(host, port, timeout=timeout)
+        start = time.monotonic()
+        self.conn.connect()                       # TCP + TLS handshake, timed
+        self.handshake_ms = (time.monotonic() - start) * 1000
+        self.requests = 0
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+
+
+class _PoolMetrics:
+    """stats()/summary() over self._all, shared by the sync and async pools."""
+
+    def stats(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "id": pc.id,
+                    "host": pc.host,
+                    "requests": pc.requests,
+                    "reused": max(pc.requests - 1, 0),
+                    "handshake_ms": round(pc.handshake_ms, 1),
+                    "open": not pc.closed,
+                }
+                for pc in self._all
+            ]
+
+    def summary(self) -> str:
+        stats = self.stats()
+        if not stats:
+            return "connection pool: no connections opened"
+        total = sum(s["requests"] for s in stats)
+        handshake = sum(s["handshake_ms"] for s in stats)
+        lines = [
+            f"connection pool: {total} requests over {len(stats)} connections "
+            f"({total - len(stats)} reused, {handshake:.0f}ms total handshake)"
+        ]
+        for s in stats:
+            lines.append(
+                f"  #{s['id']} {s['host']}: {s['requests']} requests, "
+                f"reused {s['reused']}x, handshake {s['handshake_ms']}ms"
+                + ("" if s["open"] else " (closed)")
+            )
+        return "\n".join(lines)
+
+
+class ConnectionPool(_PoolMetrics):
+    """Thread-safe pool of keep-alive connections, keyed by (scheme, host, port).
+
+    One module-level instance (POOL) is shared by every run_agent call in the
+    process, so ds-swarm threads reuse each other's warm TLS sessions.
+    HTTP/1.1 only: the stdlib has no HTTP/2 client, so concurrency comes from
+    holding up to max_idle idle connections per host instead of multiplexing.
+    """
+
+    def __init__(self, max_idle: int = 16, timeout: float = 120):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}                           # key -> [PooledConnection]
+        self._all = []                            # every connection ever opened
+        self._lock = threading.Lock()
+
+    def _checkout(self, key) -> PooledConnection:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        pc = PooledConnection(*key, timeout=self.timeout)
+        with self._lock:
+            self._all.append(pc)
+            pc.id = len(self._all)
+        return pc
+
+    def _release(self, key, pc: PooledConnection, reusable: bool):
+        if not reusable:
+            pc.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(pc)
+                return
+        pc.close()
+
+    def _send(self, method: str, url: str, body: bytes, headers: dict):
+        """Send a request and return (key, connection, response) with the body unread.
+
+        A reused connection that the server has silently dropped is retried
+        once on a fresh connection.
+        """
+        key, target = _split_url(url)
+        for attempt in range(2):
+            pc = self._checkout(key)
+            fresh = pc.requests == 0
+            try:
+                pc.conn.request(method, target, body=body, headers=headers or {})
+                resp = pc.conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError, http.client.CannotSendRequest):
+                pc.close()
+                if fresh or attempt:
+                    raise
+                continue
+            except Exception:
+                pc.close()
+                raise
+            pc.requests += 1
+            return key, pc, resp
+
+    def request(self, method: str, url: str, body: bytes = None, headers: dict = None):
+        """Send a request and read the full response. Returns (status, headers, body)."""
+        key, pc, resp = self._send(method, url, body, headers)
+        try:
+            data = resp.read()
+        except Exception:
+            pc.close()
+            raise
+        self._release(key, pc, reusable=not resp.will_close)
+        return resp.status, dict(resp.getheaders()), data
+
+    @contextmanager
+    def stream(self, method: str, url: str, body: bytes = None, headers: dict = None):
+        """Send a request and yield the live response for incremental reads.
+
+        The connection goes back to the pool only if the caller consumed the
+        whole body; an abandoned stream closes it.
+        """
+        key, pc, resp = self._send(method, url, body, headers)
+        try:
+            yield resp
+        except BaseException:
+            pc.close()
+            raise
+        self._release(key, pc, reusable=resp.isclosed() and not resp.will_close)
+
+
+POOL = ConnectionPool()
+
+
+# ── Async HTTP transport ──────────────────────────────────────────────────────
+
+class AsyncPooledConnection:
+    """asyncio counterpart of PooledConnection, speaking HTTP/1.1 over streams."""
+
+    def __init__(self, host: str, reader, writer, handshake_ms: float):
+        self.id = 0                               # assigned by the pool
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+        self.handshake_ms = handshake_ms
+        self.requests = 0
+        self.closed = False
+
+    @classmethod
+    async def open(cls, scheme: str, host: str, port: int, timeout: float):
+        start = time.monotonic()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port,
+                ssl=ssl.create_default_context() if scheme == "https" else None,
+            ),
+            timeout,
+        )
+        return cls(host, reader, writer, (time.monotonic() - start) * 1000)
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+
+class AsyncResponse:
+    """Just enough of http.client.HTTPResponse for chat_async/chat_stream_async."""
+
+    def __init__(self, pc: AsyncPooledConnection, status: int, headers: dict, timeout: float):
+        self._pc = pc
+        self._timeout = timeout
+        self.status = status
+        self.headers = headers
+        chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        length = headers.get("content-length")
+        self._chunked = chunked
+        self._remaining = None if chunked or length is None else int(length)
+        self.will_close = (
+            headers.get("connection", "").lower() == "close"
+            or (not chunked and length is None)
+        )
+        self.done = False
+
+    async def _io(self, coro):
+        return await asyncio.wait_for(coro, self._timeout)
+
+    async def chunks(self):
+        """Yield the (de-chunked) body as it arrives."""
+        reader = self._pc.reader
+        if self._chunked:
+            while True:
+                size = int((await self._io(reader.readline())).split(b";")[0], 16)
+                if size == 0:
+                    while (await self._io(reader.readline())) not in (b"\r\n", b""):
+                        pass                      # trailers
+                    break
+                data = await self._io(reader.readexactly(size))
+                await self._io(reader.readexactly(2))
+                yield data
+        elif self._remaining is not None:
+            while self._remaining:
+                data = await self._io(reader.read(min(self._remaining, 65536)))
+                if not data:
+                    raise ConnectionResetError("connection closed mid-body")
+                self._remaining -= len(data)
+                yield data
+        else:
+            while data := await self._io(reader.read(65536)):
+                yield data
+        self.done = True
+
+    async def read(self) -> bytes:
+        return b"".join([c async for c in self.chunks()])
+
+    async def lines(self):
+        """Yield body lines (with their newline), like iterating an HTTPResponse."""
+        buf = b""
+        async for chunk in self.chunks():
+            buf += chunk
+            *complete, buf = buf.split(b"\n")
+            for line in complete:
+                yield line + b"\n"
+        if buf:
+            yield buf
+
+
+class AsyncConnectionPool(_PoolMetrics):
+    """Keep-alive pool for run_agent_async. asyncio streams belong to one event
+    loop, so there is one pool per loop (see async_pool())."""
+
+    def __init__(self, max_idle: int = 64, timeout: float = 120):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._all = []
+        self._lock = threading.Lock()
+
+    async def _checkout(self, key) -> AsyncPooledConnection:
+        idle = self._idle.get(key)
+        if idle:
+            return idle.pop()
+        pc = await AsyncPooledConnection.open(*key, timeout=self.timeout)
+        with self._lock:
+            self._all.append(pc)
+            pc.id = len(self._all)
+        return pc
+
+    def _release(self, key, pc: AsyncPooledConnection, reusable: bool):
+        idle = self._idle.setdefault(key, [])
+        if reusable and len(idle) < self.max_idle:
+            idle.append(pc)
+        else:
+            pc.close()
+
+    async def _send(self, method: str, url: str, body: bytes, headers: dict):
+        key, target = _split_url(url)
+        scheme, host, port = key
+        body = body or b""
+        head = [f"{method} {target} HTTP/1.1",
+                f"Host: {host}" if port in (80, 443) else f"Host: {host}:{port}",
+                f"Content-Length: {len(body)}"]
+        head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        raw = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+        for attempt in range(2):
+            pc = await self._checkout(key)
+            fresh = pc.requests == 0
+            try:
+                pc.writer.write(raw)
+                await pc.writer.drain()
+                status_line = await asyncio.wait_for(pc.reader.readline(), self.timeout)
+                if not status_line:
+                    raise ConnectionResetError("server closed the connection")
+                status = int(status_line.split()[1])
+                resp_headers = {}
+                while (line := await asyncio.wait_for(pc.reader.readline(), self.timeout)) not in (b"\r\n", b""):
+                    k, _, v = line.decode("latin-1").partition(":")
+                    resp_headers[k.strip().lower()] = v.strip()
+            except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                pc.close()
+                if fresh or attempt:
+                    raise
+                continue
+            except BaseException:
+                pc.close()
+                raise
+            pc.requests += 1
+            return key, pc, AsyncResponse(pc, status, resp_headers, self.timeout)
+
+    async def request(self, method: str, url: str, body: bytes = None, headers: dict = None):
+        """Send a request and read the full response. Returns (status, headers, body)."""
+        key, pc, resp = await self._send(method, url, body, headers)
+        try:
+            data = await resp.read()
+        except BaseException:
+            pc.close()
+            raise
+        self._release(key, pc, reusable=not resp.will_close)
+        return resp.status, resp.headers, data
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, body: bytes = None, headers: dict = None):
+        """Async counterpart of ConnectionPool.stream()."""
+        key, pc, resp = await self._send(method, url, body, headers)
+        try:
+            yield resp
+        except BaseException:
+            pc.close()
+            raise
+        self._release(key, pc, reusable=resp.done and not resp.will_close)
+
+
+_async_pools = weakref.WeakKeyDictionary()        # event loop -> AsyncConnectionPool
+_async_pools_lock = threading.Lock()
+
+
+def async_pool() -> AsyncConnectionPool:
+    """The AsyncConnectionPool for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _async_pools_lock:
+        pool = _async_pools.get(loop)
+        if pool is None:
+            pool = _async_pools[loop] = AsyncConnectionPool()
+        return pool
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+
+class APIError(RuntimeError):
+    """A non-2xx answer from the API; retryable for 429 and 5xx."""
+
+    def __init__(self, status: int, headers: dict, body: bytes):
+        super().__init__(f"HTTP {status}: {body.decode(errors='replace')}")
+        self.status = status
+        self.retry_after = _retry_after(headers)
+
+
+def _retry_after(headers: dict):
+    """Seconds from a Retry-After header (delta or HTTP date), or None."""
+    value = next((v for k, v in (headers or {}).items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException, asyncio.TimeoutError)
+
+
+class CircuitBreaker:
+    """CLOSED → OPEN after BREAKER_THRESHOLD consecutive failures; after
+    BREAKER_COOLDOWN one probe goes through (HALF_OPEN) and its result closes
+    or re-opens the circuit. Same states as scripts/lib/circuit_breaker.sh,
+    counting failed API calls instead of stalled loops."""
+
+    CLOSED, HALF_OPEN, OPEN = "CLOSED", "HALF_OPEN", "OPEN"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> float:
+        """Seconds to hold off before the next call (0: go ahead)."""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + BREAKER_COOLDOWN - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state, self._probing = self.HALF_OPEN, False
+            if self.state == self.HALF_OPEN:
+                now = time.monotonic()
+                # wait for the probe's verdict, unless the probe itself got lost
+                if self._probing and now - self._probe_started < BREAKER_COOLDOWN:
+                    return 0.5
+                self._probing, self._probe_started = True, now
+            return 0.0
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.state, self.failures, self._probing = self.CLOSED, 0, False
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self.failures >= BREAKER_THRESHOLD):
+                self.state, self._opened_at, self._probing = self.OPEN, time.monotonic(), False
+                self.opens += 1
+
+    def release(self):
+        """A call failed before the API had a say (a local error): no verdict,
+        but a HALF_OPEN probe slot is free again for the next caller."""
+        with self._lock:
+            self._probing = False
+
+
+class RateLimiter:
+    """Process-wide admission control for API calls, shared by every agent.
+
+    Two token buckets (RATE_RPM requests and RATE_TPM tokens per minute; 0
+    turns one off) hand out reservations in arrival order: a caller takes
+    its share immediately, possibly driving the bucket negative, and sleeps
+    until the bucket would have covered it. Token use is estimated from the
+    request size and corrected from the response's usage. A 429 pauses
+    every caller until Retry-After, and failures feed a CircuitBreaker, so a
+    swarm backs off together instead of hammering the API one agent at a
+    time.
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+        self._requests = self._tokens = None      # bucket levels, filled on first use
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self.calls = 0
+        self.retries = {"429": 0, "5xx": 0, "network": 0}
+        self.waited = 0.0
+
+    def _refill(self, now: float):
+        elapsed, self._updated = now - self._updated, now
+        if RATE_RPM:
+            level = RATE_RPM if self._requests is None else self._requests + elapsed * RATE_RPM / 60
+            self._requests = min(level, RATE_RPM)
+        if RATE_TPM:
+            level = RATE_TPM if self._tokens is None else self._tokens + elapsed * RATE_TPM / 60
+            self._tokens = min(level, RATE_TPM)
+
+    def hold(self, attempt: int) -> tuple:
+        """(seconds the circuit breaker says to wait, attempt count after it).
+
+        Sitting out an open circuit uses up one of the caller's retries, so
+        an API that stays down fails the calls instead of parking them.
+        """
+        delay = self.breaker.wait()
+        if delay and self.breaker.state == CircuitBreaker.OPEN:
+            attempt += 1
+            if attempt > API_MAX_RETRIES:
+                raise RuntimeError(f"API unavailable: circuit open after "
+                                   f"{self.breaker.failures} consecutive failures")
+        return delay, attempt
+
+    def reserve(self, tokens: int) -> float:
+        """Take one request and ~tokens from the buckets; return seconds to wait first."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if RATE_RPM:
+                self._requests -= 1
+                wait = max(wait, -self._requests * 60 / RATE_RPM)
+            if RATE_TPM:
+                self._tokens -= min(tokens, RATE_TPM)
+                wait = max(wait, -self._tokens * 60 / RATE_TPM)
+            wait = max(wait, 0.0)
+            self.calls += 1
+            self.waited += wait
+            return wait
+
+    def settle(self, estimated: int, usage: dict):
+        """Correct a reservation with the tokens the call really used."""
+        if RATE_TPM and usage:
+            actual = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+            with self._lock:
+                self._tokens -= actual - min(estimated, RATE_TPM)
+
+    def succeeded(self, estimated: int, usage: dict):
+        self.breaker.record(True)
+        self.settle(estimated, usage)
+
+    def retry_delay(self, error: Exception, attempt: int):
+        """Seconds before retrying after error, or None if it must be raised."""
+        return self.backoff(_failure_kind(error), attempt, getattr(error, "retry_after", None))
+
+    def backoff(self, kind: str, attempt: int, retry_after: float = None):
+        """retry_delay for an already classified failure (see _failure_kind)."""
+        if kind == "4xx":
+            self.breaker.record(True)             # a 4xx still means the API is up
+            return None
+        if kind is None:
+            self.breaker.release()                # not the API's failure
+            return None
+        if kind != "429":
+            self.breaker.record(False)
+        if attempt >= API_MAX_RETRIES:
+            return None
+        # full jitter: spread a swarm's retries over the whole window
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, BACKOFF_BASE)
+        if kind == "429":
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        with self._lock:
+            self.retries[kind] += 1
+            self.waited += delay
+        return delay
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "retries": dict(self.retries), "waited_s": round(self.waited, 1),
+                "breaker": self.breaker.state, "breaker_opens": self.breaker.opens}
+
+    def summary(self) -> str:
+        r = self.retries
+        return (f"{self.calls} API calls, {sum(r.values())} retries (429: {r['429']}, 5xx: {r['5xx']}, "
+                f"network: {r['network']}), {self.waited:.1f}s waiting, "
+                f"circuit {self.breaker.state} ({self.breaker.opens} opens)")
+
+
+def _failure_kind(error: Exception):
+    """"429", "5xx" or "network" for retryable failures, "4xx" for a
+    request the API rejected, None for anything else."""
+    if isinstance(error, APIError):
+        if error.status not in RETRYABLE_STATUS:
+            return "4xx"
+        return "429" if error.status == 429 else "5xx"
+    if isinstance(error, TRANSIENT_ERRORS):
+        return "network"
+    return None
+
+
+class RemoteRateLimiter:
+    """Stands in for RATE_LIMITER in a worker process whose budget lives elsewhere.
+
+    remote is a multiprocessing manager proxy for the RateLimiter of the
+    coordinating process (see ds-swarm.py --processes). Failures are
+    classified here so only plain values cross the process boundary.
+    """
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def hold(self, attempt: int) -> tuple:
+        return self.remote.hold(attempt)
+
+    def reserve(self, tokens: int) -> float:
+        return self.remote.reserve(tokens)
+
+    def succeeded(self, estimated: int, usage: dict):
+        self.remote.succeeded(estimated, usage)
+
+    def retry_delay(self, error: Exception, attempt: int):
+        return self.remote.backoff(_failure_kind(error), attempt, getattr(error, "retry_after", None))
+
+    def stats(self) -> dict:
+        return self.remote.stats()
+
+    def summary(self) -> str:
+        return self.remote.summary()
+
+
+RATE_LIMITER = RateLimiter()
+
+
+def _estimate_tokens(body: bytes) -> int:
+    return len(body) // CHARS_PER_TOKEN
+
+
+def call_with_retries(send, body: bytes):
+    """Run send() under RATE_LIMITER, retrying 429s, 5xx and network errors.
+
+    send() makes one attempt and returns the parsed response; a failure it
+    raises that is not an APIError or a transient network error (say, a
+    stream that broke after tools were already dispatched) is never retried.
+    """
+    estimate = _estimate_tokens(body)
+    attempt = 0
+    while True:
+        while True:
+            hold, attempt = RATE_LIMITER.hold(attempt)
+            if not hold:
+                break
+            time.sleep(hold)
+        time.sleep(RATE_LIMITER.reserve(estimate))
+        try:
+            response = send()
+        except Exception as e:
+            delay = RATE_LIMITER.retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        RATE_LIMITER.succeeded(estimate, response.get("usage"))
+        return response
+
+
+async def _limiter_call(method, *args):
+    """Call a RATE_LIMITER method from the event loop. A RemoteRateLimiter's
+    is a round trip to the coordinating process, so it runs on a thread."""
+    if isinstance(RATE_LIMITER, RemoteRateLimiter):
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def call_with_retries_async(send, body: bytes):
+    """call_with_retries for coroutines: send is an async callable."""
+    estimate = _estimate_tokens(body)
+    attempt = 0
+    while True:
+        while True:
+            hold, attempt = await _limiter_call(RATE_LIMITER.hold, attempt)
+            if not hold:
+                break
+            await asyncio.sleep(hold)
+        await asyncio.sleep(await _limiter_call(RATE_LIMITER.reserve, estimate))
+        try:
+            response = await send()
+        except Exception as e:
+            delay = await _limiter_call(RATE_LIMITER.retry_delay, e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        await _limiter_call(RATE_LIMITER.succeeded, estimate, response.get("usage"))
+        return response
+
+# ── Response cache ────────────────────────────────────────────────────────────
+
+class ResponseCache:
+    """chat() responses on disk, addressed by a hash of the request payload.
+
+    Each entry is one JSON file under RESPONSE_CACHE_DIR/<2 hex>/; a hit
+    bumps the file's mtime, and when the directory grows past max_bytes the
+    least recently used entries are deleted. Files are written via rename,
+    so concurrent agents (or processes) never see half an entry.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._bytes = None                        # computed on the first store
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            response = json.loads(path.read_text(encoding="utf-8"))["response"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, key: str, response: dict):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"model": MODEL, "created": time.time(), "response": response}).encode()
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with open(fd, "wb") as f:
+            f.write(data)
+        try:
+            old = path.stat().st_size
+        except OSError:
+            old = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self.stores += 1
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += len(data) - old
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list:
+        return [e for sub in self.dir.glob("??") for e in os.scandir(sub) if e.name.endswith(".json")]
+
+    def _scan_bytes(self) -> int:
+        return sum(e.stat().st_size for e in self._entries())
+
+    def _evict(self):
+        """Delete least recently used entries down to 90% of the budget."""
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            if self._bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                size = e.stat().st_size
+                os.unlink(e.path)
+                self._bytes -= size
+            except OSError:
+                continue
+
+    def summary(self) -> str:
+        size = f"{self._bytes >> 10} KiB" if self._bytes is not None else "size not scanned"
+        return f"{self.hits} hits, {self.misses} misses, {self.stores} stored ({size}) in {self.dir}"
+
+
+_response_cache = None
+
+
+def response_cache() -> ResponseCache:
+    """The cache for the current RESPONSE_CACHE_DIR."""
+    global _response_cache
+    if _response_cache is None or _response_cache.dir != Path(RESPONSE_CACHE_DIR):
+        _response_cache = ResponseCache(RESPONSE_CACHE_DIR, RESPONSE_CACHE_BYTES)
+    return _response_cache
+
+
+def _cache_lookup(messages: list) -> tuple:
+    """(cache key or None, replayed response or None) under RESPONSE_CACHE."""
+    if RESPONSE_CACHE == "off":
+        return None, None
+    key = ResponseCache.key(_payload(messages))
+    if RESPONSE_CACHE == "record":
+        return key, None
+    response = response_cache().get(key)
+    if response is not None:
+        return key, dict(response, replayed=True)
+    if RESPONSE_CACHE == "replay":
+        raise RuntimeError(f"response cache miss in replay mode (request {key[:12]})")
+    return key, None
+
+
+def _cache_store(key: str, response: dict):
+    if key is not None:
+        response_cache().put(key, response)
+
+
+def _replay_stream(response: dict, on_tool_call=None, on_content=None) -> dict:
+    """Fire a streaming caller's callbacks for a replayed response."""
+    msg = response["choices"][0]["message"]
+    if msg.get("content") and on_content:
+        on_content(msg["content"])
+    for tc in msg.get("tool_calls") or []:
+        if on_tool_call:
+            on_tool_call(tc)
+    return response
+
+# ── DeepSeek API ──────────────────────────────────────────────────────────────
+
+def _payload(messages: list) -> dict:
+    return {
+        "model": MODEL,
+        "messages": messages,
+        "tools": TOOLS,
+        "tool_choice": "auto",
+        "max_tokens": 32768,
+    }
+
+
+def _request_body(messages: list, stream: bool = False) -> bytes:
+    payload = _payload(messages)
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+    return json.dumps(payload).encode()
+
+
+def _headers(api_key: str) -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+
+
+def chat(messages: list, api_key: str) -> dict:
+    key, replayed = _cache_lookup(messages)
+    if replayed:
+        return replayed
+    timer = CallTimer()
+    request = _request_body(messages)
+    timer.serialized(request)
+
+    def send():
+        timer.sending()
+        try:
+            with POOL.stream("POST", API_URL, body=request, headers=_headers(api_key)) as resp:
+                timer.first_byte()
+                body = resp.read()
+        finally:
+            timer.received()
+        if resp.status >= 400:
+            raise APIError(resp.status, dict(resp.getheaders()), body)
+        return json.loads(body)
+
+    response = call_with_retries(send, request)
+    _cache_store(key, response)
+    return timer.attach(response)
+
+
+def _sse_data(raw: bytes):
+    """The payload of an SSE `data:` line, or None for any other line."""
+    line = raw.decode("utf-8").strip()
+    if not line.startswith("data:"):
+        return None
+    return line[5:].strip()
+
+
+def _sse_events(resp):
+    """Yield the decoded JSON payload of each `data:` line in an SSE stream."""
+    for raw in resp:
+        data = _sse_data(raw)
+        if data is None:
+            continue
+        if data == "[DONE]":
+            resp.read()                           # drain so the connection can be reused
+            return
+        yield json.loads(data)
+
+
+async def _sse_events_async(resp: AsyncResponse):
+    async for raw in resp.lines():
+        data = _sse_data(raw)
+        if data is None:
+            continue
+        if data == "[DONE]":
+            await resp.read()
+            return
+        yield json.loads(data)
+
+
+def _args_complete(arguments: str) -> bool:
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(arguments), dict)
+    except ValueError:
+        return False
+
+
+class _StreamAssembler:
+    """Rebuilds a chat() response from streamed deltas.
+
+    on_tool_call(tc) fires as soon as a call's arguments form a complete
+    JSON object (or a later call index shows up), while the model may still
+    be generating later calls; on_content(text) receives content deltas.
+    """
+
+    def __init__(self, on_tool_call=None, on_content=None):
+        self.on_tool_call = on_tool_call
+        self.on_content = on_content
+        self.content = []
+        self.calls = {}                           # index -> tool call being assembled
+        self.dispatched = set()
+        self.finish_reason = None
+        self.usage = None
+
+    @property
+    def started(self) -> bool:
+        """Whether any output has reached the callbacks yet."""
+        return bool(self.content or self.calls)
+
+    def _dispatch(self, idx):
+        if idx in self.dispatched or self.on_tool_call is None:
+            return
+        self.dispatched.add(idx)
+        self.on_tool_call(self.calls[idx])
+
+    def feed(self, event: dict):
+        if event.get("usage"):
+            self.usage = event["usage"]
+        for choice in event.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                self.content.append(delta["content"])
+                if self.on_content:
+                    self.on_content(delta["content"])
+            for part in delta.get("tool_calls") or []:
+                idx = part.get("index", 0)
+                # a new index means every earlier call is finished
+                for prev in list(self.calls):
+                    if prev < idx:
+                        self._dispatch(prev)
+                tc = self.calls.setdefault(idx, {
+                    "id": "", "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                if part.get("id"):
+                    tc["id"] = part["id"]
+                fn = part.get("function") or {}
+                tc["function"]["name"] += fn.get("name") or ""
+                tc["function"]["arguments"] += fn.get("arguments") or ""
+                if _args_complete(tc["function"]["arguments"]):
+                    self._dispatch(idx)
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+
+    def response(self) -> dict:
+        for idx in sorted(self.calls):
+            self._dispatch(idx)
+        msg = {"role": "assistant", "content": "".join(self.content) or None}
+        if self.calls:
+            msg["tool_calls"] = [self.calls[i] for i in sorted(self.calls)]
+        return {
+            "choices": [{"index": 0, "message": msg, "finish_reason": self.finish_reason}],
+            "usage": self.usage,
+        }
+
+
+def chat_stream(messages: list, api_key: str, on_tool_call=None, on_content=None) -> dict:
+    """Streaming variant of chat() that returns the same response shape.
+
+    See _StreamAssembler for when on_tool_call and on_content fire.
+    """
+    key, replayed = _cache_lookup(messages)
+    if replayed:
+        return _replay_stream(replayed, on_tool_call, on_content)
+    timer = CallTimer()
+    request = _request_body(messages, stream=True)
+    timer.serialized(request)
+
+    def send():
+        assembler = _StreamAssembler(on_tool_call, on_content)
+        timer.sending()
+        try:
+            with POOL.stream("POST", API_URL, body=request, headers=_headers(api_key)) as resp:
+                if resp.status >= 400:
+                    raise APIError(resp.status, dict(resp.getheaders()), resp.read())
+                try:
+                    for event in _sse_events(resp):
+                        timer.first_byte()
+                        assembler.feed(event)
+                except TRANSIENT_ERRORS as e:
+                    # content was printed and tools may be running: not safe to redo
+                    if assembler.started:
+                        raise RuntimeError(f"stream broke after output began: {e}") from e
+                    raise
+        finally:
+            timer.received()
+        return assembler.response()
+
+    response = call_with_retries(send, request)
+    _cache_store(key, response)
+    return timer.attach(response)
+
+
+async def chat_async(messages: list, api_key: str) -> dict:
+    key, replayed = _cache_lookup(messages)
+    if replayed:
+        return replayed
+    timer = CallTimer()
+    request = _request_body(messages)
+    timer.serialized(request)
+
+    async def send():
+        timer.sending()
+        try:
+            async with async_pool().stream("POST", API_URL, body=request, headers=_headers(api_key)) as resp:
+                timer.first_byte()
+                body = await resp.read()
+        finally:
+            timer.received()
+        if resp.status >= 400:
+            raise APIError(resp.status, resp.headers, body)
+        return json.loads(body)
+
+    response = await call_with_retries_async(send, request)
+    _cache_store(key, response)
+    return timer.attach(response)
+
+
+async def chat_stream_async(messages: list, api_key: str, on_tool_call=None, on_content=None) -> dict:
+    key, replayed = _cache_lookup(messages)
+    if replayed:
+        return _replay_stream(replayed, on_tool_call, on_content)
+    timer = CallTimer()
+    request = _request_body(messages, stream=True)
+    timer.serialized(request)
+
+    async def send():
+        assembler = _StreamAssembler(on_tool_call, on_content)
+        timer.sending()
+        try:
+            async with async_pool().stream("POST", API_URL, body=request, headers=_headers(api_key)) as resp:
+                if resp.status >= 400:
+                    raise APIError(resp.status, resp.headers, await resp.read())
+                try:
+                    async for event in _sse_events_async(resp):
+                        timer.first_byte()
+                        assembler.feed(event)
+                except TRANSIENT_ERRORS as e:
+                    if assembler.started:
+                        raise RuntimeError(f"stream broke after output began: {e}") from e
+                    raise
+        finally:
+            timer.received()
+        return assembler.response()
+
+    response = await call_with_retries_async(send, request)
+    _cache_store(key, response)
+    return timer.attach(response)
+
+# ── Usage accounting ──────────────────────────────────────────────────────────
+
+class Usage:
+    """Token totals from the API's usage field, including DeepSeek's prefix-cache split.
+
+    Cached prompt prefixes are billed at a discount and served faster, so
+    cache_hit_tokens / prompt_tokens is the number to watch.
+    """
+
+    FIELDS = ("requests", "prompt_tokens", "completion_tokens",
+              "cache_hit_tokens", "cache_miss_tokens", "replayed")
+
+    def __init__(self):
+        for f in self.FIELDS:
+            setattr(self, f, 0)
+
+    def add(self, usage: dict, replayed: bool = False):
+        if replayed:
+            # served from RESPONSE_CACHE: nothing was sent or billed
+            self.replayed += 1
+            return
+        self.requests += 1
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+        self.cache_hit_tokens += usage.get("prompt_cache_hit_tokens", 0)
+        self.cache_miss_tokens += usage.get("prompt_cache_miss_tokens", 0)
+
+    def merge(self, other: "Usage"):
+        for f in self.FIELDS:
+            setattr(self, f, getattr(self, f) + getattr(other, f))
+
+    @property
+    def hit_rate(self) -> float:
+        cached = self.cache_hit_tokens + self.cache_miss_tokens
+        return self.cache_hit_tokens / cached if cached else 0.0
+
+    def as_dict(self) -> dict:
+        return {f: getattr(self, f) for f in self.FIELDS}
+
+    def summary(self) -> str:
+        return (f"{self.requests} requests, {self.prompt_tokens / 1000:.1f}k prompt tokens "
+                f"({self.hit_rate:.0%} cache hit: {self.cache_hit_tokens / 1000:.1f}k hit, "
+                f"{self.cache_miss_tokens / 1000:.1f}k miss), "
+                f"{self.completion_tokens / 1000:.1f}k completion tokens"
+                + (f", {self.replayed} replayed" if self.replayed else ""))
+
+# ── Tracing ───────────────────────────────────────────────────────────────────
+
+class CallTimer:
+    """Where one chat() call's wall time went.
+
+    chat() attaches the result to the response as response["timing"]
+    (milliseconds), next to usage. ttfb_ms is the last attempt's time to
+    the first response byte: the headers for a plain call, which the API
+    sends once the completion is done, or the first event of a stream.
+    wait_ms is everything else: rate limiting and retry backoff.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.serialize_ms = 0.0
+        self.network_ms = 0.0
+        self.ttfb_ms = None
+        self.attempts = 0
+        self.request_bytes = 0
+        self._sent = self.start
+
+    def serialized(self, request: bytes):
+        self.serialize_ms = (time.monotonic() - self.start) * 1000
+        self.request_bytes = len(request)
+
+    def sending(self):
+        self.attempts += 1
+        self.ttfb_ms = None
+        self._sent = time.monotonic()
+
+    def first_byte(self):
+        if self.ttfb_ms is None:
+            self.ttfb_ms = (time.monotonic() - self._sent) * 1000
+
+    def received(self):
+        self.network_ms += (time.monotonic() - self._sent) * 1000
+
+    def attach(self, response: dict) -> dict:
+        total = (time.monotonic() - self.start) * 1000
+        response["timing"] = {
+            "total_ms": round(total, 1),
+            "serialize_ms": round(self.serialize_ms, 1),
+            "wait_ms": round(max(total - self.serialize_ms - self.network_ms, 0), 1),
+            "network_ms": round(self.network_ms, 1),
+            "ttfb_ms": round(self.ttfb_ms, 1) if self.ttfb_ms is not None else None,
+            "attempts": self.attempts,
+            "request_bytes": self.request_bytes,
+        }
+        return response
+
+
+class Tracer:
+    """Appends trace records as JSON lines to one file.
+
+    One instance per path is shared by every agent in the process (see
+    tracer()), so a swarm's turns interleave in a single file; each record
+    carries its run id. Summarize with ds-trace.py.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # unbuffered O_APPEND: one write per record, so processes
+                # sharing the file (ds-swarm --processes) never split a line
+                self._file = open(self.path, "ab", buffering=0)
+            self._file.write(line.encode())
+
+
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def tracer():
+    """The Tracer for TRACE_FILE, or None when tracing is off."""
+    if not TRACE_FILE:
+        return None
+    path = Path(TRACE_FILE)
+    with _tracers_lock:
+        if path not in _tracers:
+            _tracers[path] = Tracer(path)
+        return _tracers[path]
+
+
+class SessionTrace:
+    """Collects one agent run's turns and writes a record per turn.
+
+    Turn records hold the API call's timing and usage, every tool call
+    (args and result size, duration, start offset within the turn) and the
+    size of the history; a final run record holds the totals.
+    """
+
+    def __init__(self, out: Tracer, name: str, task: str):
+        self.out = out
+        self.run = uuid.uuid4().hex[:12]
+        self.name = name
+        self.task = task
+        self.start = time.monotonic()
+        self.turns = 0
+        self.ended = False
+        self._turn = None
+
+    def start_turn(self, turn: int, compacted: int):
+        self._turn = {
+            "turn": turn + 1,
+            "ts": round(time.time(), 3),
+            "start": time.monotonic(),
+            "compacted": compacted,
+            "tools": [],
+        }
+
+    def response(self, response: dict):
+        usage = response.get("usage") or {}
+        self._turn.update(
+            responded=time.monotonic(),
+            api={"replayed": True} if response.get("replayed") else response.get("timing"),
+            tokens={
+                "prompt": usage.get("prompt_tokens", 0),
+                "completion": usage.get("completion_tokens", 0),
+                "cache_hit": usage.get("prompt_cache_hit_tokens", 0),
+                "cache_miss": usage.get("prompt_cache_miss_tokens", 0),
+            },
+        )
+
+    def tool(self, call_id: str, name: str, args: dict, result: str, started: float):
+        if self._turn is None:
+            return
+        now = time.monotonic()
+        self._turn["tools"].append({
+            "id": call_id,
+            "name": name,
+            "args_bytes": len(json.dumps(args)),
+            "result_bytes": len(result),
+            "ms": round((now - started) * 1000, 1),
+            "offset_ms": round((started - self._turn["start"]) * 1000, 1),
+        })
+
+    def end_turn(self, messages: list, context_tokens: int):
+        turn, self._turn = self._turn, None
+        if turn is None:
+            return
+        now = time.monotonic()
+        start, responded = turn.pop("start"), turn.pop("responded", now)
+        turn.update(
+            turn_ms=round((now - start) * 1000, 1),
+            tools_ms=round((now - responded) * 1000, 1),
+            history={"messages": len(messages), "context_tokens": context_tokens},
+        )
+        self.turns += 1
+        self.out.write({"type": "turn", "run": self.run, "agent": self.name, **turn})
+
+    def end(self, status: str, usage: "Usage"):
+        if self.ended:
+            return
+        self.ended = True
+        self.out.write({
+            "type": "run",
+            "run": self.run,
+            "agent": self.name,
+            "task": self.task[:200],
+            "status": status,
+            "turns": self.turns,
+            "ms": round((time.monotonic() - self.start) * 1000, 1),
+            "usage": usage.as_dict(),
+        })
+
+# ── Context compaction ────────────────────────────────────────────────────────
+
+def _summarize_tool_result(name: str, args: dict, content: str, turn: int) -> str:
+    """Stub that replaces an evicted tool result, keeping what is cheap and useful."""
+    lines = content.splitlines()
+    where = args.get("path") or args.get("root") or args.get("command", "")[:80]
+    head = f"[compacted: {name}({where}) from turn {turn+1}, {len(lines)} lines / {len(content)} chars"
+    if name == "bash" and lines:
+        # errors usually sit at the end of the output
+        return head + "; last lines:]\n" + "\n".join(lines[-5:])
+    return head + " — call the tool again if you still need it]"
+
+
+def compact_messages(messages: list, calls: dict, excess_tokens: int) -> tuple:
+    """Stub out old tool results in place until about excess_tokens are freed.
+
+    The system prompt, the task and the last KEEP_RECENT_TURNS assistant
+    turns (with their tool results) are pinned. calls maps tool_call_id to
+    (name, args, turn). Returns (compacted tool_call_ids, tokens freed).
+    """
+    assistant_idx = [i for i, m in enumerate(messages) if m["role"] == "assistant"]
+    if KEEP_RECENT_TURNS <= 0:
+        pinned_from = len(messages)
+    elif len(assistant_idx) >= KEEP_RECENT_TURNS:
+        pinned_from = assistant_idx[-KEEP_RECENT_TURNS]
+    else:
+        pinned_from = 0
+    candidates = [
+        i for i, m in enumerate(messages[:pinned_from])
+        if m["role"] == "tool" and not m["content"].startswith("[compacted:")
+    ]
+    if COMPACT_ORDER == "largest":
+        candidates.sort(key=lambda i: -len(messages[i]["content"]))
+
+    compacted = []
+    freed = 0
+    for i in candidates:
+        if freed >= excess_tokens:
+            break
+        msg = messages[i]
+        name, args, turn = calls.get(msg["tool_call_id"], ("tool", {}, 0))
+        stub = _summarize_tool_result(name, args, msg["content"], turn)
+        saved = (len(msg["content"]) - len(stub)) // CHARS_PER_TOKEN
+        if saved <= 0:
+            continue
+        messages[i] = {**msg, "content": stub}
+        compacted.append(msg["tool_call_id"])
+        freed += saved
+    return compacted, freed
+
+# ── Agent loop ────────────────────────────────────────────────────────────────
+
+class AgentSession:
+    """Conversation state and console output for one agent run.
+
+    run_agent and run_agent_async only differ in how they do I/O; both
+    drive an AgentSession, which owns the message history and everything
+    that happens between API calls and tool calls.
+    """
+
+    def __init__(self, task: str, verbose: bool = True, context: str = None, usage: Usage = None,
+                 name: str = None, on_event=None):
+        self.verbose = verbose
+        self.on_event = on_event                  # called with progress events (see _emit)
+        # Everything that is the same across turns and agents goes first so
+        # DeepSeek's prefix cache can serve it: the system prompt, then any
+        # context shared by a whole swarm, then this agent's task.
+        system = SYSTEM_PROMPT + (f"\n\n{context}" if context else "")
+        self.messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": task},
+        ]
+        self.usage = usage if usage is not None else Usage()
+        self.turn = 0
+        self.pending = {}                         # tool_call_id -> future for this turn
+        self.calls = {}                           # tool_call_id -> (name, args, turn)
+        self.compacted = set()                    # tool_call_ids whose result was stubbed
+        self.reads = {}                           # (path, offset, limit) -> (mtime_ns, size, turn, tool_call_id)
+        self.shell = ShellSession() if PERSISTENT_SHELL else None
+        self.typecheck_seen = {}                  # {path: (mtime_ns, size)} as of this agent's last typecheck
+        # tools run on ToolScheduler threads; these guard reads and typecheck_seen
+        self._reads_lock = threading.Lock()
+        self._typecheck_lock = threading.Lock()
+        if TYPECHECK_WARM:
+            warm_typechecker()
+        self.context_tokens = 0                   # estimated size of the next prompt
+        self._streamed = False
+        self._turn_started = None                 # monotonic start of the open turn
+        self._responded = False                   # the open turn got its response
+        self._aborted = False                     # on_event raised: the listener stopped the run
+        self._ended = False
+        self.key = hashlib.sha256(f"{name}\0{task}".encode()).hexdigest()[:12]
+        out = tracer()
+        self.trace = SessionTrace(out, name, task) if out else None
+
+        self._emit("task", task=task, name=name)
+        if verbose:
+            print(f"\n{'='*60}", flush=True)
+            print(f"TASK: {task[:200]}", flush=True)
+            print('='*60, flush=True)
+
+    def _emit(self, event: str, **fields):
+        """Tell on_event (the daemon's client, for one) what the agent is doing.
+
+        Events: task, turn, compacted, content (text as it arrives),
+        usage (the turn's tokens), tool_call, tool_result, turn_end (with
+        its wall time; only for turns that got a response) and end (the
+        run's status and token totals). Raising from on_event aborts the
+        run, which then ends with status "aborted".
+        """
+        if self.on_event:
+            try:
+                self.on_event({"event": event, **fields})
+            except Exception:
+                self._aborted = True
+                raise
+
+    def start_turn(self, turn: int):
+        self.end_turn()
+        self.turn = turn
+        self.pending = {}
+        self._streamed = False
+        compacted = len(self.compacted)
+        if CONTEXT_BUDGET and self.context_tokens > CONTEXT_BUDGET:
+            self.compact()
+        if self.trace:
+            self.trace.start_turn(turn, len(self.compacted) - compacted)
+        self._turn_started = time.monotonic()
+        self._responded = False
+        self._emit("turn", turn=turn + 1)
+        if self.verbose:
+            print(f"\n[turn {turn+1}] calling DeepSeek...", flush=True)
+
+    def compact(self):
+        """Bring the history back to ~75% of CONTEXT_BUDGET by stubbing old tool results.
+
+        Rewriting history invalidates the prefix cache from the first
+        changed message on, so this frees a quarter of the budget at once
+        rather than trimming a little every turn.
+        """
+        before = self.context_tokens
+        ids, freed = compact_messages(
+            self.messages, self.calls, before - int(CONTEXT_BUDGET * 0.75),
+        )
+        self.compacted.update(ids)
+        self.context_tokens -= freed
+        if ids:
+            self._emit("compacted", results=len(ids), tokens_before=before, tokens_after=self.context_tokens)
+        if ids and self.verbose:
+            print(f"\n[context] compacted {len(ids)} tool results, "
+                  f"~{before // 1000}k → ~{self.context_tokens // 1000}k tokens", flush=True)
+
+    def parse_call(self, tc: dict):
+        fn_name = tc["function"]["name"]
+        fn_args = json.loads(tc["function"]["arguments"])
+        self.calls[tc["id"]] = (fn_name, fn_args, self.turn)
+        self._emit("tool_call", id=tc["id"], name=fn_name, args=fn_args)
+        if self.verbose:
+            print(f"\n  → {fn_name}({json.dumps(fn_args)[:120]})", flush=True)
+        return fn_name, fn_args
+
+    def _read_key(self, args: dict):
+        p = resolve_path(args["path"])
+        st = p.stat()
+        return (str(p), args.get("offset"), args.get("limit")), (st.st_mtime_ns, st.st_size)
+
+    def _unchanged_read(self, name: str, args: dict):
+        """Marker for a read_file whose earlier result is still in context and
+        still current, else None (which means: really read the file)."""
+        if name != "read_file":
+            return None
+        try:
+            key, version = self._read_key(args)
+        except (OSError, KeyError):
+            return None
+        with self._reads_lock:
+            seen = self.reads.get(key)
+        if not seen or seen[:2] != version or seen[3] in self.compacted:
+            return None
+        return (f"[unchanged since turn {seen[2]+1}: {args['path']} has not been modified; "
+                f"the read_file result you already have is current]")
+
+    def _record_read(self, name: str, args: dict, call_id: str, result: str):
+        if name != "read_file" or result.startswith(("ERROR:", "[unchanged")):
+            return
+        try:
+            key, version = self._read_key(args)
+        except (OSError, KeyError):
+            return
+        with self._reads_lock:
+            self.reads[key] = (*version, self.turn, call_id)
+
+    def _record(self, name: str, args: dict, call_id: str, result: str):
+        if name in ("write_file", "edit_file", "multi_edit"):
+            path = str(resolve_path(args["path"]))
+            with self._reads_lock:
+                for key in [k for k in self.reads if k[0] == path]:
+                    del self.reads[key]
+        elif name == "apply_patch":
+            with self._reads_lock:
+                self.reads.clear()                # a patch can touch any number of files
+        else:
+            self._record_read(name, args, call_id, result)
+
+    def _typecheck(self, **args) -> str:
+        with self._typecheck_lock:
+            return tool_typecheck(**args, seen=self.typecheck_seen)
+
+    def _shell_bash(self, command: str, cwd: str = None) -> str:
+        TRIGRAM_INDEX.mark_stale()
+        TREE.mark_stale()
+        return self.shell.run(command, cwd)
+
+    def run_tool(self, call_id: str, name: str, args: dict) -> str:
+        """execute_tool plus the session's unchanged-reread short-circuit,
+        its typecheck baseline and, with PERSISTENT_SHELL, its own bash."""
+        started = time.monotonic()
+        token = TOOL_CALL.set(f"{self.key}/{call_id}")
+        try:
+            result = self._run_tool(call_id, name, args)
+        finally:
+            TOOL_CALL.reset(token)             # pool threads keep their context
+        if self.trace:
+            self.trace.tool(call_id, name, args, result, started)
+        return result
+
+    async def run_tool_async(self, call_id: str, name: str, args: dict) -> str:
+        started = time.monotonic()
+        token = TOOL_CALL.set(f"{self.key}/{call_id}")
+        try:
+            result = await self._run_tool_async(call_id, name, args)
+        finally:
+            TOOL_CALL.reset(token)
+        if self.trace:
+            self.trace.tool(call_id, name, args, result, started)
+        return result
+
+    def _run_tool(self, call_id: str, name: str, args: dict) -> str:
+        if name == "bash" and self.shell:
+            return self._shell_bash(**args)
+        if name == "typecheck":
+            return self._typecheck(**args)
+        result = self._unchanged_read(name, args) or execute_tool(name, args)
+        self._record(name, args, call_id, result)
+        return result
+
+    async def _run_tool_async(self, call_id: str, name: str, args: dict) -> str:
+        if name == "bash" and self.shell:
+            return await asyncio.to_thread(self._shell_bash, **args)
+        if name == "typecheck":
+            return await asyncio.to_thread(self._typecheck, **args)
+        result = self._unchanged_read(name, args) or await execute_tool_async(name, args)
+        self._record(name, args, call_id, result)
+        return result
+
+    def end_turn(self):
+        if self.trace:
+            self.trace.end_turn(self.messages, self.context_tokens)
+        if self._turn_started is not None:
+            ms = (time.monotonic() - self._turn_started) * 1000
+            self._turn_started = None
+            if self._responded:                   # a failed request is not a turn
+                self._emit("turn_end", turn=self.turn + 1, ms=round(ms, 1))
+
+    def end(self, status: str):
+        """Close the trace and the event stream with the run's outcome (the first call wins)."""
+        if self._ended:
+            return
+        self._ended = True
+        self.end_turn()
+        if self.trace:
+            self.trace.end(status, self.usage)
+        self._emit("end", status=status, turns=self.turn + 1, usage=self.usage.as_dict())
+
+    def close(self):
+        try:
+            self.end("aborted" if self._aborted else "error")
+        finally:
+            if self.shell:
+                self.shell.close()
+
+    def _stream_content(self, text: str):
+        if self.verbose:
+            if not self._streamed:
+                print("\n[assistant] ", end="", flush=True)
+            print(text, end="", flush=True)
+        self._streamed = True
+        self._emit("content", text=text)
+
+    @property
+    def on_content(self):
+        """Content-delta callback for streamed turns (None when nobody is listening)."""
+        return self._stream_content if self.verbose or self.on_event else None
+
+    def add_response(self, response: dict) -> list:
+        """Record the assistant message and return its tool calls."""
+        msg = response["choices"][0]["message"]
+        self.messages.append(msg)
+        self._responded = True
+
+        # The API counts the prompt exactly; the reply and tool results that
+        # follow are estimated until the next response.
+        usage = response.get("usage") or {}
+        if usage:
+            self.usage.add(usage, replayed=response.get("replayed", False))
+        if self.trace:
+            self.trace.response(response)
+        self._emit("usage", turn=self.turn + 1, replayed=response.get("replayed", False),
+                   prompt_tokens=usage.get("prompt_tokens", 0),
+                   completion_tokens=usage.get("completion_tokens", 0),
+                   cache_hit_tokens=usage.get("prompt_cache_hit_tokens", 0))
+        if usage.get("prompt_tokens"):
+            self.context_tokens = usage["prompt_tokens"] + usage.get("completion_tokens", 0)
+        else:
+            self.context_tokens += len(json.dumps(msg)) // CHARS_PER_TOKEN
+
+        # Extract text content if any
+        content = msg.get("content") or ""
+        if content and not self._streamed:
+            self._emit("content", text=content)
+        if content and self.verbose:
+            if self._streamed:
+                print(flush=True)
+            else:
+                print(f"\n[assistant] {content[:500]}", flush=True)
+        return msg.get("tool_calls") or []
+
+    def add_tool_result(self, tc: dict, result: str):
+        self._emit("tool_result", id=tc["id"], name=tc["function"]["name"], chars=len(result),
+                   preview=result[:300])
+        if self.verbose:
+            preview = result[:300].replace("\n", "\\n")
+            print(f"    ← {preview}", flush=True)
+        self.context_tokens += len(result) // CHARS_PER_TOKEN
+        self.messages.append({
+            "role": "tool",
+            "tool_call_id": tc["id"],
+            "content": result,
+        })
+
+    def finish(self) -> str:
+        self.end("ok")
+        if self.verbose:
+            print(f"\n{'='*60}", flush=True)
+            print("DONE", flush=True)
+            print(f"usage: {self.usage.summary()}", flush=True)
+        return self.messages[-1].get("content") or ""
+
+
+def run_agent(task: str, api_key: str, verbose: bool = True,
+              context: str = None, usage: Usage = None, name: str = None,
+              on_event=None) -> str:
+    """Run one task to completion and return the final assistant message.
+
+    context is prepended to the system prompt (keep it byte-identical across
+    agents so it stays in the prefix cache); pass a Usage to collect the
+    run's token and cache-hit totals. name labels the run in TRACE_FILE;
+    on_event receives progress events as dicts (see AgentSession._emit).
+    """
+    session = AgentSession(task, verbose, context, usage, name, on_event)
+    # In stream mode tools are scheduled while the model is still writing
+    # later calls; otherwise the whole batch is scheduled once it arrives.
+    scheduler = ToolScheduler()
+
+    def start_tool(tc):
+        name, args = session.parse_call(tc)
+        session.pending[tc["id"]] = scheduler.submit(
+            name, args, lambda: session.run_tool(tc["id"], name, args),
+        )
+
+    try:
+        for turn in range(MAX_TURNS):
+            session.start_turn(turn)
+            if STREAM:
+                response = chat_stream(
+                    session.messages, api_key,
+                    on_tool_call=start_tool, on_content=session.on_content,
+                )
+            else:
+                response = chat(session.messages, api_key)
+
+            tool_calls = session.add_response(response)
+            if not tool_calls:
+                return session.finish()
+
+            # Schedule the tool calls not already started, then collect
+            # every result in tool_call order
+            for tc in tool_calls:
+                if tc["id"] not in session.pending:
+                    start_tool(tc)
+            for tc in tool_calls:
+                session.add_tool_result(tc, session.pending[tc["id"]].result())
+        session.end("max_turns")
+    finally:
+        scheduler.shutdown()
+        session.close()
+
+    return "ERROR: max turns reached"
+
+
+async def run_agent_async(task: str, api_key: str, verbose: bool = True,
+                          context: str = None, usage: Usage = None, name: str = None,
+                          on_event=None) -> str:
+    """asyncio version of run_agent.
+
+    HTTP goes through the event loop's AsyncConnectionPool, bash and grep
+    run as async subprocesses and file tools are offloaded to threads, so a
+    single loop can drive hundreds of agents (see ds-swarm.py --async).
+    """
+    session = AgentSession(task, verbose, context, usage, name, on_event)
+    scheduler = AsyncToolScheduler()
+
+    def start_tool(tc):
+        name, args = session.parse_call(tc)
+        session.pending[tc["id"]] = scheduler.submit(
+            name, args, lambda: session.run_tool_async(tc["id"], name, args),
+        )
+
+    try:
+        for turn in range(MAX_TURNS):
+            session.start_turn(turn)
+            if STREAM:
+                response = await chat_stream_async(
+                    session.messages, api_key,
+                    on_tool_call=start_tool, on_content=session.on_content,
+                )
+            else:
+                response = await chat_async(session.messages, api_key)
+
+            tool_calls = session.add_response(response)
+            if not tool_calls:
+                return session.finish()
+
+            for tc in tool_calls:
+                if tc["id"] not in session.pending:
+                    start_tool(tc)
+            for tc in tool_calls:
+                session.add_tool_result(tc, await session.pending[tc["id"]])
+        session.end("max_turns")
+    finally:
+        await scheduler.shutdown()
+        session.close()
+
+    return "ERROR: max turns reached"
+
+# ── Daemon ────────────────────────────────────────────────────────────────────
+
+class ClientGone(Exception):
+    """The daemon's client hung up; raised out of the run to abandon it.
+
+    Not an OSError, so retry loops and stream error handling let it through.
+    """
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """One client connection: a JSON request line in, JSON event lines out.
+
+    Requests: {"task": ..., "context": ..., "name": ...} runs a task and
+    streams its progress events, then {"event": "done", "result": ...};
+    {"op": "status"} and {"op": "stop"} manage the daemon.
+    """
+
+    def send(self, event: dict):
+        try:
+            self.wfile.write((json.dumps(event) + "\n").encode())
+            self.wfile.flush()
+        except OSError as e:
+            raise ClientGone() from e
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except ValueError as e:
+            self.send({"event": "error", "message": f"bad request: {e}"})
+            return
+        op = request.get("op", "run")
+        try:
+            if op == "status":
+                self.send({"event": "status", **self.server.status()})
+            elif op == "stop":
+                self.send({"event": "stopping"})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            elif op == "run" and request.get("task"):
+                self.run_task(request)
+            else:
+                self.send({"event": "error", "message": f"unknown request: {op}"})
+        except ClientGone:
+            pass                                  # a task it started is abandoned mid-run
+
+    def run_task(self, request: dict):
+        usage = Usage()
+        start = time.monotonic()
+        self.server.started_task()
+        try:
+            result = run_agent(
+                request["task"], self.server.api_key, verbose=False,
+                context=request.get("context"), usage=usage, name=request.get("name"),
+                on_event=self.send,
+            )
+        except ClientGone:
+            raise
+        except Exception as e:
+            self.send({"event": "error", "message": str(e), "usage": usage.as_dict()})
+            return
+        finally:
+            self.server.finished_task()
+        self.send({
+            "event": "done",
+            "result": result,
+            "elapsed": round(time.monotonic() - start, 2),
+            "usage": usage.as_dict(),
+            "summary": usage.summary(),
+        })
+
+
+class AgentDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """`ds-agent.py serve`: runs tasks sent over a unix socket (see ds-client.py).
+
+    Everything that makes the first turn of a fresh process slow stays
+    warm between tasks: the resolved API key, POOL's TLS connections,
+    FILE_CACHE/LINE_INDEX/TREE, the trigram index and the tsserver behind
+    typecheck. Each connection runs its task on its own thread, so
+    concurrent clients share one rate limiter like a ds-swarm does.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, api_key: str):
+        self.path = Path(path)
+        self.api_key = api_key
+        self.started = time.monotonic()
+        self.tasks = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(str(self.path))
+                raise RuntimeError(f"a daemon is already listening on {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.path.unlink(missing_ok=True)     # left behind by a daemon that died
+            finally:
+                probe.close()
+        super().__init__(str(self.path), _DaemonHandler)
+        os.chmod(self.path, 0o600)                    # the socket spends our API key
+        self._inode = self.path.stat().st_ino
+
+    def started_task(self):
+        with self._lock:
+            self.tasks += 1
+            self.active += 1
+
+    def finished_task(self):
+        with self._lock:
+            self.active -= 1
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.monotonic() - self.started, 1),
+            "tasks": self.tasks,
+            "active": self.active,
+            "model": MODEL,
+            "root": str(PROJECT_ROOT),
+            "summaries": _summaries(),
+        }
+
+    def server_close(self):
+        super().server_close()
+        try:
+            if self.path.stat().st_ino == self._inode:    # not a newer daemon's socket
+                self.path.unlink()
+        except OSError:
+            pass
+
+
+def serve(argv: list):
+    parser = argparse.ArgumentParser(prog="ds-agent.py serve",
+                                     description="Keep a warm agent running and take tasks over a unix socket")
+    parser.add_argument("--socket", type=Path, default=DAEMON_SOCKET, help=f"(default: {DAEMON_SOCKET})")
+    _add_run_options(parser)
+    args = parser.parse_args(argv)
+    _apply_run_options(args)
+    api_key = _resolve_api_key(args.key)
+
+    if TYPECHECK_WARM:
+        warm_typechecker()
+    if GREP_INDEX:
+        threading.Thread(target=TRIGRAM_INDEX.update, daemon=True).start()
+
+    try:
+        server = AgentDaemon(args.socket, api_key)
+    except RuntimeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    print(f"ds-agent daemon {os.getpid()} listening on {args.socket}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"daemon stopped after {server.tasks} tasks", flush=True)
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def _add_run_options(parser: argparse.ArgumentParser):
+    """Flags shared by a one-off run and `serve`."""
+    parser.add_argument("--key", "-k", help="DeepSeek API key (or set DEEPSEEK_API_KEY)")
+    parser.add_argument("--model", "-m", default=MODEL, help=f"Model name (default: {MODEL})")
+    parser.add_argument("--stream", "-s", action="store_true",
+                        help="Stream responses and start tools while the model is still generating")
+    parser.add_argument("--persistent-shell", action="store_true",
+                        help="Run bash in one long-lived shell per agent (cwd and env persist)")
+    parser.add_argument("--context-budget", type=int, default=CONTEXT_BUDGET,
+                        help=f"Compact old tool results above this many prompt tokens, 0 = never (default: {CONTEXT_BUDGET})")
+    parser.add_argument("--rpm", type=int, default=RATE_RPM, help="Cap API requests per minute (0 = no cap)")
+    parser.add_argument("--tpm", type=int, default=RATE_TPM, help="Cap API tokens per minute (0 = no cap)")
+    parser.add_argument("--response-cache", choices=["off", "record", "replay", "replay-or-record"],
+                        default=RESPONSE_CACHE, help="Record API responses to disk or replay them offline")
+    parser.add_argument("--response-cache-dir", type=Path, default=RESPONSE_CACHE_DIR,
+                        help=f"Where recorded responses live (default: {RESPONSE_CACHE_DIR})")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Append per-turn timing and token records to FILE (summarize with ds-trace.py)")
+
+
+def _apply_run_options(args):
+    global MODEL, STREAM, CONTEXT_BUDGET, PERSISTENT_SHELL, RATE_RPM, RATE_TPM, RESPONSE_CACHE, RESPONSE_CACHE_DIR
+    global TRACE_FILE
+    MODEL = args.model
+    STREAM = args.stream
+    CONTEXT_BUDGET = args.context_budget
+    PERSISTENT_SHELL = args.persistent_shell
+    RATE_RPM = args.rpm
+    RATE_TPM = args.tpm
+    RESPONSE_CACHE = args.response_cache
+    RESPONSE_CACHE_DIR = args.response_cache_dir
+    TRACE_FILE = args.trace
+
+
+def _resolve_api_key(key: str = None) -> str:
+    api_key = key or os.environ.get("DEEPSEEK_API_KEY")
     if not api_key:
         # Check ~/.deepseek
         key_file = Path.home() / ".deepseek"
@@ -354,6 +4073,29 @@ def main():
     if not api_key:
         print("ERROR: No API key. Set DEEPSEEK_API_KEY, use --key, or put key in ~/.deepseek", file=sys.stderr)
         sys.exit(1)
+    return api_key
+
+
+def _summaries() -> list:
+    lines = [POOL.summary(), f"rate limiter: {RATE_LIMITER.summary()}", *cache_summaries()]
+    if RESPONSE_CACHE != "off":
+        lines.append(f"response cache: {response_cache().summary()}")
+    return lines
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description="DeepSeek coding agent (`ds-agent.py serve --help` for the daemon)")
+    parser.add_argument("task", nargs="?", help="Task description")
+    parser.add_argument("--file", "-f", help="Read task from file")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Only print final result")
+    _add_run_options(parser)
+    args = parser.parse_args()
+
+    # Resolve API key
+    api_key = _resolve_api_key(args.key)
 
     # Resolve task
     if args.file:
@@ -366,11 +4108,15 @@ def main():
         print("ERROR: provide a task via argument, --file, or stdin", file=sys.stderr)
         sys.exit(1)
 
-    MODEL = args.model
+    _apply_run_options(args)
 
     result = run_agent(task, api_key, verbose=not args.quiet)
     if args.quiet:
         print(result)
+    else:
+        print(f"\n{POOL.summary()}", flush=True)
+        for line in _summaries()[1:]:
+            print(line, flush=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the ds-agent tool layer.
+
+Usage:
+  python3 ds-bench.py grep                      # default query set
+  python3 ds-bench.py grep "useQuery" "trpc\.\w+\.useMutation" --repeat 5
+  python3 ds-bench.py grep --root ../anavi --file-glob '*.tsx'
+  python3 ds-bench.py index                     # walk vs. trigram-index search
+  python3 ds-bench.py patch                     # write_file vs. apply_patch on a large .tsx
+  python3 ds-bench.py patch --file client/src/pages/Verification.tsx --edits 3 10 30
+  python3 ds-bench.py agents                    # 1/10/100 agents against the local API stub
+  python3 ds-bench.py agents --agents 50 --modes async swarm-async --scenario bash-flood --stream
+
+grep: runs each pattern through the old subprocess path (`grep -rn` over
+the whole tree) and through the in-process search engine behind
+tool_grep, and reports median wall time and matching lines for both.
+
+index: runs each pattern through the search engine twice, once walking
+the tree and once restricted to the trigram index's candidate files
+(including the index freshness check), after building/updating the index.
+
+patch: makes N scattered one-line edits to a large file and compares
+sending the whole new file through write_file with sending a unified
+diff through apply_patch: output tokens the model has to generate,
+estimated generation time at --tokens-per-sec, and the tool's own wall
+time. The "fuzzy" column applies the same diff with bare @@ headers and
+re-indented context, which exercises hunk location by content.
+
+agents: starts ds-stub.py (a scripted local stand-in for the API, see its
+docstring) in its own process and runs N concurrent agents against it,
+in-process through run_agent threads ("thread") or run_agent_async
+("async"), and end to end through ds-swarm.py ("swarm", "swarm-async").
+Reports wall time, turns per second, the API's share of a turn, the
+per-turn overhead of the agent itself (turn time minus API network time
+minus tool time, from the --trace records) and memory growth. The stub's
+--latency/--tps make the API slow the way the real one is; the overhead
+column is what's left once that is taken out. --processes N runs the swarm
+modes with ds-swarm.py --processes N, to compare sharding across cores
+with one process at the same agent count.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import difflib
+import tempfile
+import statistics
+import threading
+import subprocess
+from pathlib import Path
+
+# Import agent runner from same directory
+sys.path.insert(0, str(Path(__file__).parent))
+import ds_agent as da  # ds-agent.py imported as ds_agent
+
+GREP_QUERIES = [
+    "useState",                                   # common literal
+    "trpc\\.\\w+\\.\\w+\\.useQuery",              # regex
+    "ShellRoute",                                 # rare literal
+    "TODO|FIXME",                                 # alternation
+]
+
+INDEX_QUERIES = GREP_QUERIES + [
+    "createTRPCRouter|publicProcedure",           # large alternation
+    "useMutation\\(\\{\\s*onSuccess",            # regex with a long literal
+    "(?i)relationship custody",                   # case-insensitive phrase
+]
+
+
+def timed(fn, repeat: int):
+    """Run fn repeat times; return (median ms, last result)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def subprocess_grep(pattern: str, root: str, file_glob: str = None) -> list:
+    cmd = ["grep", "-rnE", "--color=never"]
+    if file_glob:
+        cmd += ["--include", file_glob]
+    cmd += [pattern, root]
+    out = subprocess.run(cmd, capture_output=True, text=True, errors="replace", timeout=300).stdout
+    return out.splitlines()
+
+
+def engine_grep(pattern: str, root: str, file_glob: str = None) -> list:
+    return [
+        (path, n)
+        for path, lines in da.search(pattern, root, file_glob, max_matches=10**9)
+        for n, _, is_match in lines if is_match
+    ]
+
+
+def cmd_grep(args):
+    queries = args.patterns or GREP_QUERIES
+    root = str(Path(args.root).resolve())
+    print(f"root: {root}  (repeat={args.repeat}, median shown)\n")
+    print(f"{'pattern':<36} {'grep -rn':>12} {'lines':>8} {'engine':>12} {'lines':>8} {'speedup':>8}")
+    for pattern in queries:
+        sub_ms, sub = timed(lambda: subprocess_grep(pattern, root, args.file_glob), args.repeat)
+        eng_ms, eng = timed(lambda: engine_grep(pattern, root, args.file_glob), args.repeat)
+        print(f"{pattern[:36]:<36} {sub_ms:>10.1f}ms {len(sub):>8} "
+              f"{eng_ms:>10.1f}ms {len(eng):>8} {sub_ms / max(eng_ms, 0.001):>7.1f}x")
+    print("\nline counts differ where grep -rn walks node_modules/dist/ignored files the engine skips")
+
+
+def cmd_index(args):
+    queries = args.patterns or INDEX_QUERIES
+    root = str(Path(args.root).resolve())
+    index = da.TrigramIndex(root)
+    start = time.perf_counter()
+    stats = index.update()
+    print(f"root: {root}\nindex update: {stats['reindexed']} of {stats['scanned']} files reindexed "
+          f"in {(time.perf_counter() - start) * 1000:.0f}ms  (repeat={args.repeat}, median shown)\n")
+    print(f"{'pattern':<36} {'walk':>10} {'files':>7} {'index':>10} {'cands':>7} {'matches':>8} {'speedup':>8}")
+    for pattern in queries:
+        walk_ms, walk = timed(lambda: [p for p, _ in da.search(pattern, root, max_matches=10**9)], args.repeat)
+
+        def indexed():
+            index.mark_stale() if args.cold else None
+            cands = index.candidates(pattern, root)
+            return cands, [p for p, _ in da.search(pattern, root, max_matches=10**9, files=cands)]
+
+        idx_ms, (cands, hits) = timed(indexed, args.repeat)
+        assert cands is None or hits == walk, f"index missed matches for {pattern!r}"
+        print(f"{pattern[:36]:<36} {walk_ms:>8.1f}ms {len(walk):>7} {idx_ms:>8.1f}ms "
+              f"{'-' if cands is None else len(cands):>7} {len(hits):>8} {walk_ms / max(idx_ms, 0.001):>7.1f}x")
+
+
+def largest_source(root: Path) -> Path:
+    return Path(max(da.iter_files(str(root), "*.tsx"), key=lambda p: Path(p).stat().st_size))
+
+
+def edited(lines: list, n: int) -> list:
+    """lines with n evenly spaced non-blank lines changed."""
+    out = list(lines)
+    candidates = [i for i, line in enumerate(lines) if line.strip()]
+    for i in candidates[len(candidates) // (2 * n)::max(len(candidates) // n, 1)][:n]:
+        out[i] = out[i] + "  // edited"
+    return out
+
+
+def fuzzed(patch: str) -> str:
+    """The same diff as a model might write it: no line numbers, context re-indented."""
+    out = []
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            line = "@@"
+        elif line.startswith(" "):
+            line = " " + line.strip()
+        out.append(line)
+    return "\n".join(out) + "\n"
+
+
+def cmd_patch(args):
+    source = da.resolve_path(args.file) if args.file else largest_source(da.PROJECT_ROOT)
+    original = source.read_text(encoding="utf-8")
+    lines = original.splitlines(keepends=True)
+    tps = args.tokens_per_sec
+    print(f"file: {source} ({len(lines)} lines, {len(original)} chars)  "
+          f"(repeat={args.repeat}, median shown; generation at {tps:g} tok/s)\n")
+    print(f"{'edits':>5} {'write tok':>10} {'patch tok':>10} {'gen write':>10} {'gen patch':>10} "
+          f"{'write_file':>11} {'apply_patch':>12} {'fuzzy':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / source.name
+        for n in args.edits:
+            new = "".join(edited(lines, n))
+            patch = "".join(difflib.unified_diff(lines, new.splitlines(keepends=True),
+                                                 f"a/{source.name}", f"b/{source.name}"))
+
+            def run(tool, **kwargs):
+                def go():
+                    target.write_text(original, encoding="utf-8")
+                    result = tool(**kwargs)
+                    assert not result.startswith("ERROR"), result
+                    assert target.read_text(encoding="utf-8") == new
+                return go
+
+            write_ms, _ = timed(run(da.tool_write_file, path=str(target), content=new), args.repeat)
+            patch_ms, _ = timed(run(da.tool_apply_patch, patch=patch, path=str(target)), args.repeat)
+            fuzzy_ms, _ = timed(run(da.tool_apply_patch, patch=fuzzed(patch), path=str(target)), args.repeat)
+            write_tok = len(new) // da.CHARS_PER_TOKEN
+            patch_tok = len(patch) // da.CHARS_PER_TOKEN
+            print(f"{n:>5} {write_tok:>10} {patch_tok:>10} {write_tok / tps:>9.1f}s {patch_tok / tps:>9.1f}s "
+                  f"{write_ms:>9.2f}ms {patch_ms:>10.2f}ms {fuzzy_ms:>7.2f}ms")
+    print(f"\ntokens estimated at {da.CHARS_PER_TOKEN} chars/token; generation time dominates both tools")
+
+
+def start_stub(args, tree: Path) -> tuple:
+    """Run ds-stub.py in its own process; returns (process, API url)."""
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / "ds-stub.py"), "--tree", str(tree),
+         "--scenario", args.scenario, "--latency", str(args.latency), "--jitter", "0",
+         "--tps", str(args.tps)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    line = proc.stdout.readline()
+    if not line.startswith("listening on "):
+        proc.kill()
+        raise RuntimeError(f"ds-stub.py did not start: {line!r}")
+    return proc, line.split()[-1]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def bench_tasks(args, n: int, label: str) -> list:
+    # a unique task per agent and run: the stub keys conversations on it
+    return [{"name": f"bench-{label}-{i}", "task": f"scenario: {args.scenario} (bench {label}, agent {i})"}
+            for i in range(n)]
+
+
+def run_in_process(tasks: list, mode: str) -> tuple:
+    """Run tasks with run_agent threads or run_agent_async; returns (failures, RSS growth MB)."""
+    results = []
+    before = rss_mb()
+    if mode == "thread":
+        def one(t):
+            results.append(da.run_agent(t["task"], "stub", verbose=False, name=t["name"]))
+        threads = [threading.Thread(target=one, args=(t,)) for t in tasks]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+    else:
+        async def run_all():
+            return await asyncio.gather(*(
+                da.run_agent_async(t["task"], "stub", verbose=False, name=t["name"]) for t in tasks
+            ), return_exceptions=True)
+        results = asyncio.run(run_all())
+    failures = sum(1 for r in results if not isinstance(r, str) or r.startswith("ERROR"))
+    return failures + len(tasks) - len(results), rss_mb() - before
+
+
+def run_swarm(tasks: list, mode: str, args, url: str, trace: Path) -> tuple:
+    """Run tasks through ds-swarm.py; returns (failures, the swarm's peak RSS MB)."""
+    cmd = [sys.executable, str(Path(__file__).parent / "ds-swarm.py"), "--tasks", json.dumps(tasks),
+           "--trace", str(trace), "--concurrency", "0"]
+    cmd += ["--processes", str(args.processes)] if args.processes else []
+    cmd += ["--async"] if mode == "swarm-async" else []
+    cmd += ["--stream"] if args.stream else []
+    env = dict(os.environ, DEEPSEEK_API_URL=url, DEEPSEEK_API_KEY="stub")
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    failures = out.count(" FAILED in ") + (proc.returncode != 0)
+    return failures, usage.ru_maxrss / 1024
+
+
+def cmd_agents(args):
+    da.STREAM = args.stream
+    da.TYPECHECK_WARM = False
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        proc, url = start_stub(args, tmp / "tree")
+        da.API_URL = url
+        da.PROJECT_ROOT = tmp / "tree"
+        try:
+            print(f"stub: {url}  scenario={args.scenario} latency={args.latency:g}ms tps={args.tps:g} "
+                  f"stream={args.stream}\n")
+            print(f"{'agents':>6} {'mode':<12} {'wall':>8} {'turns':>6} {'turns/s':>8} {'turn p50':>9} "
+                  f"{'api p50':>8} {'overhead':>9} {'memory':>12} {'failed':>7}")
+            for n in args.agents:
+                for mode in args.modes:
+                    label = f"{mode}-{n}-{time.monotonic_ns()}"
+                    trace = tmp / f"{label}.jsonl"
+                    tasks = bench_tasks(args, n, label)
+                    start = time.perf_counter()
+                    if mode.startswith("swarm"):
+                        failed, memory = run_swarm(tasks, mode, args, url, trace)
+                        memory = f"{memory:.0f}MB peak"
+                    else:
+                        da.TRACE_FILE = str(trace)
+                        failed, memory = run_in_process(tasks, mode)
+                        memory = f"{memory:+.0f}MB"
+                    wall = time.perf_counter() - start
+                    turns = [json.loads(line) for line in trace.read_text().splitlines()
+                             if '"type":"turn"' in line] if trace.exists() else []
+                    turn_ms = [t["turn_ms"] for t in turns]
+                    api_ms = [(t.get("api") or {}).get("network_ms", 0) for t in turns]
+                    overhead = [t["turn_ms"] - a - t["tools_ms"] for t, a in zip(turns, api_ms)]
+                    print(f"{n:>6} {mode:<12} {wall:>7.2f}s {len(turns):>6} {len(turns) / wall:>8.1f} "
+                          f"{statistics.median(turn_ms) if turns else 0:>7.0f}ms "
+                          f"{statistics.median(api_ms) if turns else 0:>6.0f}ms "
+                          f"{statistics.mean(overhead) if turns else 0:>7.2f}ms {memory:>12} {failed:>7}",
+                          flush=True)
+        finally:
+            da.TRACE_FILE = None
+            proc.kill()
+            proc.wait()
+    print("\noverhead = turn time - API network time - tool time, mean per turn; "
+          "memory = RSS growth in-process, peak RSS of the ds-swarm.py process")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ds-agent tool benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("grep", help="subprocess grep vs the in-process search engine")
+    p.add_argument("patterns", nargs="*", help="Regex patterns (default: built-in query set)")
+    p.add_argument("--root", default=str(da.PROJECT_ROOT), help="Tree to search (default: anavi/)")
+    p.add_argument("--file-glob", help="Only search files matching this glob")
+    p.add_argument("--repeat", "-r", type=int, default=3)
+    p.set_defaults(fn=cmd_grep)
+
+    p = sub.add_parser("index", help="tree walk vs. trigram-index candidates")
+    p.add_argument("patterns", nargs="*", help="Regex patterns (default: built-in query set)")
+    p.add_argument("--root", default=str(da.PROJECT_ROOT), help="Tree to search (default: anavi/)")
+    p.add_argument("--repeat", "-r", type=int, default=3)
+    p.add_argument("--cold", action="store_true", help="Force the mtime rescan on every indexed query")
+    p.set_defaults(fn=cmd_index)
+
+    p = sub.add_parser("patch", help="full-file write_file vs. apply_patch diffs")
+    p.add_argument("--file", help="File to edit (default: the largest .tsx under anavi/)")
+    p.add_argument("--edits", type=int, nargs="+", default=[1, 5, 20],
+                   help="Numbers of scattered one-line edits to try")
+    p.add_argument("--tokens-per-sec", type=float, default=40.0,
+                   help="Model output speed for the generation-time estimate")
+    p.add_argument("--repeat", "-r", type=int, default=5)
+    p.set_defaults(fn=cmd_patch)
+
+    p = sub.add_parser("agents", help="agent loop throughput against the local API stub")
+    p.add_argument("--agents", type=int, nargs="+", default=[1, 10, 100], help="Concurrent agent counts")
+    p.add_argument("--modes", nargs="+", choices=["thread", "async", "swarm", "swarm-async"],
+                   default=["thread", "async", "swarm"])
+    p.add_argument("--scenario", choices=["explore", "edit-storm", "bash-flood", "mixed"], default="mixed")
+    p.add_argument("--latency", type=float, default=200.0, help="Stub ms before the first byte")
+    p.add_argument("--tps", type=float, default=200.0, help="Stub completion tokens per second (0 = instant)")
+    p.add_argument("--stream", action="store_true", help="Use streamed completions")
+    p.add_argument("--processes", type=int, default=0, help="Worker processes for the swarm modes")
+    p.set_defaults(fn=cmd_agents)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Send a task to a running `ds-agent.py serve` daemon and print its progress.
+
+Usage:
+  python3 ds-agent.py serve &                 # once: keeps key, caches and tsserver warm
+  python3 ds-client.py "your task here"
+  echo "your task" | python3 ds-client.py --quiet
+  python3 ds-client.py --file task.txt
+  python3 ds-client.py --status
+  python3 ds-client.py --stop
+
+Takes the same task arguments as ds-agent.py and prints the same console
+output, so loops that call ds-agent.py over and over can call this
+instead. Only stdlib modules that load in a few milliseconds are imported;
+all the work happens in the daemon. If no daemon is listening the task runs
+in a fresh ds-agent.py process instead (unless --no-fallback).
+
+Exit status: 0 when the agent finished, 1 on an error or an ERROR result,
+2 when the daemon isn't reachable and there is no fallback.
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+from pathlib import Path
+
+DEFAULT_SOCKET = Path.home() / ".cache" / "ds-agent" / "daemon.sock"   # ds-agent's DAEMON_SOCKET
+
+
+def connect(path: Path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def events(sock, request: dict):
+    sock.sendall((json.dumps(request) + "\n").encode())
+    with sock.makefile("rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def render(event: dict, state: dict):
+    """Print an event the way ds-agent.py prints the same moment of a run."""
+    kind = event["event"]
+    if kind == "task":
+        print(f"\n{'='*60}\nTASK: {event['task'][:200]}\n{'='*60}", flush=True)
+    elif kind == "turn":
+        if state.get("streaming"):
+            print(flush=True)
+        state["streaming"] = False
+        print(f"\n[turn {event['turn']}] calling DeepSeek...", flush=True)
+    elif kind == "compacted":
+        print(f"\n[context] compacted {event['results']} tool results, "
+              f"~{event['tokens_before'] // 1000}k → ~{event['tokens_after'] // 1000}k tokens", flush=True)
+    elif kind == "content":
+        if not state.get("streaming"):
+            print("\n[assistant] ", end="", flush=True)
+            state["streaming"] = True
+        print(event["text"], end="", flush=True)
+    elif kind == "tool_call":
+        if state.get("streaming"):
+            print(flush=True)
+            state["streaming"] = False
+        print(f"\n  → {event['name']}({json.dumps(event['args'])[:120]})", flush=True)
+    elif kind == "tool_result":
+        preview = event["preview"].replace("\n", "\\n")
+        print(f"    ← {preview}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a task on the ds-agent daemon")
+    parser.add_argument("task", nargs="?", help="Task description")
+    parser.add_argument("--file", "-f", help="Read task from file")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Only print final result")
+    parser.add_argument("--name", help="Label for the run in the daemon's --trace file")
+    parser.add_argument("--socket", type=Path, default=Path(os.environ.get("DS_AGENT_SOCKET", DEFAULT_SOCKET)))
+    parser.add_argument("--status", action="store_true", help="Show what the daemon has warm and exit")
+    parser.add_argument("--stop", action="store_true", help="Shut the daemon down")
+    parser.add_argument("--no-fallback", action="store_true",
+                        help="Fail instead of running ds-agent.py when no daemon is listening")
+    args = parser.parse_args()
+
+    sock = connect(args.socket)
+    if args.status or args.stop:
+        if sock is None:
+            print(f"no daemon listening on {args.socket}", file=sys.stderr)
+            sys.exit(2)
+        for event in events(sock, {"op": "status" if args.status else "stop"}):
+            if event["event"] == "status":
+                print(f"pid {event['pid']}, up {event['uptime']:.0f}s, model {event['model']}, "
+                      f"{event['tasks']} tasks run, {event['active']} running\nroot: {event['root']}")
+                print("\n".join(event["summaries"]))
+            else:
+                print(event["event"])
+        return
+
+    if args.file:
+        task = Path(args.file).read_text().strip()
+    elif args.task:
+        task = args.task
+    elif not sys.stdin.isatty():
+        task = sys.stdin.read().strip()
+    else:
+        print("ERROR: provide a task via argument, --file, or stdin", file=sys.stderr)
+        sys.exit(1)
+
+    if sock is None:
+        if args.no_fallback:
+            print(f"ERROR: no daemon listening on {args.socket} (start one with: python3 ds-agent.py serve)",
+                  file=sys.stderr)
+            sys.exit(2)
+        agent = str(Path(__file__).parent / "ds-agent.py")
+        # "--": a task starting with "-" (or reading "serve") is still the task
+        os.execv(sys.executable, [sys.executable, agent, *(["--quiet"] if args.quiet else []), "--", task])
+
+    state = {}
+    try:
+        for event in events(sock, {"task": task, "name": args.name}):
+            if event["event"] == "done":
+                if args.quiet:
+                    print(event["result"])
+                else:
+                    if state.get("streaming"):
+                        print(flush=True)
+                    print(f"\n{'='*60}\nDONE ({event['elapsed']:.1f}s)\nusage: {event['summary']}", flush=True)
+                sys.exit(1 if event["result"].startswith("ERROR") else 0)
+            if event["event"] == "error":
+                print(f"ERROR: {event['message']}", file=sys.stderr)
+                sys.exit(1)
+            if not args.quiet:
+                render(event, state)
+    except KeyboardInterrupt:
+        sys.exit(130)                             # closing the socket abandons the run
+    print("ERROR: the daemon closed the connection mid-run", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
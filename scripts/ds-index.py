@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Build and inspect the trigram index that ds-agent's grep tool uses.
+
+Commands:
+  python3 ds-index.py build            — create or incrementally update the index
+  python3 ds-index.py rebuild          — delete the index and build it from scratch
+  python3 ds-index.py stats            — files, trigrams and postings in the index
+  python3 ds-index.py query PATTERN    — candidate files for a regex, vs. a full walk
+
+Options:
+  --root DIR   index a different tree (default: the anavi project root)
+
+The index lives in ~/.cache/ds-agent/trigram-<hash of root>.db. Agents keep
+it current on their own; building it ahead of time just moves the
+first-grep cost out of the agent run.
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Import agent runner from same directory
+sys.path.insert(0, str(Path(__file__).parent))
+import ds_agent as da  # ds-agent.py imported as ds_agent
+
+
+def cmd_build(index, args):
+    start = time.time()
+    stats = index.update()
+    print(f"scanned {stats['scanned']} files, reindexed {stats['reindexed']}, "
+          f"removed {stats['removed']} in {time.time() - start:.2f}s")
+    cmd_stats(index, args)
+
+
+def cmd_rebuild(index, args):
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(index.db_path) + suffix).unlink(missing_ok=True)
+    cmd_build(da.TrigramIndex(index.root), args)
+
+
+def cmd_stats(index, args):
+    info = index.info()
+    print(f"root:      {info['root']}")
+    print(f"database:  {info['db']} ({info['db_bytes'] / 1e6:.1f} MB)")
+    print(f"files:     {info['files']} ({info['text']} indexed, {info['unindexed']} too large, "
+          f"{info['binary']} binary)")
+    print(f"trigrams:  {info['trigrams']}")
+    print(f"postings:  {info['postings']}")
+
+
+def cmd_query(index, args):
+    start = time.time()
+    candidates = index.candidates(args.pattern, index.root, args.file_glob)
+    elapsed = (time.time() - start) * 1000
+    if candidates is None:
+        print(f"index can't narrow {args.pattern!r} (no literal of 3+ characters); grep walks the tree")
+        return
+    matched = [p for p, _ in da.search(args.pattern, index.root, args.file_glob,
+                                       max_matches=10**9, files=candidates)]
+    print(f"{len(candidates)} candidate files in {elapsed:.1f}ms, {len(matched)} actually match")
+    for path in candidates[:args.limit]:
+        print(("  * " if path in matched else "    ") + da._display_path(path))
+    if len(candidates) > args.limit:
+        print(f"  ... {len(candidates) - args.limit} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ds-agent trigram index")
+    parser.add_argument("--root", default=str(da.PROJECT_ROOT), help="Tree to index (default: anavi/)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="Create or update the index").set_defaults(fn=cmd_build)
+    sub.add_parser("rebuild", help="Rebuild the index from scratch").set_defaults(fn=cmd_rebuild)
+    sub.add_parser("stats", help="Show index size").set_defaults(fn=cmd_stats)
+    p = sub.add_parser("query", help="Show candidate files for a pattern")
+    p.add_argument("pattern")
+    p.add_argument("--file-glob")
+    p.add_argument("--limit", type=int, default=40)
+    p.set_defaults(fn=cmd_query)
+    args = parser.parse_args()
+
+    root = Path(args.root).resolve()
+    index = da.TRIGRAM_INDEX if root == Path(da.PROJECT_ROOT).resolve() else da.TrigramIndex(root)
+    args.fn(index, args)
+
+
+if __name__ == "__main__":
+    main()
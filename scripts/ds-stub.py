@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DeepSeek chat completions API, for benchmarking ds-agent.
+
+Usage:
+  python3 ds-stub.py --tree /tmp/ds-bench-tree             # serve on a free port
+  python3 ds-stub.py --tree /tmp/t --port 8011 --latency 300 --tps 60 --scenario edit-storm
+
+  DEEPSEEK_API_URL=http://127.0.0.1:8011/v1/chat/completions DEEPSEEK_API_KEY=stub \\
+      python3 ds-agent.py "scenario: explore"
+
+The first line printed is "listening on <url>", so a parent process can
+start it with --port 0 and read the address back.
+
+Instead of a model, each conversation plays back a scripted sequence of
+tool calls against a synthetic TypeScript tree (written to --tree on
+start-up). The scenario comes from "scenario: NAME" in the task text, else
+--scenario:
+
+  explore      read-heavy: glob, grep, then batches of parallel read_file calls
+  edit-storm   write a scratch file, then many edit_file/multi_edit rounds on it
+  bash-flood   bash commands with long output (a 200k-line seq, a wall of tsc errors)
+  mixed        a bit of everything
+
+The server is stateless apart from counters: the turn is the number of
+assistant messages in the request, and a conversation is identified by
+its task, so any number of agents can share one stub.
+
+Latency: every response waits --latency ms (plus up to --jitter of that)
+before its first byte, then generates its completion at --tps tokens/s;
+streamed responses spread their chunks over that time. Usage reports
+prompt tokens at 4 chars/token and counts the previous turn's prompt of
+the same conversation as a prefix-cache hit, roughly as DeepSeek does.
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CHARS_PER_TOKEN = 4
+MODULES = 200                                     # files in the synthetic tree
+
+SCENARIOS = ("explore", "edit-storm", "bash-flood", "mixed")
+
+
+# ── Synthetic tree ────────────────────────────────────────────────────────────
+
+def module_path(root: Path, i: int) -> Path:
+    return root / "src" / f"feature{i % 10}" / f"module{i:03}.ts"
+
+
+def make_tree(root: Path, modules: int = MODULES):
+    """A small TypeScript project for the scenarios to read, grep and edit."""
+    for i in range(modules):
+        path = module_path(root, i)
+        if path.exists():
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = [f"import {{ helper{(i + 1) % modules} }} from './module{(i + 1) % modules:03}';", ""]
+        for j in range(40):
+            lines += [
+                f"export function handler{i}_{j}(input: string): number {{",
+                f"  // TODO: validate input for handler {j}",
+                f"  return input.length * {j} + helper{(i + 1) % modules}();",
+                "}",
+                "",
+            ]
+        lines.append(f"export const helper{i} = () => {i};")
+        path.write_text("\n".join(lines) + "\n")
+    (root / "scratch").mkdir(exist_ok=True)
+
+
+# ── Scenarios ─────────────────────────────────────────────────────────────────
+# Each returns the list of turns for one conversation: a turn is a list of
+# (tool name, args) calls, and the conversation ends with a text reply once
+# the turns run out.
+
+def explore(root: Path, seed: int) -> list:
+    first = seed % MODULES
+    turns = [
+        [("glob", {"pattern": "src/**/*.ts", "root": str(root)})],
+        [("grep", {"pattern": f"export function handler{first}_\\d+", "path": str(root / "src")}),
+         ("grep", {"pattern": "TODO: validate", "path": str(root / "src"), "file_glob": "*.ts"})],
+    ]
+    for batch in range(6):
+        turns.append([
+            ("read_file", {"path": str(module_path(root, (first + batch * 4 + k) % MODULES))})
+            for k in range(4)
+        ])
+    turns.append([("read_file", {"path": str(module_path(root, first)), "offset": 50, "limit": 40})])
+    return turns
+
+
+def edit_storm(root: Path, seed: int) -> list:
+    path = str(root / "scratch" / f"agent{seed}.ts")
+    lines = [f"export const value{j} = 0;" for j in range(60)]
+    turns = [[("write_file", {"path": path, "content": "\n".join(lines) + "\n"})]]
+    for rnd in range(8):
+        edits = [{"old_string": f"value{j} = 0;", "new_string": f"value{j} = {rnd + 1};"}
+                 for j in range(rnd * 6, rnd * 6 + 6)]
+        if rnd % 2:
+            turns.append([("multi_edit", {"path": path, "edits": edits})])
+        else:
+            turns.append([("edit_file", {"path": path, **edit}) for edit in edits])
+    turns.append([("read_file", {"path": path})])
+    return turns
+
+
+def bash_flood(root: Path, seed: int) -> list:
+    return [
+        [("bash", {"command": "seq 1 200000", "cwd": str(root)})],
+        [("bash", {"command": "for i in $(seq 1 3000); do "
+                              "echo \"src/feature$((i % 10))/module$((i % 200)).ts($i,5): "
+                              "error TS2322: Type 'string' is not assignable to type 'number'.\"; done",
+                   "cwd": str(root)})],
+        [("bash", {"command": f"cat src/feature{seed % 10}/*.ts", "cwd": str(root)}),
+         ("bash", {"command": "ls -laR src | head -n 400", "cwd": str(root)})],
+        [("bash", {"command": "grep -rn 'TODO' src | wc -l", "cwd": str(root)})],
+    ]
+
+
+def mixed(root: Path, seed: int) -> list:
+    e, s, b = explore(root, seed), edit_storm(root, seed), bash_flood(root, seed)
+    return [e[0], e[1], e[2], s[0], s[1], b[1], e[3], s[2], b[3], s[-1]]
+
+
+PLAYBOOKS = {"explore": explore, "edit-storm": edit_storm, "bash-flood": bash_flood, "mixed": mixed}
+
+
+# ── Server ────────────────────────────────────────────────────────────────────
+
+class Stub:
+    """Scenario playback and simulated timing, shared by all handler threads."""
+
+    def __init__(self, root: Path, scenario: str, latency: float, jitter: float, tps: float):
+        self.root = root
+        self.scenario = scenario
+        self.latency = latency
+        self.jitter = jitter
+        self.tps = tps
+        self.requests = 0
+        self.conversations = {}                   # task hash -> last prompt tokens
+        self._lock = threading.Lock()
+
+    def reply(self, request: dict) -> tuple:
+        """(assistant message, usage) for a chat completions request."""
+        messages = request["messages"]
+        task = next((m["content"] for m in messages if m["role"] == "user"), "")
+        conv = hashlib.sha1(task.encode()).hexdigest()
+        seed = int(conv[:8], 16)
+        scenario = self.scenario
+        for word in ("scenario:", "scenario="):
+            if word in task:
+                scenario = task.split(word, 1)[1].split()[0]
+        turns = PLAYBOOKS.get(scenario, PLAYBOOKS[self.scenario])(self.root, seed)
+        turn = sum(1 for m in messages if m["role"] == "assistant")
+
+        if turn < len(turns):
+            msg = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{turn}_{k}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(args)}}
+                for k, (name, args) in enumerate(turns[turn])
+            ]}
+        else:
+            msg = {"role": "assistant", "content": f"Done: {scenario} finished in {turn} turns. " * 20}
+
+        prompt = len(json.dumps(messages)) // CHARS_PER_TOKEN
+        with self._lock:
+            self.requests += 1
+            hit = min(self.conversations.get(conv, 0), prompt) // 64 * 64
+            self.conversations[conv] = prompt
+        usage = {
+            "prompt_tokens": prompt,
+            "completion_tokens": len(json.dumps(msg)) // CHARS_PER_TOKEN,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt - hit,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return msg, usage
+
+    def first_byte_delay(self) -> float:
+        return self.latency * (1 + random.uniform(0, self.jitter)) / 1000
+
+    def generation_time(self, usage: dict) -> float:
+        return usage["completion_tokens"] / self.tps if self.tps else 0.0
+
+
+def stream_events(msg: dict, usage: dict) -> list:
+    """The SSE payloads for msg, split into a few deltas like the real API."""
+    events = [{"choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]}]
+    content = msg.get("content") or ""
+    for i in range(0, len(content), 200):
+        events.append({"choices": [{"index": 0, "delta": {"content": content[i:i + 200]}}]})
+    for i, tc in enumerate(msg.get("tool_calls") or []):
+        args = tc["function"]["arguments"]
+        events.append({"choices": [{"index": 0, "delta": {"tool_calls": [
+            {"index": i, "id": tc["id"], "type": "function",
+             "function": {"name": tc["function"]["name"], "arguments": ""}}]}}]})
+        for j in range(0, len(args), 80):
+            events.append({"choices": [{"index": 0, "delta": {"tool_calls": [
+                {"index": i, "function": {"arguments": args[j:j + 80]}}]}}]})
+    finish = "tool_calls" if msg.get("tool_calls") else "stop"
+    events.append({"choices": [{"index": 0, "delta": {}, "finish_reason": finish}], "usage": usage})
+    return events
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True                # small SSE chunks would wait on delayed ACKs
+    stub: Stub = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"requests": self.stub.requests,
+                           "conversations": len(self.stub.conversations)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        msg, usage = self.stub.reply(request)
+        time.sleep(self.stub.first_byte_delay())
+        generation = self.stub.generation_time(usage)
+
+        if not request.get("stream"):
+            time.sleep(generation)
+            body = json.dumps({
+                "id": "stub", "object": "chat.completion", "model": request.get("model"),
+                "choices": [{"index": 0, "message": msg,
+                             "finish_reason": "tool_calls" if msg.get("tool_calls") else "stop"}],
+                "usage": usage,
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = stream_events(msg, usage)
+        pause = generation / len(events)
+        for event in events:
+            self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            if pause:
+                time.sleep(pause)
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted DeepSeek API stub for benchmarks")
+    parser.add_argument("--tree", type=Path, required=True, help="Where to write the synthetic project")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 = any free port")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed",
+                        help="Playback for tasks that don't name one (default: mixed)")
+    parser.add_argument("--latency", type=float, default=200.0, help="ms before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.25, help="up to this fraction of extra latency")
+    parser.add_argument("--tps", type=float, default=100.0, help="completion tokens per second (0 = instant)")
+    args = parser.parse_args()
+
+    root = args.tree.resolve()
+    make_tree(root)
+    Handler.stub = Stub(root, args.scenario, args.latency, args.jitter, args.tps)
+    ThreadingHTTPServer.request_queue_size = 1024
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    host, port = server.server_address[:2]
+    print(f"listening on http://{host}:{port}/v1/chat/completions", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
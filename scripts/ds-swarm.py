@@ -16,40 +16,492 @@ tasks.json format:
   OR a plain array of strings:
   ["Fix X in foo.ts", "Fix Y in bar.ts"]
 
+  OR an object with context shared by every agent:
+  {"context": "Briefing every agent needs...", "tasks": [...]}
+
+  Shared context is appended to the system prompt, byte-identical for all
+  agents, so DeepSeek serves it from the prefix cache after the first call.
+
+  Task objects may also set "priority" (higher runs first, default 0) and
+  "weight" (expected cost, e.g. turns; default 1).
+
 Results are written to /tmp/ds-swarm-<name>.txt
+
+Every agent's events (task started, each turn and its tokens and latency,
+tool calls and results, errors, and a "finished" record with the result)
+go to a JSONL log, --events (default /tmp/ds-swarm-events.jsonl), with a
+timestamp and the agent's name. The console shows a line per start and
+finish, plus turns/min, tokens/min and p50/p95 turn latency every
+--progress seconds; --live replaces that with a panel of running agents
+redrawn in place. --fail-fast (or --max-failures N) aborts the swarm on
+the first (Nth) failed task: queued tasks are skipped and running agents
+stop at their next turn, so a broken swarm doesn't burn the whole budget.
+An aborted swarm exits with status 1.
+
+At most --concurrency agents (default 16, 0 = all at once) run at a time;
+the rest wait in a queue. The queue hands out the highest priority first,
+heaviest first within a priority so long tasks don't end up as the tail,
+and file order after that, so equal tasks never overtake each other.
+Queued, running and done counts are printed as agents start and finish.
+
+Agents in one process share its caches: read_file output, file contents,
+grep output and glob matches are keyed by the versions of the files they
+came from, so a hot file is read once per version rather than once per
+agent, and any agent's edit (or a bash command) only invalidates what
+depended on the files it changed. Hit and miss counts are printed at the
+end.
+
+By default each running agent gets its own thread. --async runs them as
+coroutines on a single asyncio event loop instead, which scales to hundreds
+of agents.
+
+--processes N shards the running agents over N worker processes (each
+with its own threads or event loop, and its own GIL), so JSON, grep and
+file work on large swarms uses more than one core. This process stays the
+coordinator: workers pull tasks from its queue, draw on its rate limiter
+(so --rpm/--tpm still cap the whole swarm), typecheck with its tsserver
+and report results back to it. --concurrency is split evenly between the
+workers. The caches above are per process, though: each worker reads,
+greps and globs into its own, so a hot file is read once per worker and
+memory grows with N.
 """
 
 import sys
 import os
 import json
+import asyncio
 import threading
 import time
+import shutil
 import argparse
+import multiprocessing
+import queue as queue_module
+from collections import deque
+from multiprocessing.managers import BaseManager, DictProxy, ListProxy
 from pathlib import Path
 
 # Import agent runner from same directory
 sys.path.insert(0, str(Path(__file__).parent))
-from ds_agent import run_agent  # ds-agent.py imported as ds_agent
+from ds_agent import run_agent, run_agent_async, async_pool, cache_summaries, typechecker, POOL, RATE_LIMITER, Usage  # ds-agent.py imported as ds_agent
+
+
+class TaskQueue:
+    """The swarm's pending tasks, handed out by priority and weight.
+
+    Tasks are sorted once: highest priority, then highest weight, then
+    the earliest in the tasks file. Thread-safe; also keeps the
+    queued/running/done counts the swarm prints. cancel() drops whatever
+    hasn't started when the swarm aborts.
+    """
+
+    def __init__(self, tasks: list):
+        order = sorted(range(len(tasks)), key=lambda i: (-tasks[i].get("priority", 0),
+                                                         -tasks[i].get("weight", 1), i))
+        self.pending = deque(tasks[i] for i in order)
+        self.total = len(tasks)
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.aborted = 0
+        self.skipped = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def next(self):
+        """The next task to run, or None when the queue is empty."""
+        with self._lock:
+            if not self.pending:
+                return None
+            self.running += 1
+            return self.pending.popleft()
+
+    def finish(self, status: str):
+        with self._lock:
+            self.running -= 1
+            self.done += 1
+            self.failed += status == "error"
+            self.aborted += status == "aborted"
+
+    def cancel(self) -> list:
+        """Drop every task that hasn't started; returns their names."""
+        with self._lock:
+            names = [t["name"] for t in self.pending]
+            self.pending.clear()
+            self.skipped += len(names)
+            return names
+
+    def counts(self) -> str:
+        with self._lock:
+            notes = [f"{n} {what}" for n, what in
+                     ((self.failed, "failed"), (self.aborted, "aborted"), (self.skipped, "skipped")) if n]
+            return (f"queued {len(self.pending)} · running {self.running} · done {self.done}/{self.total}"
+                    + (f" ({', '.join(notes)})" if notes else ""))
+
+
+# ── Events ────────────────────────────────────────────────────────────────────
+
+EVENTS_FILE = Path("/tmp/ds-swarm-events.jsonl")
+LIVE_INTERVAL = 0.5                               # seconds between --live redraws
+
+
+class SwarmAborted(Exception):
+    """Stops a running agent at its next turn once the swarm is aborting."""
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
 
 
-def run_one(name: str, task: str, api_key: str, results: dict, lock: threading.Lock):
+class SwarmEvents:
+    """Every agent's progress events, gathered in the coordinating process.
+
+    Agents hand their AgentSession events (task, turn, usage, tool_call,
+    tool_result, turn_end, end, ...; see ds_agent's AgentSession._emit) to
+    record() along with their name, and the swarm adds a "finished" event
+    per task with its status and result. Each event is appended to the
+    JSONL log with a timestamp, feeds the throughput numbers, and shows
+    up as a console line or in the --live view. Once max_failures tasks
+    have failed the swarm aborts: the queue is cancelled and record()
+    returns False, which stops each running agent at its next turn.
+    """
+
+    def __init__(self, queue: TaskQueue, path: Path, live: bool = False, max_failures: int = 0):
+        self.queue = queue
+        self.path = path
+        self.live = live
+        self.max_failures = max_failures
+        self.failures = 0
+        self.aborted = None                       # why, once the swarm is aborting
+        self.turns = 0
+        self.tokens = 0
+        self.turn_ms = []
+        self.agents = {}                          # running agent -> {"turn", "tool", "start"}
+        self.stopped = threading.Event()
+        self._lines = []                          # console lines the next --live redraw prints
+        self._drawn = 0                           # height of the --live panel on screen
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def record(self, agent: str, event: dict) -> bool:
+        """Log one of agent's events; returns False once the swarm is aborting."""
+        kind = event["event"]
+        if kind == "tool_call":
+            event = {**event, "args": json.dumps(event["args"])[:200]}
+        abort = None
+        with self._lock:
+            self._file.write(json.dumps({"ts": round(time.time(), 3), "agent": agent, **event}) + "\n")
+            self._file.flush()
+            now = time.monotonic()
+            line = None
+            if kind == "task":
+                self.agents[agent] = {"turn": 0, "tool": "", "start": now}
+                line = f"[{agent}] starting...  [{self.queue.counts()}]"
+            elif kind == "turn" and agent in self.agents:
+                self.agents[agent].update(turn=event["turn"], tool="api")
+            elif kind == "tool_call" and agent in self.agents:
+                self.agents[agent]["tool"] = event["name"]
+            elif kind == "usage":
+                self.tokens += event["prompt_tokens"] + event["completion_tokens"]
+            elif kind == "turn_end":
+                self.turns += 1
+                self.turn_ms.append(event["ms"])
+            elif kind == "finished":
+                self.agents.pop(agent, None)
+                if event["status"] == "ok":
+                    line = f"[{agent}] done in {event['elapsed']:.1f}s → {event['file']}  [{self.queue.counts()}]"
+                elif event["status"] == "aborted":
+                    line = f"[{agent}] stopped after {event['elapsed']:.1f}s  [{self.queue.counts()}]"
+                else:
+                    line = (f"[{agent}] FAILED in {event['elapsed']:.1f}s: {event['error']}  "
+                            f"[{self.queue.counts()}]")
+                if event["status"] == "error":
+                    self.failures += 1
+                    if self.max_failures and self.failures >= self.max_failures and not self.aborted:
+                        abort = self.aborted = f"{self.failures} failed"
+        if line:
+            self.say(line)
+        if abort:
+            self.abort(abort)
+        return not self.aborted
+
+    def abort(self, reason: str):
+        skipped = self.queue.cancel()
+        with self._lock:
+            self._file.write(json.dumps({"ts": round(time.time(), 3), "event": "abort", "reason": reason,
+                                         "skipped": skipped}) + "\n")
+            self._file.flush()
+            running = len(self.agents)
+        self.say(f"[swarm] aborting ({reason}): skipped {len(skipped)} queued tasks, "
+                 f"stopping {running} running agents at their next turn")
+
+    def say(self, line: str):
+        if not self.live:
+            print(line, flush=True)
+            return
+        with self._lock:
+            self._lines.append(line)
+
+    def throughput(self) -> str:
+        minutes = (time.monotonic() - self.queue.start) / 60
+        return (f"{self.turns / minutes:.0f} turns/min · {self.tokens / minutes / 1000:.1f}k tokens/min · "
+                f"turn p50 {percentile(self.turn_ms, 0.5) / 1000:.1f}s, p95 {percentile(self.turn_ms, 0.95) / 1000:.1f}s")
+
+    def status(self) -> list:
+        return [f"[swarm] {self.queue.counts()} after {time.monotonic() - self.queue.start:.0f}s",
+                f"        {self.throughput()}"]
+
+    def draw(self):
+        """Reprint the --live panel below any lines said since the last draw."""
+        width = shutil.get_terminal_size().columns - 1
+        now = time.monotonic()
+        with self._lock:
+            lines, self._lines = self._lines, []
+            panel = self.status()
+            rows = max(shutil.get_terminal_size().lines - 5, 1)
+            agents = sorted(self.agents.items(), key=lambda kv: kv[1]["start"])
+            for name, a in agents[:rows]:
+                panel.append(f"  {name[:32]:<32} turn {a['turn']:>2}  {a['tool'][:16]:<16} {now - a['start']:6.0f}s")
+            if len(agents) > rows:
+                panel.append(f"  ... and {len(agents) - rows} more")
+            clear = f"\x1b[{self._drawn}F\x1b[J" if self._drawn else ""
+            self._drawn = len(panel)
+        sys.stdout.write(clear + "".join(f"{line}\n" for line in lines + [p[:width] for p in panel]))
+        sys.stdout.flush()
+
+    def watch(self, every: float):
+        """Redraw the --live panel, or print a status line every `every` seconds, until close()."""
+        if self.live:
+            while not self.stopped.wait(LIVE_INTERVAL):
+                self.draw()
+            self.draw()
+        elif every:
+            while not self.stopped.wait(every):
+                print("\n".join(self.status()), flush=True)
+
+    def close(self):
+        self.stopped.set()
+        with self._lock:
+            self._file.close()
+
+
+def agent_events(events: SwarmEvents, name: str):
+    """on_event for one agent: forwards to the swarm and stops the agent at
+    the start of its next turn once the swarm is aborting."""
+    def on_event(event: dict):
+        if event["event"] == "content":
+            return                                # streamed text deltas stay out of the log
+        if not events.record(name, event) and event["event"] == "turn":
+            raise SwarmAborted("swarm aborted")
+    return on_event
+
+
+def record_ok(name: str, result: str, elapsed: float, usage: Usage, results: dict, lock: threading.Lock,
+              queue: TaskQueue, events: SwarmEvents):
+    if result.startswith("ERROR:"):               # ran out of turns: a failure as far as the swarm goes
+        record_error(name, RuntimeError(result[len("ERROR:"):].strip()), elapsed, usage, results, lock,
+                     queue, events)
+        return
+    out_file = Path(f"/tmp/ds-swarm-{name}.txt")
+    out_file.write_text(f"=== {name} ({elapsed:.1f}s) ===\n\n{result}\n")
+    with lock:
+        results[name] = {"status": "ok", "elapsed": elapsed, "file": str(out_file), "usage": usage}
+    queue.finish("ok")
+    events.record(name, {"event": "finished", "status": "ok", "elapsed": round(elapsed, 1),
+                         "file": str(out_file), "result": result, "usage": usage.as_dict()})
+
+
+def record_error(name: str, e: Exception, elapsed: float, usage: Usage, results: dict, lock: threading.Lock,
+                 queue: TaskQueue, events: SwarmEvents):
+    status = "aborted" if isinstance(e, SwarmAborted) else "error"
     out_file = Path(f"/tmp/ds-swarm-{name}.txt")
+    msg = f"ERROR: {e}"
+    out_file.write_text(f"=== {name} FAILED ({elapsed:.1f}s) ===\n\n{msg}\n")
+    with lock:
+        results[name] = {"status": status, "elapsed": elapsed, "error": str(e), "file": str(out_file),
+                         "usage": usage}
+    queue.finish(status)
+    events.record(name, {"event": "finished", "status": status, "elapsed": round(elapsed, 1),
+                         "file": str(out_file), "error": str(e), "usage": usage.as_dict()})
+
+
+def run_one(name: str, task: str, api_key: str, context: str, results: dict, lock: threading.Lock,
+            queue: TaskQueue, events: SwarmEvents):
     start = time.time()
+    usage = Usage()
     try:
-        print(f"[{name}] starting...", flush=True)
-        result = run_agent(task, api_key, verbose=False)
-        elapsed = time.time() - start
-        out_file.write_text(f"=== {name} ({elapsed:.1f}s) ===\n\n{result}\n")
-        with lock:
-            results[name] = {"status": "ok", "elapsed": elapsed, "file": str(out_file)}
-        print(f"[{name}] done in {elapsed:.1f}s → {out_file}", flush=True)
+        result = run_agent(task, api_key, verbose=False, context=context, usage=usage, name=name,
+                           on_event=agent_events(events, name))
+        record_ok(name, result, time.time() - start, usage, results, lock, queue, events)
     except Exception as e:
-        elapsed = time.time() - start
-        msg = f"ERROR: {e}"
-        out_file.write_text(f"=== {name} FAILED ({elapsed:.1f}s) ===\n\n{msg}\n")
-        with lock:
-            results[name] = {"status": "error", "error": str(e), "file": str(out_file)}
-        print(f"[{name}] FAILED in {elapsed:.1f}s: {e}", flush=True)
+        record_error(name, e, time.time() - start, usage, results, lock, queue, events)
+
+
+async def run_one_async(name: str, task: str, api_key: str, context: str, results: dict, lock: threading.Lock,
+                        queue: TaskQueue, events: SwarmEvents):
+    start = time.time()
+    usage = Usage()
+    # queue, results and events may be manager proxies (--processes): their
+    # calls block, so they run on a thread rather than on the event loop
+    try:
+        result = await run_agent_async(task, api_key, verbose=False, context=context, usage=usage, name=name,
+                                       on_event=agent_events(events, name))
+        await asyncio.to_thread(record_ok, name, result, time.time() - start, usage, results, lock,
+                                queue, events)
+    except Exception as e:
+        await asyncio.to_thread(record_error, name, e, time.time() - start, usage, results, lock,
+                                queue, events)
+
+
+def worker(queue: TaskQueue, api_key: str, context: str, results: dict, lock: threading.Lock,
+           events: SwarmEvents):
+    while (t := queue.next()) is not None:
+        run_one(t["name"], t["task"], api_key, context, results, lock, queue, events)
+
+
+async def worker_async(queue: TaskQueue, api_key: str, context: str, results: dict, lock: threading.Lock,
+                       events: SwarmEvents):
+    while (t := await asyncio.to_thread(queue.next)) is not None:
+        await run_one_async(t["name"], t["task"], api_key, context, results, lock, queue, events)
+
+
+def run_all(queue: TaskQueue, workers: int, api_key: str, context: str, results: dict, lock: threading.Lock,
+            events: SwarmEvents):
+    threads = [
+        threading.Thread(target=worker, args=(queue, api_key, context, results, lock, events), daemon=True)
+        for _ in range(workers)
+    ]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return POOL.summary()
+
+
+async def run_all_async(queue: TaskQueue, workers: int, api_key: str, context: str, results: dict,
+                        lock: threading.Lock, events: SwarmEvents) -> str:
+    """Run the queue on this event loop; returns the loop's pool summary."""
+    await asyncio.gather(*(
+        worker_async(queue, api_key, context, results, lock, events) for _ in range(workers)
+    ))
+    return async_pool().summary()
+
+
+# ── Worker processes (--processes) ────────────────────────────────────────────
+
+# ds_agent settings a worker process copies from the coordinator
+SHARED_SETTINGS = ("API_URL", "MODEL", "STREAM", "PERSISTENT_SHELL", "CONTEXT_BUDGET",
+                   "RESPONSE_CACHE", "RESPONSE_CACHE_DIR", "TRACE_FILE")
+
+
+class EventForwarder:
+    """SwarmEvents.record for async agents in a worker process.
+
+    Events are queued and sent on to the coordinator's SwarmEvents from a
+    thread, in order, so the event loop never waits on the manager.
+    record() answers from the latest reply, so an abort reaches an agent
+    an event or two late.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.live = True                          # False once the swarm is aborting
+        self._queue = queue_module.Queue()
+        self._thread = threading.Thread(target=self._forward, daemon=True)
+        self._thread.start()
+
+    def record(self, agent: str, event: dict) -> bool:
+        self._queue.put((agent, event))
+        return self.live
+
+    def _forward(self):
+        while (item := self._queue.get()) is not None:
+            self.live = self.events.record(*item)
+
+    def close(self):
+        """Wait until every queued event has been sent."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class SwarmManager(BaseManager):
+    """Serves the coordinator's queue, results, events, rate limiter and
+    typechecker to worker processes."""
+
+
+SwarmManager.register("queue")
+SwarmManager.register("events")
+SwarmManager.register("results", proxytype=DictProxy)
+SwarmManager.register("reports", proxytype=ListProxy)
+SwarmManager.register("limiter")
+SwarmManager.register("typechecker")
+
+
+def serve_shared(queue: TaskQueue, results: dict, events: SwarmEvents, reports: list, limiter) -> tuple:
+    """Start serving the swarm's shared state on a thread; returns (address, authkey)."""
+    SwarmManager.register("queue", callable=lambda: queue)
+    SwarmManager.register("events", callable=lambda: events)
+    SwarmManager.register("results", callable=lambda: results, proxytype=DictProxy)
+    SwarmManager.register("reports", callable=lambda: reports, proxytype=ListProxy)
+    SwarmManager.register("limiter", callable=lambda: limiter)
+    SwarmManager.register("typechecker", callable=lambda root: typechecker(Path(root)))
+    authkey = os.urandom(32)
+    server = SwarmManager(authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.address, authkey
+
+
+def process_main(address, authkey: bytes, settings: dict, workers: int, use_async: bool,
+                 api_key: str, context: str):
+    """Entry point of one worker process: run queued tasks until the queue is empty."""
+    import ds_agent as da
+    for name, value in settings.items():
+        setattr(da, name, value)
+    manager = SwarmManager(address=address, authkey=authkey)
+    manager.connect()
+    queue, results, events = manager.queue(), manager.results(), manager.events()
+    da.RATE_LIMITER = da.RemoteRateLimiter(manager.limiter())
+    # typecheck in the coordinator's tsserver, which it has already warmed
+    da.TYPECHECK_SERVER = manager.typechecker
+    da.TYPECHECK_WARM = False
+    lock = threading.Lock()
+    if use_async:
+        forwarder = EventForwarder(events)
+        try:
+            pool_summary = asyncio.run(run_all_async(queue, workers, api_key, context, results, lock, forwarder))
+        finally:
+            forwarder.close()
+    else:
+        pool_summary = run_all(queue, workers, api_key, context, results, lock, events)
+    manager.reports().append("\n".join([f"[process {os.getpid()}] {pool_summary}", *cache_summaries()]))
+
+
+def run_processes(queue: TaskQueue, processes: int, workers: int, use_async: bool, api_key: str, context: str,
+                  results: dict, events: SwarmEvents) -> str:
+    """Run the queue on worker processes; returns their pool and cache summaries."""
+    import ds_agent as da
+    reports = []
+    address, authkey = serve_shared(queue, results, events, reports, da.RATE_LIMITER)
+    settings = {name: getattr(da, name) for name in SHARED_SETTINGS}
+    if da.TYPECHECK_WARM:
+        da.warm_typechecker()                     # the one tsserver every worker checks with
+    per_process = -(-workers // processes)
+    # spawn, not fork: this process already runs the server and progress threads
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=process_main, name=f"ds-swarm-{i + 1}", daemon=True,
+                    args=(address, authkey, settings, per_process, use_async, api_key, context))
+        for i in range(processes)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+        if proc.exitcode:
+            events.say(f"[swarm] worker process {proc.pid} exited with status {proc.exitcode}")
+    return "\n".join(reports)
 
 
 def main():
@@ -58,6 +510,33 @@ def main():
     parser.add_argument("--tasks", "-t", help="Inline JSON tasks array")
     parser.add_argument("--key", "-k", help="DeepSeek API key")
     parser.add_argument("--model", "-m", default="deepseek-chat")
+    parser.add_argument("--stream", "-s", action="store_true", help="Stream responses (early tool dispatch)")
+    parser.add_argument("--persistent-shell", action="store_true",
+                        help="Give each agent one long-lived bash (cwd and env persist)")
+    parser.add_argument("--context-budget", type=int, default=None,
+                        help="Prompt tokens per agent before old tool results are compacted (0 = never)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run all agents on one asyncio event loop instead of one thread each")
+    parser.add_argument("--processes", "-P", type=int, default=0,
+                        help="Spread agents over this many worker processes, each with its own file and "
+                             "search caches (default: 0, run in this one)")
+    parser.add_argument("--concurrency", "-j", type=int, default=16,
+                        help="Agents running at once, 0 = every task at once (default: 16)")
+    parser.add_argument("--progress", type=float, default=15.0,
+                        help="Print counts and throughput this often, in seconds (0 = only on changes)")
+    parser.add_argument("--live", action="store_true",
+                        help="Keep a live panel of running agents and throughput at the bottom of the terminal")
+    parser.add_argument("--events", type=Path, default=EVENTS_FILE,
+                        help=f"Write every agent's events here as JSON lines (default: {EVENTS_FILE})")
+    parser.add_argument("--fail-fast", action="store_true", help="Abort the swarm on the first failed task")
+    parser.add_argument("--max-failures", type=int, default=0,
+                        help="Abort the swarm once this many tasks have failed (default: 0, never)")
+    parser.add_argument("--rpm", type=int, default=None, help="Cap API requests per minute across the swarm")
+    parser.add_argument("--tpm", type=int, default=None, help="Cap API tokens per minute across the swarm")
+    parser.add_argument("--response-cache", choices=["off", "record", "replay", "replay-or-record"], default=None,
+                        help="Record API responses to disk or replay a recorded run offline")
+    parser.add_argument("--response-cache-dir", type=Path, default=None, help="Where recorded responses live")
+    parser.add_argument("--trace", metavar="FILE", help="Append every agent's per-turn records to FILE")
     args = parser.parse_args()
 
     # Resolve API key
@@ -73,6 +552,20 @@ def main():
     # Set model
     import ds_agent as da
     da.MODEL = args.model
+    da.STREAM = args.stream
+    da.PERSISTENT_SHELL = args.persistent_shell
+    if args.context_budget is not None:
+        da.CONTEXT_BUDGET = args.context_budget
+    if args.rpm is not None:
+        da.RATE_RPM = args.rpm
+    if args.tpm is not None:
+        da.RATE_TPM = args.tpm
+    if args.response_cache is not None:
+        da.RESPONSE_CACHE = args.response_cache
+    if args.response_cache_dir is not None:
+        da.RESPONSE_CACHE_DIR = args.response_cache_dir
+    if args.trace:
+        da.TRACE_FILE = args.trace
 
     # Load tasks
     raw = None
@@ -85,6 +578,10 @@ def main():
         sys.exit(1)
 
     # Normalize to list of {name, task}
+    context = None
+    if isinstance(raw, dict):
+        context = raw.get("context")
+        raw = raw["tasks"]
     tasks = []
     for i, item in enumerate(raw):
         if isinstance(item, str):
@@ -92,31 +589,58 @@ def main():
         else:
             tasks.append(item)
 
-    print(f"\nDispatching {len(tasks)} agents in parallel...\n")
+    workers = min(args.concurrency or len(tasks), len(tasks))
+    processes = min(args.processes, workers)
+    print(f"\nDispatching {len(tasks)} agents, {workers} at a time"
+          + (f" over {processes} processes" if processes else "") + "...\n")
 
     results = {}
     lock = threading.Lock()
-    threads = []
+    queue = TaskQueue(tasks)
+    events = SwarmEvents(queue, args.events, live=args.live and sys.stdout.isatty(),
+                         max_failures=1 if args.fail_fast else args.max_failures)
+    watcher = threading.Thread(target=events.watch, args=(args.progress,), daemon=True)
+    watcher.start()
 
+    if processes:
+        pool_summary = run_processes(queue, processes, workers, args.use_async, api_key, context, results, events)
+    elif args.use_async:
+        pool_summary = asyncio.run(run_all_async(queue, workers, api_key, context, results, lock, events))
+    else:
+        pool_summary = run_all(queue, workers, api_key, context, results, lock, events)
+    # tasks skipped by an abort, or taken by a worker process that died, never reported back
     for t in tasks:
-        th = threading.Thread(
-            target=run_one,
-            args=(t["name"], t["task"], api_key, results, lock),
-            daemon=True,
-        )
-        threads.append(th)
-        th.start()
-
-    for th in threads:
-        th.join()
+        if t["name"] not in results:
+            status, error = (("skipped", "swarm aborted") if events.aborted
+                             else ("error", "worker process exited before finishing"))
+            results[t["name"]] = {"status": status, "error": error, "file": "-", "usage": Usage()}
+    events.close()
+    watcher.join()
 
     print("\n" + "="*60)
-    print("SWARM COMPLETE")
+    print(f"SWARM ABORTED ({events.aborted})" if events.aborted else "SWARM COMPLETE")
     print("="*60)
+    total = Usage()
     for name, r in results.items():
-        status = "✓" if r["status"] == "ok" else "✗"
-        print(f"  {status} {name}: {r.get('elapsed', 0):.1f}s → {r['file']}")
+        status = {"ok": "✓", "skipped": "-"}.get(r["status"], "✗")
+        print(f"  {status} {name}: {r.get('elapsed', 0):.1f}s → {r['file']}"
+              + (f"  ({r['status']}: {r['error'][:100]})" if r["status"] != "ok" else ""))
+        print(f"      {r['usage'].summary()}")
+        total.merge(r["usage"])
+    print()
+    print(f"swarm usage: {total.summary()}")
+    print(f"throughput: {events.throughput()}")
+    print(f"events: {args.events}")
     print()
+    print(pool_summary)
+    print(f"rate limiter: {RATE_LIMITER.summary()}")
+    if not processes:
+        print("\n".join(cache_summaries()))
+    if da.RESPONSE_CACHE != "off":
+        print(f"response cache: {da.response_cache().summary()}")
+    print()
+    if events.aborted:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Summarize the per-turn traces that ds-agent writes with --trace.
+
+Usage:
+  python3 ds-agent.py --trace /tmp/run.jsonl "Fix X"
+  python3 ds-swarm.py tasks.json --trace /tmp/swarm.jsonl
+
+  python3 ds-trace.py summary /tmp/swarm.jsonl        # where time and tokens went
+  python3 ds-trace.py summary /tmp/*.jsonl --top 20   # several files at once
+  python3 ds-trace.py turns /tmp/run.jsonl            # one line per turn
+  python3 ds-trace.py turns /tmp/swarm.jsonl --agent fix-funnel
+
+summary: splits the summed turn time into request serialization, waiting
+(rate limiting and retry backoff), the API call itself (time to first
+byte, then the rest of the transfer), tools and the agent's own
+bookkeeping; then token totals with the prefix-cache hit rate, a per-tool
+table sorted by total time, history growth, and the slowest turns.
+
+Turn time is wall time per agent, so in a swarm the totals add up to more
+than the elapsed time.
+"""
+
+import json
+import argparse
+import statistics
+from pathlib import Path
+
+
+def load(paths: list) -> tuple:
+    """(turn records, run records) from JSONL trace files."""
+    turns, runs = [], []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue                      # a line cut short by a crash
+                if record.get("type") == "turn":
+                    turns.append(record)
+                elif record.get("type") == "run":
+                    runs.append(record)
+    return turns, runs
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+
+def _label(turn: dict) -> str:
+    return f"{turn.get('agent') or turn['run']}#{turn['turn']}"
+
+
+def _api(turn: dict) -> dict:
+    return turn.get("api") or {}
+
+
+def _share(part: float, total: float) -> str:
+    return f"{part / 1000:9.1f}s  {part / total:6.1%}" if total else f"{part / 1000:9.1f}s"
+
+
+def cmd_summary(args):
+    turns, runs = load(args.files)
+    if not turns:
+        print("no turn records")
+        return
+
+    statuses = {}
+    for r in runs:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    agents = {t["run"] for t in turns}
+    print(f"{len(agents)} runs, {len(turns)} turns"
+          + (f"  ({', '.join(f'{n} {s}' for s, n in sorted(statuses.items()))})" if statuses else ""))
+    if runs:
+        print(f"run wall time: {sum(r['ms'] for r in runs) / 1000:.1f}s total, "
+              f"{max(r['ms'] for r in runs) / 1000:.1f}s longest")
+
+    # Time
+    total = sum(t["turn_ms"] for t in turns)
+    serialize = sum(_api(t).get("serialize_ms", 0) for t in turns)
+    wait = sum(_api(t).get("wait_ms", 0) for t in turns)
+    network = sum(_api(t).get("network_ms", 0) for t in turns)
+    ttfb = sum(_api(t).get("ttfb_ms") or 0 for t in turns)
+    tools = sum(t["tools_ms"] for t in turns)
+    other = total - serialize - wait - network - tools
+    replayed = sum(1 for t in turns if _api(t).get("replayed"))
+    retries = sum(max(_api(t).get("attempts", 1) - 1, 0) for t in turns)
+    print(f"\ntime ({total / 1000:.1f}s across turns)")
+    print(f"  serialize request   {_share(serialize, total)}")
+    print(f"  rate limit / retry  {_share(wait, total)}   ({retries} retries)")
+    print(f"  API to first byte   {_share(ttfb, total)}")
+    print(f"  API rest of body    {_share(network - ttfb, total)}")
+    print(f"  tools               {_share(tools, total)}")
+    print(f"  agent loop          {_share(other, total)}"
+          + (f"   ({replayed} turns replayed from the response cache)" if replayed else ""))
+    ttfbs = [_api(t)["ttfb_ms"] for t in turns if _api(t).get("ttfb_ms") is not None]
+    if ttfbs:
+        print(f"  first byte: p50 {percentile(ttfbs, 0.5):.0f}ms, p95 {percentile(ttfbs, 0.95):.0f}ms, "
+              f"max {max(ttfbs):.0f}ms")
+
+    # Tokens
+    tok = {k: sum(t["tokens"][k] for t in turns if t.get("tokens")) for k in
+           ("prompt", "completion", "cache_hit", "cache_miss")}
+    cached = tok["cache_hit"] + tok["cache_miss"]
+    print(f"\ntokens: {tok['prompt'] / 1000:.1f}k prompt "
+          f"({tok['cache_hit'] / cached if cached else 0:.0%} prefix-cache hit), "
+          f"{tok['completion'] / 1000:.1f}k completion")
+
+    # Tools
+    by_tool = {}
+    for t in turns:
+        for call in t["tools"]:
+            by_tool.setdefault(call["name"], []).append(call)
+    if by_tool:
+        print(f"\n{'tool':<16} {'calls':>6} {'total':>9} {'p50':>8} {'p95':>8} {'max':>8} "
+              f"{'args':>8} {'result':>9}")
+        for name, calls in sorted(by_tool.items(), key=lambda kv: -sum(c["ms"] for c in kv[1])):
+            ms = [c["ms"] for c in calls]
+            print(f"{name:<16} {len(calls):>6} {sum(ms) / 1000:>8.1f}s {percentile(ms, 0.5):>6.0f}ms "
+                  f"{percentile(ms, 0.95):>6.0f}ms {max(ms):>6.0f}ms "
+                  f"{statistics.mean(c['args_bytes'] for c in calls):>7.0f}B "
+                  f"{statistics.mean(c['result_bytes'] for c in calls):>8.0f}B")
+
+    # History
+    sizes = [_api(t)["request_bytes"] for t in turns if _api(t).get("request_bytes")]
+    contexts = [t["history"]["context_tokens"] for t in turns]
+    print(f"\nhistory: up to {max(t['history']['messages'] for t in turns)} messages, "
+          f"~{max(contexts) / 1000:.1f}k tokens"
+          + (f", requests {statistics.mean(sizes) / 1000:.0f} KB avg / {max(sizes) / 1000:.0f} KB max"
+             if sizes else "")
+          + f", {sum(t['compacted'] for t in turns)} tool results compacted")
+
+    # Slowest turns
+    print("\nslowest turns")
+    for t in sorted(turns, key=lambda t: -t["turn_ms"])[:args.top]:
+        api = _api(t)
+        names = ", ".join(c["name"] for c in t["tools"]) or "-"
+        print(f"  {_label(t):<32} {t['turn_ms'] / 1000:6.1f}s  "
+              f"api {api.get('total_ms', 0) / 1000:5.1f}s  tools {t['tools_ms'] / 1000:5.1f}s  [{names[:60]}]")
+
+
+def cmd_turns(args):
+    turns, runs = load(args.files)
+    if args.agent:
+        turns = [t for t in turns if args.agent in (t.get("agent"), t["run"])]
+    print(f"{'turn':<32} {'total':>7} {'wait':>7} {'ttfb':>7} {'api':>7} {'tools':>7} "
+          f"{'prompt':>7} {'hit':>5} {'out':>6}  tools")
+    for t in turns:
+        api, tok = _api(t), t.get("tokens") or {}
+        cached = tok.get("cache_hit", 0) + tok.get("cache_miss", 0)
+        print(f"{_label(t):<32} {t['turn_ms']:>5.0f}ms {api.get('wait_ms', 0):>5.0f}ms "
+              f"{api.get('ttfb_ms') or 0:>5.0f}ms {api.get('total_ms', 0):>5.0f}ms "
+              f"{t['tools_ms']:>5.0f}ms {tok.get('prompt', 0):>7} "
+              f"{tok.get('cache_hit', 0) / cached if cached else 0:>5.0%} {tok.get('completion', 0):>6}  "
+              + ", ".join(f"{c['name']} {c['ms']:.0f}ms" for c in t["tools"]))
+    for r in runs:
+        if not args.agent or args.agent in (r.get("agent"), r["run"]):
+            print(f"run {r.get('agent') or r['run']}: {r['status']} after {r['turns']} turns, "
+                  f"{r['ms'] / 1000:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ds-agent trace summaries")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summary", help="Where time and tokens went across a run or swarm")
+    p.add_argument("files", nargs="+", type=Path)
+    p.add_argument("--top", type=int, default=10, help="Slowest turns to list")
+    p.set_defaults(fn=cmd_summary)
+    p = sub.add_parser("turns", help="One line per turn")
+    p.add_argument("files", nargs="+", type=Path)
+    p.add_argument("--agent", help="Only this agent name or run id")
+    p.set_defaults(fn=cmd_turns)
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()